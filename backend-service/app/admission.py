@@ -0,0 +1,413 @@
+"""
+File d'admission Perplexity - concurrence par modèle, priorités et limites de débit
+
+Le chat, les rapports demandés par un utilisateur et les veilles du scheduler
+partagent le même quota Perplexity. Chaque modèle a sa file: un nombre maximal
+d'appels simultanés et un budget de tokens par minute. Quand la file est pleine,
+les appels attendent par ordre de priorité (chat > rapport interactif > veille
+planifiée), puis d'arrivée.
+
+Un 429 suspend les admissions du modèle pendant la durée Retry-After annoncée
+par l'API. Les 429, les 5xx, les erreurs de connexion et les timeouts sont
+relancés ici avec backoff exponentiel (le SDK OpenAI est configuré sans retry
+propre, voir perplexity_client); pendant l'attente, l'appel rend sa place dans
+la file et la redemande avant de repartir.
+"""
+
+import asyncio
+import heapq
+import itertools
+import os
+import random
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from enum import IntEnum
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, TypeVar
+
+import httpx
+from loguru import logger
+
+from app import metrics
+
+try:
+    from openai import APIConnectionError  # APITimeoutError en hérite
+except ImportError:
+    APIConnectionError = None
+
+T = TypeVar("T")
+
+
+class Priority(IntEnum):
+    """Classes de priorité (la plus petite valeur passe en premier)"""
+    CHAT = 0
+    INTERACTIVE = 1
+    SCHEDULED = 2
+
+
+def _parse_model_limits(raw: str, defaults: Dict[str, int]) -> Dict[str, int]:
+    """Lit "sonar=10,sonar-pro=4" par-dessus les valeurs par défaut"""
+    limits = dict(defaults)
+    for item in raw.split(","):
+        if "=" not in item:
+            continue
+        model, value = item.split("=", 1)
+        try:
+            limits[model.strip()] = int(value)
+        except ValueError:
+            logger.warning(f"Invalid Perplexity limit ignored: {item}")
+    return limits
+
+
+# Appels simultanés par modèle ("*" = modèle non listé)
+MODEL_CONCURRENCY = _parse_model_limits(
+    os.getenv("PERPLEXITY_CONCURRENCY", ""),
+    {"sonar": 10, "sonar-pro": 4, "sonar-reasoning-pro": 2, "*": 4},
+)
+# Budget de tokens (entrée + sortie) par minute et par modèle
+MODEL_TOKENS_PER_MINUTE = _parse_model_limits(
+    os.getenv("PERPLEXITY_TOKENS_PER_MINUTE", ""),
+    {"sonar": 400000, "sonar-pro": 200000, "sonar-reasoning-pro": 100000, "*": 200000},
+)
+
+# Attente maximale dans la file avant abandon (secondes)
+QUEUE_TIMEOUTS = {
+    Priority.CHAT: float(os.getenv("PERPLEXITY_QUEUE_TIMEOUT_CHAT", "30")),
+    Priority.INTERACTIVE: float(os.getenv("PERPLEXITY_QUEUE_TIMEOUT_INTERACTIVE", "300")),
+    Priority.SCHEDULED: float(os.getenv("PERPLEXITY_QUEUE_TIMEOUT_SCHEDULED", "1800")),
+}
+
+# Relance sur 429, 5xx, erreur de connexion ou timeout
+PERPLEXITY_MAX_RETRIES = int(os.getenv("PERPLEXITY_MAX_RETRIES", "3"))
+PERPLEXITY_BACKOFF_BASE = float(os.getenv("PERPLEXITY_BACKOFF_BASE", "2"))
+PERPLEXITY_BACKOFF_MAX = float(os.getenv("PERPLEXITY_BACKOFF_MAX", "60"))
+
+CHARS_PER_TOKEN = 4
+
+
+class AdmissionTimeout(Exception):
+    """L'appel n'a pas obtenu de place dans la file à temps"""
+
+
+class ModelQueue:
+    """File d'un modèle: places de concurrence + seau de tokens"""
+
+    def __init__(self, model: str, max_concurrency: int, tokens_per_minute: int):
+        self.model = model
+        self.max_concurrency = max(1, max_concurrency)
+        self.tokens_per_minute = max(1, tokens_per_minute)
+        self.active = 0
+        self.queued = 0
+        self._tokens = float(self.tokens_per_minute)
+        self._refilled_at = time.monotonic()
+        self._paused_until = 0.0
+        self._waiters: List[tuple] = []  # tas (priorité, ordre d'arrivée, future, coût)
+        self._order = itertools.count()
+        self._wakeup: Optional[asyncio.TimerHandle] = None
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(
+            float(self.tokens_per_minute),
+            self._tokens + (now - self._refilled_at) * self.tokens_per_minute / 60
+        )
+        self._refilled_at = now
+
+    def _admission_delay(self, cost: int) -> Optional[float]:
+        """0 si l'appel peut partir, délai avant de réessayer, None si toutes les places sont prises"""
+        if self.active >= self.max_concurrency:
+            return None
+        now = time.monotonic()
+        if now < self._paused_until:
+            return self._paused_until - now
+        self._refill()
+        if self._tokens >= cost:
+            return 0.0
+        return (cost - self._tokens) * 60 / self.tokens_per_minute
+
+    def _admit(self, cost: int) -> None:
+        self.active += 1
+        self._tokens -= cost
+
+    def _publish(self) -> None:
+        metrics.set_gauge(f"perplexity_queue_depth_{self.model}", self.queued)
+        metrics.set_gauge(f"perplexity_active_{self.model}", self.active)
+
+    def _dispatch(self) -> None:
+        """Admet les appels en tête de file tant que places et tokens le permettent"""
+        if self._wakeup is not None:
+            self._wakeup.cancel()
+            self._wakeup = None
+
+        while self._waiters:
+            _, _, future, cost = self._waiters[0]
+            if future.done():
+                # Appel abandonné (échéance ou annulation), déjà décompté
+                heapq.heappop(self._waiters)
+                continue
+            delay = self._admission_delay(cost)
+            if delay is None:
+                break  # release() relancera la distribution
+            if delay > 0:
+                self._wakeup = asyncio.get_running_loop().call_later(delay, self._dispatch)
+                break
+            heapq.heappop(self._waiters)
+            self.queued -= 1
+            self._admit(cost)
+            future.set_result(None)
+
+        self._publish()
+
+    async def acquire(self, priority: Priority, cost: int, timeout: float) -> float:
+        """
+        Attend une place pour un appel
+
+        Returns:
+            Temps passé dans la file (secondes)
+
+        Raises:
+            AdmissionTimeout: aucune place obtenue avant `timeout`
+        """
+        cost = min(cost, self.tokens_per_minute)
+        if not self._waiters and self._admission_delay(cost) == 0:
+            self._admit(cost)
+            self._publish()
+            return 0.0
+
+        start = time.monotonic()
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (int(priority), next(self._order), future, cost))
+        self.queued += 1
+        self._dispatch()
+
+        try:
+            await asyncio.wait({future}, timeout=timeout)
+        except asyncio.CancelledError:
+            self._abandon(future)
+            raise
+
+        if not future.done():
+            self._abandon(future)
+            metrics.increment("perplexity_admission_timeouts")
+            raise AdmissionTimeout(
+                f"{self.model}: no slot after {timeout:g}s "
+                f"({self.active} active, {self.queued} queued)"
+            )
+        return time.monotonic() - start
+
+    def _abandon(self, future: "asyncio.Future") -> None:
+        if future.done() and not future.cancelled():
+            # Admis au moment de l'annulation: rendre la place
+            self.release()
+            return
+        future.cancel()
+        self.queued -= 1
+        self._dispatch()
+
+    def release(self) -> None:
+        self.active -= 1
+        self._dispatch()
+
+    def settle(self, charged: int, actual: int) -> None:
+        """Corrige le budget avec la consommation réelle de l'appel"""
+        self._refill()
+        self._tokens -= actual - charged
+        if actual < charged:
+            self._dispatch()
+
+    def pause(self, seconds: float) -> None:
+        """Suspend les admissions (Retry-After reçu sur ce modèle)"""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+_queues: Dict[str, ModelQueue] = {}
+
+
+def get_model_queue(model: str) -> ModelQueue:
+    """File d'admission du modèle (créée à la première utilisation)"""
+    queue = _queues.get(model)
+    if queue is None:
+        queue = ModelQueue(
+            model,
+            MODEL_CONCURRENCY.get(model, MODEL_CONCURRENCY["*"]),
+            MODEL_TOKENS_PER_MINUTE.get(model, MODEL_TOKENS_PER_MINUTE["*"]),
+        )
+        _queues[model] = queue
+    return queue
+
+
+def priority_for_task(task_type: str) -> Priority:
+    """Priorité par défaut d'un type de tâche (voir get_model_for_task)"""
+    return Priority.CHAT if task_type == "chat" else Priority.INTERACTIVE
+
+
+def estimate_request_tokens(messages: List[Dict], max_tokens: int) -> int:
+    """Coût estimé d'un appel: prompt + moitié du plafond de sortie (corrigé par settle)"""
+    prompt_chars = sum(len(str(m.get("content", ""))) for m in messages)
+    return prompt_chars // CHARS_PER_TOKEN + max_tokens // 2
+
+
+class AdmissionSlot:
+    """Place obtenue dans la file d'un modèle"""
+
+    def __init__(self, queue: ModelQueue, cost: int, priority: Priority):
+        self.queue = queue
+        self.cost = cost
+        self.priority = priority
+        self.held = True
+
+    def release(self) -> None:
+        """Rend la place (sans effet si elle l'est déjà)"""
+        if self.held:
+            self.held = False
+            self.queue.release()
+
+    def release_for_retry(self) -> None:
+        """Rend la place et les tokens d'un appel échoué avant d'attendre la relance"""
+        if self.held:
+            self.queue.settle(self.cost, 0)
+            self.release()
+
+    async def reacquire(self) -> None:
+        """Reprend une place pour la relance (même priorité, même échéance de file)"""
+        await self.queue.acquire(self.priority, self.cost, QUEUE_TIMEOUTS[self.priority])
+        self.held = True
+
+    def settle(self, usage) -> None:
+        """Ajuste le budget avec l'usage renvoyé par l'API (response.usage)"""
+        actual = getattr(usage, "total_tokens", None)
+        if actual:
+            self.queue.settle(self.cost, actual)
+            self.cost = actual
+
+
+@asynccontextmanager
+async def perplexity_slot(model: str, priority: Priority, estimated_tokens: int) -> AsyncIterator[AdmissionSlot]:
+    """Réserve une place pour toute la durée d'un appel (streaming compris)"""
+    queue = get_model_queue(model)
+    cost = min(estimated_tokens, queue.tokens_per_minute)
+    waited = await queue.acquire(priority, cost, QUEUE_TIMEOUTS[priority])
+    metrics.observe(f"perplexity_queue_wait_{priority.name.lower()}", waited)
+    if waited > 1:
+        logger.info(f"Perplexity {model}: {priority.name.lower()} call admitted after {waited:.1f}s in queue")
+    slot = AdmissionSlot(queue, cost, priority)
+    try:
+        yield slot
+    finally:
+        slot.release()
+
+
+def error_status(error: Exception) -> Optional[int]:
+    """Code HTTP d'une erreur SDK OpenAI / httpx, None si absent"""
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status if isinstance(status, int) else None
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    return error_status(error) == 429
+
+
+def is_retryable_error(error: Exception) -> bool:
+    """429, 5xx, erreur de connexion ou timeout: l'appel peut être relancé"""
+    status = error_status(error)
+    if status is not None:
+        return status == 429 or status >= 500
+    if APIConnectionError is not None and isinstance(error, APIConnectionError):
+        return True
+    return isinstance(error, httpx.TransportError)
+
+
+def retry_after_seconds(error: Exception) -> Optional[float]:
+    """Délai demandé par l'API (retry-after-ms, Retry-After en secondes ou date HTTP)"""
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    if not headers:
+        return None
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        value = headers.get("retry-after")
+        if not value:
+            return None
+        try:
+            return max(float(value), 0.0)
+        except ValueError:
+            retry_at = parsedate_to_datetime(value)
+            return max((retry_at - datetime.now(timezone.utc)).total_seconds(), 0.0)
+    except Exception:
+        return None
+
+
+async def retry_rate_limited(
+    model: str,
+    fn: Callable[[], Awaitable[T]],
+    max_retries: int = PERPLEXITY_MAX_RETRIES,
+    slot: Optional[AdmissionSlot] = None
+) -> T:
+    """
+    Exécute fn() en relançant sur 429, 5xx, erreur de connexion ou timeout
+
+    Le délai est celui du Retry-After s'il est fourni, sinon un backoff
+    exponentiel avec jitter. Un 429 suspend aussi les nouvelles admissions du
+    modèle pour la même durée. Si `slot` est fourni, la place est rendue
+    pendant l'attente puis redemandée (AdmissionTimeout si la file ne la rend
+    pas à temps). Au-delà de `max_retries`, ou si l'API demande d'attendre plus
+    de PERPLEXITY_BACKOFF_MAX, l'erreur est propagée.
+    """
+    attempt = 0
+    while True:
+        try:
+            return await fn()
+        except Exception as error:
+            if not is_retryable_error(error) or attempt >= max_retries:
+                raise
+            status = error_status(error)
+
+            retry_after = retry_after_seconds(error)
+            if retry_after is not None and retry_after > PERPLEXITY_BACKOFF_MAX:
+                logger.warning(f"Perplexity {model}: Retry-After {retry_after:.0f}s exceeds backoff limit, giving up")
+                raise
+            if retry_after is not None:
+                delay = retry_after + random.uniform(0, 0.5)
+            else:
+                delay = min(PERPLEXITY_BACKOFF_MAX, PERPLEXITY_BACKOFF_BASE * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+            if status == 429:
+                metrics.increment("perplexity_rate_limited")
+                get_model_queue(model).pause(delay)
+            metrics.increment("perplexity_retries")
+            attempt += 1
+            reason = f"HTTP {status}" if status is not None else type(error).__name__
+            logger.warning(f"Perplexity {model}: {reason}, retry {attempt}/{max_retries} in {delay:.1f}s")
+            if slot is not None:
+                slot.release_for_retry()
+            await asyncio.sleep(delay)
+            if slot is not None:
+                await slot.reacquire()
+
+
+async def admitted_completion(client, priority: Priority, **request_params):
+    """chat.completions.create (hors streaming) avec file d'admission et relances"""
+    model = request_params["model"]
+    estimated = estimate_request_tokens(request_params["messages"], request_params.get("max_tokens", 1000))
+    async with perplexity_slot(model, priority, estimated) as slot:
+        response = await retry_rate_limited(
+            model, lambda: client.chat.completions.create(**request_params), slot=slot
+        )
+        slot.settle(getattr(response, "usage", None))
+        return response
+
+
+def admission_snapshot() -> Dict[str, Dict]:
+    """État des files par modèle"""
+    return {
+        model: {
+            "active": queue.active,
+            "queued": queue.queued,
+            "max_concurrency": queue.max_concurrency,
+            "tokens_per_minute": queue.tokens_per_minute,
+        }
+        for model, queue in _queues.items()
+    }
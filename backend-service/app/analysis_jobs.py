@@ -0,0 +1,463 @@
+"""
+Jobs d'analyse en arrière-plan - statut durable, résultat conservé jusqu'à lecture
+
+Un rapport sonar-pro prend 90 à 120 s: tenir la connexion HTTP ouverte tout
+ce temps la rend fragile (timeout du proxy, coupure réseau). POST crée un job
+et répond immédiatement; un pool borné de workers exécute l'analyse; le client
+interroge le statut (GET) ou s'abonne au flux SSE.
+
+Deux stores interchangeables (variable ANALYSIS_JOBS_BACKEND):
+- "memory": dictionnaire en mémoire, propre au worker
+- "sqlite": base SQLite locale, partagée entre workers; au redémarrage les
+  jobs non terminés sont remis en file
+
+Plusieurs workers uvicorn partagent la base: un job est réservé atomiquement
+(claim) avant exécution, et le worker qui l'exécute renouvelle un bail
+(heartbeat). Un job "running" n'est repris que si son bail a expiré (worker
+arrêté ou planté), jamais pendant qu'un worker vivant l'exécute.
+"""
+
+import os
+import json
+import time
+import uuid
+import socket
+import sqlite3
+import asyncio
+import threading
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from loguru import logger
+
+from app import metrics
+
+# Configuration
+ANALYSIS_JOBS_BACKEND = os.getenv("ANALYSIS_JOBS_BACKEND", "sqlite").lower()
+ANALYSIS_JOBS_DIR = os.getenv("ANALYSIS_JOBS_DIR", "/data/jobs")
+ANALYSIS_JOBS_WORKERS = int(os.getenv("ANALYSIS_JOBS_WORKERS", "4"))
+ANALYSIS_JOBS_MAX_QUEUED = int(os.getenv("ANALYSIS_JOBS_MAX_QUEUED", "200"))
+# Durée de conservation: résultat jamais lu / déjà lu (le client peut relire après un rechargement)
+ANALYSIS_JOBS_TTL = int(os.getenv("ANALYSIS_JOBS_TTL", str(7 * 24 * 3600)))
+ANALYSIS_JOBS_FETCHED_TTL = int(os.getenv("ANALYSIS_JOBS_FETCHED_TTL", "3600"))
+# Bail d'exécution: renouvelé toutes les ANALYSIS_JOBS_HEARTBEAT s, job repris après ANALYSIS_JOBS_LEASE s sans nouvelle
+ANALYSIS_JOBS_HEARTBEAT = int(os.getenv("ANALYSIS_JOBS_HEARTBEAT", "15"))
+ANALYSIS_JOBS_LEASE = int(os.getenv("ANALYSIS_JOBS_LEASE", "60"))
+
+# Identifiant du worker propriétaire d'un job en cours
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_COMPLETED = "completed"
+JOB_FAILED = "failed"
+FINISHED_STATUSES = (JOB_COMPLETED, JOB_FAILED)
+
+
+class JobQueueFull(Exception):
+    """Trop de jobs en attente: la demande est refusée plutôt que mise en file sans fin"""
+
+
+def _new_job(params: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "id": uuid.uuid4().hex,
+        "status": JOB_QUEUED,
+        "params": params,
+        "result": None,
+        "error": None,
+        "created_at": time.time(),
+        "started_at": None,
+        "finished_at": None,
+        "fetched_at": None,
+        "owner": None,
+        "heartbeat_at": None,
+    }
+
+
+def _is_expired(job: Dict[str, Any], now: float) -> bool:
+    if job["fetched_at"] is not None:
+        return now - job["fetched_at"] > ANALYSIS_JOBS_FETCHED_TTL
+    return now - job["created_at"] > ANALYSIS_JOBS_TTL
+
+
+def _is_claimable(job: Dict[str, Any], stale_before: float) -> bool:
+    """En attente, ou en cours mais sans heartbeat depuis stale_before"""
+    if job["status"] == JOB_QUEUED:
+        return True
+    return job["status"] == JOB_RUNNING and (job["heartbeat_at"] is None or job["heartbeat_at"] < stale_before)
+
+
+class MemoryJobStore:
+    """Jobs en mémoire (perdus au redémarrage)"""
+
+    blocking = False
+
+    def __init__(self):
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def create(self, job: Dict[str, Any]) -> None:
+        with self._lock:
+            self._jobs[job["id"]] = dict(job)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def update(self, job_id: str, **fields: Any) -> None:
+        with self._lock:
+            if job_id in self._jobs:
+                self._jobs[job_id].update(fields)
+
+    def recoverable(self, stale_before: float) -> List[Dict[str, Any]]:
+        with self._lock:
+            jobs = [dict(j) for j in self._jobs.values() if _is_claimable(j, stale_before)]
+        return sorted(jobs, key=lambda j: j["created_at"])
+
+    def claim(self, job_id: str, owner: str, now: float, stale_before: float) -> bool:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or not _is_claimable(job, stale_before):
+                return False
+            job.update(status=JOB_RUNNING, owner=owner, started_at=now, heartbeat_at=now)
+            return True
+
+    def update_owned(self, job_id: str, worker: str, **fields: Any) -> bool:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job["owner"] != worker or job["status"] != JOB_RUNNING:
+                return False
+            job.update(fields)
+            return True
+
+    def purge(self) -> int:
+        now = time.time()
+        with self._lock:
+            expired = [job_id for job_id, job in self._jobs.items() if _is_expired(job, now)]
+            for job_id in expired:
+                del self._jobs[job_id]
+        return len(expired)
+
+
+class SqliteJobStore:
+    """Jobs en SQLite: statut et résultat survivent au redémarrage du backend"""
+
+    blocking = True
+
+    _COLUMNS = (
+        "id", "status", "params", "result", "error", "created_at", "started_at", "finished_at", "fetched_at",
+        "owner", "heartbeat_at",
+    )
+    _JSON_COLUMNS = ("params", "result")
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or os.path.join(ANALYSIS_JOBS_DIR, "analysis_jobs.sqlite3")
+        self._lock = threading.Lock()
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS analysis_jobs ("
+                " id TEXT PRIMARY KEY,"
+                " status TEXT NOT NULL,"
+                " params TEXT NOT NULL,"
+                " result TEXT,"
+                " error TEXT,"
+                " created_at REAL NOT NULL,"
+                " started_at REAL,"
+                " finished_at REAL,"
+                " fetched_at REAL,"
+                " owner TEXT,"
+                " heartbeat_at REAL)"
+            )
+            # Bases créées avant le bail d'exécution
+            existing = {row[1] for row in conn.execute("PRAGMA table_info(analysis_jobs)")}
+            for column, kind in (("owner", "TEXT"), ("heartbeat_at", "REAL")):
+                if column not in existing:
+                    conn.execute(f"ALTER TABLE analysis_jobs ADD COLUMN {column} {kind}")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_analysis_jobs_status ON analysis_jobs(status)")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=5.0)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def _encode(self, column: str, value: Any) -> Any:
+        if column in self._JSON_COLUMNS and value is not None:
+            return json.dumps(value, ensure_ascii=False)
+        return value
+
+    def _decode(self, row: tuple) -> Dict[str, Any]:
+        job = dict(zip(self._COLUMNS, row))
+        for column in self._JSON_COLUMNS:
+            if job[column] is not None:
+                job[column] = json.loads(job[column])
+        return job
+
+    def create(self, job: Dict[str, Any]) -> None:
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                f"INSERT INTO analysis_jobs ({', '.join(self._COLUMNS)}) VALUES ({', '.join('?' * len(self._COLUMNS))})",
+                tuple(self._encode(c, job[c]) for c in self._COLUMNS)
+            )
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock, self._connect() as conn:
+            row = conn.execute(
+                f"SELECT {', '.join(self._COLUMNS)} FROM analysis_jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        return self._decode(row) if row else None
+
+    def update(self, job_id: str, **fields: Any) -> None:
+        columns = [c for c in fields if c in self._COLUMNS and c != "id"]
+        if not columns:
+            return
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                f"UPDATE analysis_jobs SET {', '.join(f'{c} = ?' for c in columns)} WHERE id = ?",
+                (*(self._encode(c, fields[c]) for c in columns), job_id)
+            )
+
+    _CLAIMABLE = (
+        "(status = 'queued' OR (status = 'running' AND (heartbeat_at IS NULL OR heartbeat_at < ?)))"
+    )
+
+    def recoverable(self, stale_before: float) -> List[Dict[str, Any]]:
+        with self._lock, self._connect() as conn:
+            rows = conn.execute(
+                f"SELECT {', '.join(self._COLUMNS)} FROM analysis_jobs"
+                f" WHERE {self._CLAIMABLE} ORDER BY created_at",
+                (stale_before,)
+            ).fetchall()
+        return [self._decode(row) for row in rows]
+
+    def claim(self, job_id: str, owner: str, now: float, stale_before: float) -> bool:
+        """Réserve le job (un seul worker gagne, même entre processus)"""
+        with self._lock, self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE analysis_jobs SET status = 'running', owner = ?, started_at = ?, heartbeat_at = ?"
+                f" WHERE id = ? AND {self._CLAIMABLE}",
+                (owner, now, now, job_id, stale_before)
+            )
+            return cursor.rowcount == 1
+
+    def update_owned(self, job_id: str, worker: str, **fields: Any) -> bool:
+        """Mise à jour par le worker propriétaire uniquement (False si le job a été repris)"""
+        columns = [c for c in fields if c in self._COLUMNS and c != "id"]
+        with self._lock, self._connect() as conn:
+            cursor = conn.execute(
+                f"UPDATE analysis_jobs SET {', '.join(f'{c} = ?' for c in columns)}"
+                " WHERE id = ? AND owner = ? AND status = 'running'",
+                (*(self._encode(c, fields[c]) for c in columns), job_id, worker)
+            )
+            return cursor.rowcount == 1
+
+    def purge(self) -> int:
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            cursor = conn.execute(
+                "DELETE FROM analysis_jobs WHERE"
+                " (fetched_at IS NOT NULL AND fetched_at < ?)"
+                " OR (fetched_at IS NULL AND created_at < ?)",
+                (now - ANALYSIS_JOBS_FETCHED_TTL, now - ANALYSIS_JOBS_TTL)
+            )
+            return cursor.rowcount
+
+
+def create_job_store(backend: str = ANALYSIS_JOBS_BACKEND):
+    """Instancie le store configuré (mémoire si SQLite est indisponible)"""
+    if backend == "sqlite":
+        try:
+            store = SqliteJobStore()
+            logger.info(f"Analysis job store: sqlite ({store.path})")
+            return store
+        except Exception as e:
+            logger.warning(f"SQLite job store unavailable, falling back to memory: {e}")
+    logger.info("Analysis job store: memory")
+    return MemoryJobStore()
+
+
+class AnalysisJobRunner:
+    """
+    Pool borné de workers asyncio qui exécutent les jobs dans l'ordre d'arrivée
+
+    run_fn reçoit les paramètres du job et renvoie le résultat (dict
+    sérialisable en JSON); une exception marque le job en échec.
+    """
+
+    def __init__(
+        self,
+        store,
+        run_fn: Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]],
+        workers: int = ANALYSIS_JOBS_WORKERS,
+        max_queued: int = ANALYSIS_JOBS_MAX_QUEUED
+    ):
+        self.store = store
+        self.run_fn = run_fn
+        self.workers = max(1, workers)
+        self._queue: "asyncio.Queue[str]" = asyncio.Queue(maxsize=max_queued)
+        self._tasks: List[asyncio.Task] = []
+        self._changed: Dict[str, asyncio.Event] = {}
+        self.worker_id = WORKER_ID
+
+    async def _call(self, method: str, *args, **kwargs):
+        fn = getattr(self.store, method)
+        if self.store.blocking:
+            return await asyncio.to_thread(fn, *args, **kwargs)
+        return fn(*args, **kwargs)
+
+    async def start(self) -> None:
+        """Lance les workers et remet en file les jobs interrompus par un redémarrage"""
+        if self._tasks:
+            return
+        purged = await self._call("purge")
+        if purged:
+            logger.info(f"Purged {purged} expired analysis jobs")
+        await self._recover()
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._recovery_loop()))
+        self._publish()
+
+    async def _recover(self) -> int:
+        """
+        Met en file locale les jobs en attente et les jobs "running" dont le bail
+        a expiré. Si la file est pleine, les suivants restent en base et sont
+        repris au passage suivant; le claim évite toute double exécution.
+        """
+        requeued = 0
+        for job in await self._call("recoverable", time.time() - ANALYSIS_JOBS_LEASE):
+            if job["id"] in self._queue._queue:
+                continue
+            if self._queue.full():
+                break
+            self._queue.put_nowait(job["id"])
+            requeued += 1
+            if job["status"] == JOB_RUNNING:
+                logger.info(f"Analysis job {job['id']} requeued (lease of {job['owner'] or 'unknown worker'} expired)")
+        if requeued:
+            self._publish()
+        return requeued
+
+    async def _recovery_loop(self) -> None:
+        while True:
+            await asyncio.sleep(ANALYSIS_JOBS_LEASE)
+            try:
+                await self._recover()
+            except Exception as e:
+                logger.warning(f"Analysis job recovery failed: {e}")
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def _publish(self) -> None:
+        metrics.set_gauge("analysis_jobs_queued", self._queue.qsize())
+
+    def _notify(self, job_id: str) -> None:
+        event = self._changed.pop(job_id, None)
+        if event is not None:
+            event.set()
+
+    async def submit(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        """Crée un job et le met en file (JobQueueFull si la file est pleine)"""
+        if self._queue.full():
+            metrics.increment("analysis_jobs_rejected")
+            raise JobQueueFull(f"{self._queue.qsize()} analysis jobs already queued")
+        job = _new_job(params)
+        await self._call("create", job)
+        self._queue.put_nowait(job["id"])
+        metrics.increment("analysis_jobs_submitted")
+        self._publish()
+        return job
+
+    async def get(self, job_id: str, mark_fetched: bool = False) -> Optional[Dict[str, Any]]:
+        """Statut d'un job; mark_fetched=True lance le délai de conservation après lecture"""
+        job = await self._call("get", job_id)
+        if job and mark_fetched and job["status"] in FINISHED_STATUSES and job["fetched_at"] is None:
+            job["fetched_at"] = time.time()
+            await self._call("update", job_id, fetched_at=job["fetched_at"])
+        return job
+
+    def queue_position(self, job_id: str) -> Optional[int]:
+        """Position dans la file locale (1 = prochain), None si absent"""
+        try:
+            return list(self._queue._queue).index(job_id) + 1
+        except ValueError:
+            return None
+
+    async def wait_for_change(self, job_id: str, timeout: float) -> None:
+        """Attend un changement de statut (ou timeout: le job peut tourner sur un autre worker)"""
+        event = self._changed.setdefault(job_id, asyncio.Event())
+        try:
+            await asyncio.wait_for(event.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _worker(self, index: int) -> None:
+        while True:
+            job_id = await self._queue.get()
+            self._publish()
+            try:
+                await self._run(job_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Analysis job worker {index} error on {job_id}: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def _heartbeat(self, job_id: str) -> None:
+        """Renouvelle le bail du job tant qu'il s'exécute ici"""
+        while True:
+            await asyncio.sleep(ANALYSIS_JOBS_HEARTBEAT)
+            try:
+                if not await self._call("update_owned", job_id, self.worker_id, heartbeat_at=time.time()):
+                    logger.warning(f"Analysis job {job_id} lease lost")
+                    return
+            except Exception as e:
+                logger.warning(f"Analysis job {job_id} heartbeat failed: {e}")
+
+    async def _run(self, job_id: str) -> None:
+        job = await self._call("get", job_id)
+        if job is None or job["status"] in FINISHED_STATUSES:
+            return
+
+        started_at = time.time()
+        if not await self._call("claim", job_id, self.worker_id, started_at, started_at - ANALYSIS_JOBS_LEASE):
+            return  # Réservé par un autre worker entre-temps
+        self._notify(job_id)
+        metrics.observe("analysis_job_queue_wait", started_at - job["created_at"])
+
+        heartbeat = asyncio.create_task(self._heartbeat(job_id))
+        try:
+            result = await self.run_fn(job["params"])
+            status, error = JOB_COMPLETED, None
+        except asyncio.CancelledError:
+            # Arrêt du service: le job est rendu pour être repris sans attendre l'expiration du bail
+            try:
+                await self._call(
+                    "update_owned", job_id, self.worker_id, status=JOB_QUEUED, owner=None, heartbeat_at=None
+                )
+            except Exception as e:
+                logger.warning(f"Analysis job {job_id} not released ({e}): resumed once its lease expires")
+            raise
+        except Exception as e:
+            logger.error(f"Analysis job {job_id} failed: {e}")
+            result, status, error = None, JOB_FAILED, str(e)[:500]
+        finally:
+            heartbeat.cancel()
+
+        finished_at = time.time()
+        if not await self._call(
+            "update_owned", job_id, self.worker_id,
+            status=status, result=result, error=error, finished_at=finished_at
+        ):
+            logger.warning(f"Analysis job {job_id} was taken over by another worker, result dropped")
+            return
+        self._notify(job_id)
+        metrics.increment(f"analysis_jobs_{status}")
+        metrics.observe("analysis_job_duration", finished_at - started_at)
+        logger.info(f"Analysis job {job_id} {status} in {finished_at - started_at:.1f}s")
@@ -5,6 +5,8 @@ Ce fichier contient toutes les informations que l'assistant doit connaître
 sur l'application Prometheus pour guider et aider les utilisateurs.
 """
 
+from functools import lru_cache
+
 # Description générale de l'application
 APP_DESCRIPTION = """
 Prometheus est une plateforme d'intelligence stratégique alimentée par l'IA.
@@ -220,8 +222,9 @@ def get_faq_answer(faq_key: str) -> dict:
     """Retourne une réponse FAQ"""
     return FAQ.get(faq_key, {})
 
+@lru_cache(maxsize=1)
 def build_context_prompt() -> str:
-    """Construit le prompt de contexte pour l'assistant avec toute la connaissance app"""
+    """Construit le prompt de contexte pour l'assistant avec toute la connaissance app (une seule fois)"""
     context = f"""
 Tu es l'assistant intelligent de Prometheus, une plateforme d'intelligence stratégique IA.
 
@@ -18,6 +18,9 @@ import os
 SCHEDULER_URL = os.getenv("SCHEDULER_URL", "http://scheduler-service:8007")
 BACKEND_URL = os.getenv("BACKEND_URL", "http://backend-service:8006")
 
+# Veilles renvoyées par l'action "lister" (le total vient de X-Total-Count)
+WATCH_LIST_LIMIT = int(os.getenv("ASSISTANT_WATCH_LIST_LIMIT", "50"))
+
 
 class ActionType(str, Enum):
     """Types d'actions disponibles"""
@@ -138,7 +141,7 @@ async def execute_action(action: ProposedAction, user_id: str = "default_user")
         elif action.action_type == ActionType.DELETE_WATCH:
             return await _delete_watch(action.parameters)
         elif action.action_type == ActionType.LIST_WATCHES:
-            return await _list_watches()
+            return await _list_watches(user_id)
         elif action.action_type == ActionType.GENERATE_REPORT:
             return await _generate_report(action.parameters)
         elif action.action_type == ActionType.VIEW_WATCH_DETAILS:
@@ -284,17 +287,21 @@ async def _delete_watch(params: Dict[str, Any]) -> ActionResult:
         )
 
 
-async def _list_watches() -> ActionResult:
-    """Liste toutes les veilles"""
+async def _list_watches(user_id: str) -> ActionResult:
+    """Liste les veilles de l'utilisateur (projection compacte, limitée côté scheduler)"""
     try:
-        logger.info(f"Fetching watches from {SCHEDULER_URL}/watches")
+        logger.info(f"Fetching watches from {SCHEDULER_URL}/watches/summary")
         async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.get(f"{SCHEDULER_URL}/watches")
+            response = await client.get(
+                f"{SCHEDULER_URL}/watches/summary",
+                params={"user_id": user_id, "limit": WATCH_LIST_LIMIT}
+            )
             logger.info(f"Watches list response status: {response.status_code}")
 
             if response.status_code == 200:
                 watches = response.json()
-                logger.info(f"Successfully retrieved {len(watches) if watches else 0} watches")
+                total = int(response.headers.get("x-total-count", len(watches)))
+                logger.info(f"Successfully retrieved {len(watches)}/{total} watches")
 
                 if not watches:
                     return ActionResult(
@@ -317,8 +324,8 @@ async def _list_watches() -> ActionResult:
 
                 return ActionResult(
                     success=True,
-                    message=f"Vous avez {len(watches)} veille(s) configurée(s).",
-                    data={"watches": watch_list, "count": len(watches)}
+                    message=f"Vous avez {total} veille(s) configurée(s).",
+                    data={"watches": watch_list, "count": total}
                 )
             else:
                 logger.error(f"Failed to fetch watches: {response.status_code} - {response.text}")
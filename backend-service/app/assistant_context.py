@@ -0,0 +1,166 @@
+"""
+Contexte de l'assistant - assemblage mis en cache, parties récupérées en parallèle
+
+La connaissance de l'application est statique: elle est construite une seule
+fois. Les parties propres à l'utilisateur (extraits des contextes entreprise
+pertinents pour le message via memory-service, veilles de l'utilisateur via
+scheduler-service, historique RAG) sont lancées en même temps. Les extraits
+dépendent du message et ne sont pas mis en cache: la recherche plein texte de
+memory-service est peu coûteuse. Les veilles sont gardées quelques instants en
+cache, revalidées ensuite par ETag, et invalidées par scheduler-service (POST
+/internal/assistant-context/invalidate).
+"""
+
+import asyncio
+import os
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from loguru import logger
+
+from app import metrics
+from app.app_knowledge import build_context_prompt
+from app.context_manager import get_context_for_prompt
+from app.document_client import get_internal_client
+from app.prompt_budget import truncate_to_tokens, SECTION_BUDGETS
+from app.prompt_inputs import _timed_stage, USER_CONTEXT_TIMEOUT, USER_HISTORY_TIMEOUT
+from app.rag_memory import get_history_for_prompt
+from app.result_cache import MemoryResultCache
+from app.single_flight import SingleFlight
+
+SCHEDULER_URL = os.getenv("SCHEDULER_URL", "http://scheduler-service:8007")
+
+# Durée de vie courte: l'invalidation explicite couvre les modifications connues
+ASSISTANT_WATCHES_TTL = int(os.getenv("ASSISTANT_WATCHES_TTL", "60"))
+ASSISTANT_CACHE_MAX_USERS = int(os.getenv("ASSISTANT_CACHE_MAX_USERS", "1000"))
+WATCHES_TIMEOUT = float(os.getenv("WATCHES_TIMEOUT", "5"))
+# Veilles affichées dans le contexte (limite appliquée par scheduler-service)
+ASSISTANT_WATCH_LIMIT = int(os.getenv("ASSISTANT_WATCH_LIMIT", "10"))
+# Au-delà du TTL, la liste est revalidée par ETag (304 si inchangée) tant que
+# l'entrée a moins de ASSISTANT_WATCHES_REVALIDATE_TTL secondes
+ASSISTANT_WATCHES_REVALIDATE_TTL = int(os.getenv("ASSISTANT_WATCHES_REVALIDATE_TTL", "3600"))
+
+# Parties invalidables
+CONTEXT_PARTS = ("watches",)
+
+_watches_cache = MemoryResultCache(max_entries=ASSISTANT_CACHE_MAX_USERS, ttl=ASSISTANT_WATCHES_REVALIDATE_TTL)
+_context_flights = SingleFlight("assistant_context")
+
+
+async def _load_user_context(user_id: str, message: str) -> str:
+    user_context = await get_context_for_prompt(user_id, query=message)
+    if user_context and len(user_context) > 50:
+        return truncate_to_tokens(user_context, SECTION_BUDGETS["user_context"])
+    return ""
+
+
+def _format_watches(watches: List[Dict[str, Any]]) -> str:
+    if not watches:
+        return ""
+    watches_info = "\n## Veilles configurees par l'utilisateur:\n"
+    for w in watches:
+        status = "Active" if w.get("is_active") else "Inactive"
+        watches_info += f"- {w['name']} (ID: {w['id']}): {w['topic']} - {status}\n"
+    return watches_info
+
+
+async def _fetch_watches(user_id: str, cached: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Veilles de l'utilisateur (projection compacte), revalidées par ETag si déjà connues"""
+    headers = {"If-None-Match": cached["etag"]} if cached and cached.get("etag") else {}
+    client = get_internal_client()
+    response = await client.get(
+        f"{SCHEDULER_URL}/watches/summary",
+        params={"user_id": user_id, "limit": ASSISTANT_WATCH_LIMIT},
+        headers=headers,
+        timeout=WATCHES_TIMEOUT
+    )
+    if response.status_code == 304 and cached:
+        metrics.increment("assistant_watches_not_modified")
+        return {**cached, "checked_at": time.time()}
+    if response.status_code != 200:
+        raise RuntimeError(f"scheduler-service returned {response.status_code}")
+    return {
+        "section": _format_watches(response.json()),
+        "etag": response.headers.get("etag"),
+        "checked_at": time.time(),
+    }
+
+
+async def _user_watches(user_id: str) -> str:
+    """Section "veilles configurées": fraîche pendant ASSISTANT_WATCHES_TTL, puis revalidée"""
+    key = str(user_id)
+    entry = _watches_cache.get(key)
+    cached = entry["value"] if entry else None
+    if cached and time.time() - cached["checked_at"] < ASSISTANT_WATCHES_TTL:
+        metrics.increment("assistant_watches_cache_hits")
+        return cached["section"]
+    metrics.increment("assistant_watches_cache_misses")
+    fresh = await _context_flights.do(f"watches:{key}", lambda: _fetch_watches(key, cached))
+    _watches_cache.set(key, fresh)
+    return fresh["section"]
+
+
+def _load_history(user_id: str, message: str) -> str:
+    history_context = get_history_for_prompt(user_id, message, max_length=1000)
+    if history_context and len(history_context) > 50:
+        return truncate_to_tokens(history_context, SECTION_BUDGETS["history"])
+    return ""
+
+
+async def build_assistant_context(user_id: str, message: str) -> Tuple[str, List[str]]:
+    """
+    Construit le contexte complet pour l'assistant:
+    - Connaissance de l'application (construite une fois)
+    - Extraits des contextes entreprise pertinents pour le message
+    - Historique des conversations (lecture hors boucle d'événements)
+    - Veilles de l'utilisateur (cache court, revalidation ETag)
+
+    Retourne (context_prompt, sources_used)
+    """
+    key = str(user_id)
+    timings: Dict[str, float] = {}
+    user_context, history_context, watches_info = await asyncio.gather(
+        _timed_stage(
+            "assistant_user_context",
+            _load_user_context(user_id, message),
+            USER_CONTEXT_TIMEOUT, "", timings
+        ),
+        _timed_stage(
+            "assistant_history",
+            asyncio.to_thread(_load_history, user_id, message),
+            USER_HISTORY_TIMEOUT, "", timings
+        ),
+        _timed_stage(
+            "assistant_watches",
+            _user_watches(user_id),
+            WATCHES_TIMEOUT, "", timings
+        ),
+    )
+
+    context_parts = [build_context_prompt()]
+    sources_used = ["Documentation Prometheus"]
+    if user_context:
+        context_parts.append(f"\n## Contexte de l'entreprise de l'utilisateur:\n{user_context}")
+        sources_used.append("Contexte entreprise")
+    if history_context:
+        context_parts.append(f"\n## Historique recent des conversations:\n{history_context}")
+        sources_used.append("Historique conversations")
+    if watches_info:
+        context_parts.append(watches_info)
+        sources_used.append("Veilles utilisateur")
+
+    logger.debug(f"Assistant context for {key[:8]}... built in {timings}")
+    return "\n".join(context_parts), sources_used
+
+
+def invalidate_assistant_context(user_id: Optional[str] = None, parts: Iterable[str] = CONTEXT_PARTS) -> Dict[str, Any]:
+    """Oublie les parties mises en cache (user_id None: tous les utilisateurs)"""
+    parts = [part for part in parts if part in CONTEXT_PARTS]
+    caches = {"watches": _watches_cache}
+    for part in parts:
+        if user_id is None:
+            caches[part].clear()
+        else:
+            caches[part].delete(str(user_id))
+    metrics.increment("assistant_context_invalidations")
+    return {"invalidated": parts, "user_id": user_id}
@@ -4,6 +4,8 @@ Prompts spécialisés avec sources fiables - Sans mention de secteur spécifique
 
 from typing import Dict, List
 
+from app.prompt_templates import PROMPT_TEMPLATES
+
 # Instructions de sources fiables à intégrer dans tous les prompts
 TRUSTED_SOURCES_INSTRUCTION = """
 ## SOURCES AUTORISÉES (EXCLUSIVEMENT)
@@ -772,6 +774,13 @@ IMPORTANT: Utilise UNIQUEMENT les sources officielles (Journal Officiel, EUR-Lex
     """
 }
 
+# Compilation unique des templates: les sources autorisées sont intégrées dès l'import,
+# seuls {context} et {query} restent à remplir à chaque requête
+for _analysis_type, _source in GENERIC_PROMPTS.items():
+    PROMPT_TEMPLATES.register(f"generic/{_analysis_type}", _source, trusted_sources=TRUSTED_SOURCES_INSTRUCTION)
+for _analysis_type, _source in GENERIC_PROMPTS_NO_RECO.items():
+    PROMPT_TEMPLATES.register(f"generic_no_reco/{_analysis_type}", _source, trusted_sources=TRUSTED_SOURCES_INSTRUCTION)
+
 def get_business_prompt(business_type: str, analysis_type: str, context: str, query: str, include_recommendations: bool = True) -> str:
     """Récupère le prompt générique pour un type d'analyse (business_type ignoré)
     
@@ -787,17 +796,13 @@ def get_business_prompt(business_type: str, analysis_type: str, context: str, qu
     if analysis_type not in GENERIC_PROMPTS:
         analysis_type = "synthese_executive"  # Default
     
-    prompt_template = GENERIC_PROMPTS[analysis_type]
+    template_name = f"generic/{analysis_type}"
     
     # Si recommandations désactivées, utiliser la version sans recommandations
     if not include_recommendations and analysis_type in GENERIC_PROMPTS_NO_RECO:
-        prompt_template = GENERIC_PROMPTS_NO_RECO[analysis_type]
+        template_name = f"generic_no_reco/{analysis_type}"
     
-    return prompt_template.format(
-        trusted_sources=TRUSTED_SOURCES_INSTRUCTION,
-        context=context, 
-        query=query
-    )
+    return PROMPT_TEMPLATES.render(template_name, context=context, query=query)
 
 def get_generic_prompt(analysis_type: str, context: str, query: str) -> str:
     """Récupère le prompt générique sans business_type"""
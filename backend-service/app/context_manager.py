@@ -1,6 +1,10 @@
 """
 Context Manager - Gestion du contexte utilisateur pour RAG
 Supporte le multi-contexte via memory-service avec fallback fichier local.
+
+Avec une requete, seuls les extraits des contextes pertinents pour celle-ci
+sont demandes a memory-service (POST /internal/contexts/retrieve, dans le
+budget de caracteres) au lieu de telecharger tous les contextes actifs.
 """
 
 import os
@@ -11,11 +15,15 @@ from loguru import logger
 import hashlib
 import httpx
 
+from app.document_client import get_internal_client
+
 # Directory for storing user contexts (legacy fallback)
 CONTEXT_DIR = os.getenv("CONTEXT_DIR", "/data/contexts")
 
 # Memory service URL for multi-context support
 MEMORY_SERVICE_URL = os.getenv("MEMORY_SERVICE_URL", "http://memory-service:8008")
+CONTEXT_RETRIEVE_TIMEOUT = float(os.getenv("CONTEXT_RETRIEVE_TIMEOUT", "10"))
+CONTEXT_RETRIEVE_MAX_CHUNKS = int(os.getenv("CONTEXT_RETRIEVE_MAX_CHUNKS", "12"))
 
 
 def ensure_context_dir():
@@ -238,18 +246,85 @@ async def get_contexts_from_memory_service(user_id: str) -> List[Dict[str, Any]]
     return []
 
 
-async def get_context_for_prompt(user_id: str, max_length: int = 4000) -> str:
+async def retrieve_context_chunks(user_id: str, query: str, max_length: int) -> Optional[List[Dict[str, Any]]]:
+    """
+    Recupere les extraits des contextes actifs les plus pertinents pour la requete.
+
+    Args:
+        user_id: Identifiant de l'utilisateur (int ou str)
+        query: Requete ou message de l'utilisateur
+        max_length: Budget total en caracteres
+
+    Returns:
+        Extraits dans l'ordre de lecture (liste vide si aucun contexte),
+        None si memory-service ne repond pas (fallback sur l'ancien chemin)
+    """
+    try:
+        response = await get_internal_client().post(
+            f"{MEMORY_SERVICE_URL}/internal/contexts/retrieve",
+            json={
+                "user_id": str(user_id),
+                "query": query,
+                "max_chars": max_length,
+                "max_chunks": CONTEXT_RETRIEVE_MAX_CHUNKS,
+            },
+            timeout=CONTEXT_RETRIEVE_TIMEOUT
+        )
+        if response.status_code == 200:
+            data = response.json()
+            chunks = data.get("chunks", [])
+            logger.info(
+                f"Retrieved {len(chunks)} context chunks ({data.get('total_chars', 0)} chars) "
+                f"for user {str(user_id)[:8]}..."
+            )
+            return chunks
+        logger.warning(f"Memory service retrieve returned {response.status_code}")
+    except Exception as e:
+        logger.warning(f"Failed to retrieve context chunks from memory-service: {e}")
+    return None
+
+
+def format_context_chunks(chunks: List[Dict[str, Any]]) -> str:
+    """Regroupe les extraits par contexte (ordre de lecture conserve)"""
+    grouped: Dict[int, List[Dict[str, Any]]] = {}
+    for chunk in chunks:
+        grouped.setdefault(chunk.get("context_id"), []).append(chunk)
+
+    sections = []
+    for context_chunks in grouped.values():
+        first = context_chunks[0]
+        name = first.get("name", "Contexte")
+        header = f"### {name} (document)" if first.get("type") == "document" else f"### {name}"
+        sections.append(header + "\n" + "\n[...]\n".join(c.get("content", "") for c in context_chunks))
+
+    if not sections:
+        return ""
+
+    return "## CONTEXTES ENTREPRISE\n\n" + "\n\n".join(sections) + "\n\n"
+
+
+async def get_context_for_prompt(user_id: str, max_length: int = 4000, query: Optional[str] = None) -> str:
     """
-    Recupere et formate TOUS les contextes actifs pour injection dans le prompt.
+    Recupere et formate les contextes actifs pour injection dans le prompt.
     Utilise memory-service pour multi-contexte, fallback sur fichier local.
 
     Args:
         user_id: Identifiant de l'utilisateur
         max_length: Longueur maximale totale des contextes (4000 par defaut)
+        query: Requete courante; si fournie, seuls les extraits pertinents
+            sont recuperes (sinon tous les contextes, tronques)
 
     Returns:
         Contextes formates ou chaine vide
     """
+    if query is not None:
+        chunks = await retrieve_context_chunks(user_id, query, max_length)
+        if chunks:
+            return format_context_chunks(chunks)
+        if chunks is not None:
+            # Aucun contexte dans memory-service: ancien systeme fichier
+            return get_context_for_prompt_legacy(str(user_id), max_length)
+
     # Essayer d'abord memory-service pour multi-contexte
     contexts = await get_contexts_from_memory_service(user_id)
 
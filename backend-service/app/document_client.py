@@ -0,0 +1,158 @@
+"""
+Client vector-service / document-service partagé - recherche RAG non bloquante
+
+Un seul httpx.AsyncClient par process, avec connexions keep-alive vers les
+services internes. Chaque appel porte sa propre échéance: une recherche ou
+des métadonnées trop lentes dégradent le rapport (moins de sources) au lieu
+de le bloquer.
+"""
+
+import asyncio
+import os
+from typing import Dict, Iterable, List, Optional
+
+import httpx
+from loguru import logger
+
+# Configuration - services internes
+VECTOR_SERVICE_URL = os.getenv("VECTOR_URL", "http://vector-service:8002")
+DOCUMENT_SERVICE_URL = os.getenv("DOCUMENT_URL", "http://document-service:8001")
+
+# Échéances par appel (secondes)
+VECTOR_SEARCH_TIMEOUT = float(os.getenv("VECTOR_SEARCH_TIMEOUT", "10"))
+DOCUMENT_METADATA_TIMEOUT = float(os.getenv("DOCUMENT_METADATA_TIMEOUT", "5"))
+
+# Cache des métadonnées (citations APA): borné, invalidé par document-service
+DOCUMENT_METADATA_CACHE_SIZE = int(os.getenv("DOCUMENT_METADATA_CACHE_SIZE", "2000"))
+DOCUMENT_METADATA_CACHE_TTL = int(os.getenv("DOCUMENT_METADATA_CACHE_TTL", "3600"))
+
+# Pool de connexions vers les services internes
+INTERNAL_MAX_CONNECTIONS = int(os.getenv("INTERNAL_MAX_CONNECTIONS", "50"))
+INTERNAL_MAX_KEEPALIVE = int(os.getenv("INTERNAL_MAX_KEEPALIVE", "20"))
+
+_http_client: Optional[httpx.AsyncClient] = None
+
+
+def get_internal_client() -> httpx.AsyncClient:
+    """Retourne le client HTTP partagé vers vector-service et document-service"""
+    global _http_client
+
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=INTERNAL_MAX_CONNECTIONS,
+                max_keepalive_connections=INTERNAL_MAX_KEEPALIVE,
+            ),
+            timeout=httpx.Timeout(VECTOR_SEARCH_TIMEOUT, connect=2.0),
+        )
+    return _http_client
+
+
+async def close_internal_client() -> None:
+    """Ferme le pool de connexions à l'arrêt du service"""
+    global _http_client
+
+    if _http_client is not None:
+        await _http_client.aclose()
+    _http_client = None
+
+
+async def search_documents(query: str, top_k: int = 10, timeout: float = VECTOR_SEARCH_TIMEOUT) -> List[Dict]:
+    """
+    Recherche vectorielle via vector-service
+
+    Returns:
+        Liste des passages trouvés (vide en cas d'erreur ou d'échéance dépassée)
+    """
+    try:
+        response = await get_internal_client().post(
+            f"{VECTOR_SERVICE_URL}/search",
+            json={"query": query, "top_k": top_k},
+            timeout=timeout
+        )
+
+        if response.status_code == 200:
+            result = response.json()
+            # The vector-service returns a LIST of results. Also support dict forms.
+            if isinstance(result, list):
+                return result
+            if isinstance(result, dict):
+                return result.get("results", result.get("data", []))
+            return []
+        else:
+            logger.warning(f"Vector search failed: {response.status_code}")
+            return []
+
+    except httpx.TimeoutException:
+        logger.error(f"Vector search timeout ({timeout}s)")
+        return []
+    except httpx.ConnectError:
+        logger.error("Vector search connection error")
+        return []
+    except Exception as e:
+        logger.error(f"Vector search error: {e}")
+        return []
+
+
+async def fetch_document_metadata(doc_id: int, timeout: float = DOCUMENT_METADATA_TIMEOUT) -> Optional[Dict]:
+    """Récupère les métadonnées d'un document depuis le document-service"""
+    try:
+        response = await get_internal_client().get(
+            f"{DOCUMENT_SERVICE_URL}/document/{doc_id}",
+            timeout=timeout
+        )
+
+        if response.status_code == 200:
+            return response.json()
+        logger.warning(f"Failed to get document metadata for doc_id={doc_id}: {response.status_code}")
+        return None
+
+    except Exception as e:
+        logger.error(f"Error fetching document metadata for doc_id={doc_id}: {e}")
+        return None
+
+
+async def fetch_documents_metadata(
+    doc_ids: Iterable[int],
+    timeout: float = DOCUMENT_METADATA_TIMEOUT
+) -> Dict[int, Dict]:
+    """
+    Récupère les métadonnées de plusieurs documents en un seul appel
+
+    Utilise POST /documents/metadata (métadonnées seules, sans le contenu
+    extrait). Si le document-service ne connaît pas encore cet endpoint, les
+    documents sont demandés un par un, en parallèle, sous la même échéance.
+    Les documents non obtenus à temps sont absents du résultat.
+    """
+    ids = list(dict.fromkeys(doc_ids))
+    if not ids:
+        return {}
+
+    try:
+        response = await get_internal_client().post(
+            f"{DOCUMENT_SERVICE_URL}/documents/metadata",
+            json={"ids": ids},
+            timeout=timeout
+        )
+        if response.status_code == 200:
+            return {item["id"]: item for item in response.json()}
+        if response.status_code not in (404, 405):
+            logger.warning(f"Bulk document metadata failed: {response.status_code}")
+            return {}
+    except Exception as e:
+        logger.error(f"Error fetching bulk document metadata: {e}")
+        return {}
+
+    # document-service sans endpoint groupé: un appel par document, en parallèle
+    tasks = {doc_id: asyncio.ensure_future(fetch_document_metadata(doc_id, timeout)) for doc_id in ids}
+    done, pending = await asyncio.wait(tasks.values(), timeout=timeout)
+    for task in pending:
+        task.cancel()
+    if pending:
+        logger.warning(f"Document metadata deadline exceeded for {len(pending)}/{len(ids)} documents")
+
+    return {
+        doc_id: task.result()
+        for doc_id, task in tasks.items()
+        if task in done and not task.cancelled() and task.result()
+    }
@@ -0,0 +1,120 @@
+"""
+Détection des intentions et entités de l'assistant, pilotée par tables
+
+Les mots-clés (intentions, fréquences, marqueurs de sujet, aide sur
+l'application) sont regroupés dans KEYWORD_GROUPS et les intentions sont des
+règles déclaratives (INTENT_RULES): ajouter une intention ne rajoute aucun
+parcours du texte, seulement des groupes consultés à la demande.
+
+Un message est analysé une seule fois par tour de chat (scan_message est
+mémorisé): chaque groupe est évalué au plus une fois, seulement si une règle
+le consulte, et l'extraction d'emails utilise une regex compilée au chargement.
+
+La correspondance reste une recherche de sous-chaîne (comme les anciens
+`any(word in message_lower ...)`): "sur" est trouvé dans "surveillance".
+Une regex unique en trie a été mesurée (scripts/bench_intent_matcher.py):
+sous CPython elle est plus lente que les recherches `in` en C, quelle que
+soit la longueur du message, d'où ce choix.
+"""
+
+import re
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+EMAIL_RE = re.compile(r'[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}')
+SEND_SUFFIX_RE = re.compile(r'\s*(a|à)\s*(envoyer|envoyé|envoyée)\s*(a|à)?\s*$', re.IGNORECASE)
+
+# Groupes de mots-clés (recherchés en minuscules, sous-chaînes)
+KEYWORD_GROUPS: Dict[str, Tuple[str, ...]] = {
+    "action": ("creer", "créer", "nouvelle", "ajouter", "configurer"),
+    "watch": ("veille", "surveillance", "watch"),
+    "watches": ("veille", "veilles", "surveillance", "watches"),
+    "watch_ref": ("veille", "watch"),
+    "report": ("rapport", "analyse", "report"),
+    "list": ("liste", "lister", "voir", "afficher", "montre", "quelles sont"),
+    "delete": ("supprimer", "effacer", "retirer", "delete"),
+    "update": ("modifier", "changer", "mettre à jour", "update", "edit"),
+    "question": ("comment", "qu'est-ce", "c'est quoi", "explique", "how", "what", "pourquoi"),
+    "help": ("aide", "help", "fonctionnalit", "feature", "peut faire", "capable"),
+    "topic_marker": ("sur", "concernant", "à propos de", "about"),
+    "daily": ("quotidien", "chaque jour"),
+    "weekly": ("hebdomadaire", "chaque semaine"),
+    "monthly": ("mensuel",),
+    "app_help": (
+        "comment", "aide", "help", "expliqu", "tutoriel", "guide",
+        "prometheus", "plateforme", "application", "app",
+        "veille", "rapport", "creer", "créer", "configurer",
+        "fonctionn", "utiliser", "marche", "fonctionne",
+        "bouton", "page", "menu", "interface", "etape", "étape",
+    ),
+}
+
+# Règles évaluées dans l'ordre: la première dont tous les groupes sont présents l'emporte
+INTENT_RULES: Tuple[Tuple[str, Tuple[str, ...]], ...] = (
+    ("create_watch", ("action", "watch")),
+    ("generate_report", ("action", "report")),
+    ("list_watches", ("list", "watches")),
+    ("delete_watch", ("delete", "watch_ref")),
+    ("update_watch", ("update", "watch_ref")),
+    ("explanation", ("question",)),
+    ("explanation", ("help",)),
+)
+DEFAULT_INTENT = "conversation"
+
+# Fréquence de veille: première présente dans cet ordre
+FREQUENCY_HINTS = (("daily", "daily"), ("weekly", "weekly_monday"), ("monthly", "monthly"))
+
+
+class MessageScan:
+    """Analyse d'un message: groupes évalués à la demande puis mémorisés"""
+
+    __slots__ = ("message", "message_lower", "emails", "_groups", "_table")
+
+    def __init__(self, message: str, table: Dict[str, Tuple[str, ...]]):
+        self.message = message
+        self.message_lower = message.lower()
+        self.emails: Tuple[str, ...] = tuple(EMAIL_RE.findall(message)) if "@" in message else ()
+        self._groups: Dict[str, bool] = {}
+        self._table = table
+
+    def has(self, group: str) -> bool:
+        present = self._groups.get(group)
+        if present is None:
+            text = self.message_lower
+            present = self._groups[group] = any(word in text for word in self._table[group])
+        return present
+
+
+@lru_cache(maxsize=256)
+def scan_message(message: str) -> MessageScan:
+    """Analyse partagée par tous les détecteurs d'un même tour de chat"""
+    return MessageScan(message, KEYWORD_GROUPS)
+
+
+def match_intent(scan: MessageScan) -> str:
+    """Applique INTENT_RULES au message"""
+    for intent, required in INTENT_RULES:
+        if all(scan.has(group) for group in required):
+            return intent
+    return DEFAULT_INTENT
+
+
+def extract_after_marker(scan: MessageScan) -> List[str]:
+    """Textes suivant chaque marqueur de sujet présent ("sur", "concernant"...), dans l'ordre de la table"""
+    fragments = []
+    if not scan.has("topic_marker"):
+        return fragments
+    for keyword in KEYWORD_GROUPS["topic_marker"]:
+        position = scan.message_lower.find(keyword)
+        if position != -1:
+            idx = position + len(keyword)
+            fragments.append(scan.message[idx:].strip().split(",")[0].split(".")[0].strip())
+    return fragments
+
+
+def detect_frequency(scan: MessageScan) -> Optional[str]:
+    """Fréquence de veille suggérée par le message, ou None"""
+    for group, frequency in FREQUENCY_HINTS:
+        if scan.has(group):
+            return frequency
+    return None
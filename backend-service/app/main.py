@@ -2,44 +2,63 @@
 Backend Service - Version robuste sans points d'échec
 """
 
-from fastapi import FastAPI, HTTPException, UploadFile, File
+from fastapi import FastAPI, HTTPException, UploadFile, File, Request
 from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 
 from pydantic import BaseModel
-from typing import List, Dict, Optional, AsyncGenerator
+from typing import Any, List, Dict, Optional, AsyncGenerator
 import os
-import re
-import requests
 import json
 import asyncio
+import time
 from datetime import datetime, timedelta
 from loguru import logger
 from importlib import metadata
 from app.business_prompts import get_business_prompt, get_available_business_types, get_business_type_display_name, get_trusted_sources, TRUSTED_SOURCES_INSTRUCTION
 from app.language_detector import detect_query_language
+from app.intent_matcher import (
+    scan_message, match_intent, extract_after_marker, detect_frequency, SEND_SUFFIX_RE
+)
 from app.context_manager import (
     save_text_context, save_document_context, get_user_context,
-    get_user_context_info, delete_user_context, get_context_for_prompt,
+    get_user_context_info, delete_user_context,
     extract_text_from_file
 )
 from app.rag_memory import (
-    add_conversation, get_history_for_prompt, get_full_history,
+    add_conversation, get_full_history,
     clear_user_memory, search_history
 )
-from app.app_knowledge import build_context_prompt, ANALYSIS_TYPES, SECTORS, WATCH_FREQUENCIES, GUIDES, FAQ
+from app.app_knowledge import ANALYSIS_TYPES, SECTORS, WATCH_FREQUENCIES, GUIDES, FAQ
+from app.streaming import relay_until_disconnect, ClientDisconnected, GenerationHub, ReplayUnavailable
+from app.single_flight import SingleFlight, make_flight_key
+from app.prompt_inputs import gather_prompt_inputs
+from app.assistant_context import build_assistant_context, invalidate_assistant_context
+from app.prompt_templates import PROMPT_TEMPLATES
+from app.prompt_budget import (
+    estimate_tokens, truncate_to_tokens, fit_prompt_sections,
+    MAX_USER_PROMPT_TOKENS
+)
+from app import metrics
+from app.result_cache import make_analysis_key, get_cached_analysis, store_analysis, MemoryResultCache
+from app.analysis_jobs import AnalysisJobRunner, JobQueueFull, create_job_store, FINISHED_STATUSES
 from app.assistant_actions import (
     ActionType, ProposedAction, ActionResult, execute_action,
     build_action_from_intent, ACTION_DEFINITIONS
 )
 
-# Import SDK Perplexity (compatible OpenAI SDK)
-try:
-    from openai import OpenAI
-    OPENAI_SDK_AVAILABLE = True
-except ImportError:
-    OPENAI_SDK_AVAILABLE = False
-    logger.error("SDK OpenAI package not available (required for Perplexity API compatibility)")
+from app.perplexity_client import (
+    PERPLEXITY_API_KEY, OPENAI_SDK_AVAILABLE,
+    get_perplexity_client, warmup_perplexity_client, close_perplexity_client
+)
+from app.admission import (
+    Priority, AdmissionTimeout, priority_for_task, perplexity_slot, retry_rate_limited,
+    admitted_completion, estimate_request_tokens, is_rate_limit_error, admission_snapshot
+)
+from app.document_client import (
+    VECTOR_SERVICE_URL, DOCUMENT_METADATA_CACHE_SIZE, DOCUMENT_METADATA_CACHE_TTL,
+    search_documents, fetch_documents_metadata, close_internal_client
+)
 
 app = FastAPI(title="Backend Intelligence Service", description="Rapports longs cabinet de conseil - version robuste")
 
@@ -53,11 +72,23 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Configuration - Perplexity API
-PERPLEXITY_API_KEY = os.getenv("PERPLEXITY_API_KEY", "")
-PERPLEXITY_BASE_URL = "https://api.perplexity.ai"
-VECTOR_SERVICE_URL = "http://vector-service:8002"
-DOCUMENT_SERVICE_URL = "http://document-service:8001"
+
+@app.on_event("startup")
+async def startup_event():
+    """Ouvre le pool de connexions Perplexity partagé et lance les workers de jobs"""
+    await warmup_perplexity_client()
+    await _job_runner.start()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Ferme proprement les connexions sortantes"""
+    await _job_runner.stop()
+    await close_perplexity_client()
+    await close_internal_client()
+
+# Configuration - services internes (Perplexity: voir app.perplexity_client,
+# vector-service et document-service: voir app.document_client)
 MEMORY_SERVICE_URL = os.getenv("MEMORY_SERVICE_URL", "http://memory-service:8008")
 
 # Configuration multi-modèles Sonar optimisée par cas d'usage
@@ -72,8 +103,16 @@ def get_model_for_task(task_type: str) -> str:
     """Sélectionne le modèle Sonar approprié selon la tâche"""
     return PERPLEXITY_MODELS.get(task_type, PERPLEXITY_MODELS["chat"])
 
-# Cache pour les métadonnées des documents
-_document_metadata_cache = {}
+# Cache pour les métadonnées des documents (LRU + TTL, invalidé par document-service)
+_document_metadata_cache = MemoryResultCache(
+    max_entries=DOCUMENT_METADATA_CACHE_SIZE,
+    ttl=DOCUMENT_METADATA_CACHE_TTL
+)
+
+# Regroupement des générations identiques simultanées (double clic, veilles communes)
+_perplexity_flights = SingleFlight("perplexity_calls")
+_analysis_flights = SingleFlight("analyses")
+_stream_hub = GenerationHub()
 
 # Modèles Pydantic
 class BusinessAnalysisRequest(BaseModel):
@@ -84,6 +123,7 @@ class BusinessAnalysisRequest(BaseModel):
     include_recommendations: Optional[bool] = True  # Option pour inclure/exclure les recommandations
     language: Optional[str] = "fr"  # Langue de réponse: 'fr' ou 'en'
     user_id: Optional[str] = None  # ID utilisateur pour charger ses contextes
+    use_cache: Optional[bool] = True  # False pour forcer une nouvelle génération
 
 class AnalysisResponse(BaseModel):
     analysis_type: str
@@ -105,6 +145,7 @@ class SchedulerAnalysisRequest(BaseModel):
     analysis_type: str
     sector: Optional[str] = "general"
     deep_analysis: Optional[bool] = False
+    use_cache: Optional[bool] = True  # False pour forcer une nouvelle génération
 
 class ChatResponse(BaseModel):
     response: str
@@ -113,30 +154,20 @@ class ChatResponse(BaseModel):
     metadata: Dict
     timestamp: str
 
-def get_document_metadata(doc_id: int) -> Optional[Dict]:
-    """Récupère les métadonnées réelles d'un document depuis le document-service"""
-    # Vérifier le cache d'abord
-    if doc_id in _document_metadata_cache:
-        return _document_metadata_cache[doc_id]
-    
-    try:
-        response = requests.get(
-            f"{DOCUMENT_SERVICE_URL}/document/{doc_id}",
-            timeout=5
-        )
-        
-        if response.status_code == 200:
-            metadata = response.json()
-            # Mettre en cache
-            _document_metadata_cache[doc_id] = metadata
-            return metadata
-        else:
-            logger.warning(f"Failed to get document metadata for doc_id={doc_id}: {response.status_code}")
-            return None
-            
-    except Exception as e:
-        logger.error(f"Error fetching document metadata for doc_id={doc_id}: {e}")
-        return None
+async def get_documents_metadata(doc_ids: List[int]) -> Dict[int, Dict]:
+    """Métadonnées de plusieurs documents: cache d'abord, le reste en un seul appel"""
+    found = {}
+    for doc_id in doc_ids:
+        entry = _document_metadata_cache.get(doc_id)
+        if entry:
+            found[doc_id] = entry["value"]
+    missing = [doc_id for doc_id in doc_ids if doc_id not in found]
+    if missing:
+        fetched = await fetch_documents_metadata(missing)
+        for doc_id, doc_metadata in fetched.items():
+            _document_metadata_cache.set(doc_id, doc_metadata)
+        found.update(fetched)
+    return found
 
 async def save_conversation_to_memory(
     user_id: str,
@@ -216,49 +247,29 @@ async def save_document_to_memory(
     except Exception as e:
         logger.warning(f"Failed to save document to memory service: {e}")
 
-def search_documents_safe(query: str, top_k: int = 10) -> List[Dict]:
-    """Recherche vectorielle avec gestion d'erreurs robuste"""
-    try:
-        response = requests.post(
-            f"{VECTOR_SERVICE_URL}/search",
-            json={"query": query, "top_k": top_k},
-            timeout=10
-        )
-        
-        if response.status_code == 200:
-            result = response.json()
-            # The vector-service returns a LIST of results. Also support dict forms.
-            if isinstance(result, list):
-                return result
-            if isinstance(result, dict):
-                return result.get("results", result.get("data", []))
-            return []
-        else:
-            logger.warning(f"Vector search failed: {response.status_code}")
-            return []
-            
-    except requests.exceptions.Timeout:
-        logger.error("Vector search timeout")
-        return []
-    except requests.exceptions.ConnectionError:
-        logger.error("Vector search connection error")
-        return []
-    except Exception as e:
-        logger.error(f"Vector search error: {e}")
-        return []
+async def search_documents_safe(query: str, top_k: int = 10) -> List[Dict]:
+    """Recherche vectorielle avec gestion d'erreurs robuste (client partagé, non bloquant)"""
+    return await search_documents(query, top_k=top_k)
+
+async def enrich_sources_with_apa(documents: List[Dict]) -> List[Dict]:
+    """Enrichit toutes les sources d'un rapport: métadonnées récupérées en un seul aller-retour"""
+    doc_ids = [d.get("doc_id") for d in documents if isinstance(d.get("doc_id"), int)]
+    metadata_by_id = await get_documents_metadata(doc_ids) if doc_ids else {}
+    return [
+        enrich_source_with_apa(d, i + 1, metadata_by_id.get(d.get("doc_id")))
+        for i, d in enumerate(documents)
+    ]
+
+def enrich_source_with_apa(doc: Dict, index: int, metadata: Optional[Dict] = None) -> Dict:
+    """Enrichit une source avec métadonnées APA pour citations académiques
 
-def enrich_source_with_apa(doc: Dict, index: int) -> Dict:
-    """Enrichit une source avec métadonnées APA pour citations académiques"""
+    Les métadonnées du document sont fournies par l'appelant (voir enrich_sources_with_apa).
+    """
     doc_id = doc.get("doc_id", "N/A")
     text = str(doc.get("text", ""))
     score = doc.get("score", 0)
     segment_index = doc.get("segment_index", 0)
     
-    # Récupérer les vraies métadonnées du document
-    metadata = None
-    if isinstance(doc_id, int):
-        metadata = get_document_metadata(doc_id)
-    
     # Utiliser les vraies métadonnées si disponibles
     if metadata:
         filename = metadata.get("filename", "Document inconnu")
@@ -344,67 +355,57 @@ def format_context_safe(documents: List[Dict]) -> str:
     
     return context
 
-async def create_optimized_prompt(business_type: str, analysis_type: str, query: str, context: str, include_recommendations: bool = True, language: str = "fr", user_id: Optional[str] = None) -> str:
-    """Crée prompts concis et efficaces pour rapports de cabinet de conseil avec sonar-pro
+# ============================================================================
+# Templates de rapports - compilés une seule fois dans PROMPT_TEMPLATES
+# ============================================================================
+# Format str.format: seuls {query}, {context} et les dates sont remplis à chaque
+# requête; le texte fixe (plusieurs Ko par template) est découpé à l'import.
 
-    Args:
-        business_type: Type de métier
-        analysis_type: Type d'analyse
-        query: Requête d'analyse
-        context: Contexte documentaire
-        include_recommendations: Si True, inclut les recommandations stratégiques
-        language: Langue de réponse ('fr' pour français, 'en' pour anglais)
-    """
-    
-    # Instruction de langue
-    language_instruction = ""
-    if language == "en":
-        language_instruction = """
+LANGUAGE_INSTRUCTIONS = {
+    "en": """
 ⚠️ **LANGUAGE INSTRUCTION - RESPOND IN ENGLISH**:
 The user query is in English. You MUST respond entirely in English.
 All sections, titles, content, and recommendations must be written in English.
 
-"""
-    else:
-        language_instruction = """
+""",
+    "fr": """
 ⚠️ **INSTRUCTION DE LANGUE - RÉPONDRE EN FRANÇAIS**:
 La requête utilisateur est en français. Tu DOIS répondre entièrement en français.
 Toutes les sections, titres, contenus et recommandations doivent être rédigés en français.
 
+""",
+}
+
+NO_RECOMMENDATIONS_INSTRUCTION = """
+
+⚠️ **INSTRUCTION SPÉCIALE - SANS RECOMMANDATIONS**:
+Ce rapport doit être une analyse FACTUELLE UNIQUEMENT.
+- NE PAS inclure de section "Recommandations Stratégiques"
+- NE PAS inclure de section "Plan d'Action"
+- NE PAS inclure de conseils ou suggestions d'amélioration
+- Se concentrer UNIQUEMENT sur l'analyse, les données et les constats
+- Remplacer la section recommandations par une section "Conclusions et Points Clés" qui résume les faits sans préconisations
+
 """
-    
-    # Integration du contexte utilisateur et historique (RAG)
-    # Multi-contexte: recupere TOUS les contextes actifs depuis memory-service
-    user_context_section = ""
-    user_history_section = ""
-    if user_id:
-        try:
-            user_context_section = await get_context_for_prompt(user_id, max_length=4000)
-            user_history_section = get_history_for_prompt(user_id, query, max_length=800)
-        except Exception as e:
-            logger.warning(f"Error fetching user context/history: {e}")
-    
-    # Calcul des dates pour contrainte temporelle (dernière semaine)
-    date_fin = datetime.now().strftime("%d/%m/%Y")
-    date_debut = (datetime.now() - timedelta(days=7)).strftime("%d/%m/%Y")
-    time_constraint = f"""
+
+# Contrainte temporelle (dernière semaine) des synthèses exécutives
+TIME_CONSTRAINT_TEMPLATE = """
 ## CONTRAINTE TEMPORELLE OBLIGATOIRE
 IMPORTANT: Concentre tes recherches sur les sources publiees entre le {date_debut} et le {date_fin} (dernière semaine uniquement).
 Privilegie les actualites et donnees les plus recentes. Les sources plus anciennes ne doivent etre utilisees que pour le contexte historique.
 
 """
-    
-    # Synthese Executive = Rapport exhaustif (60 sources) avec contrainte temporelle 1 semaine
-    if analysis_type.lower() == "synthese_executive":
-        prompt_templates_deep = {
-            "finance_banque": f"""Tu es un consultant senior McKinsey specialise en strategie bancaire - Synthese Executive.
+
+# Synthese Executive = Rapport exhaustif (60 sources) avec contrainte temporelle 1 semaine
+REPORT_TEMPLATES_DEEP = {
+    "finance_banque": """Tu es un consultant senior McKinsey specialise en strategie bancaire - Synthese Executive.
 
 {time_constraint}
 
 **MISSION** : {query}
 
 **CONTEXTE DOCUMENTAIRE** :
-{context[:5000]}
+{context}
 
 **FORMAT** : Rapport ultra-detaille (8000-10000 mots) avec 60 sources MINIMUM
 
@@ -467,13 +468,13 @@ Phase 2 : 18 sources cabinets de conseil maximum (30%)
 
 Genere maintenant ce rapport exhaustif :""",
 
-            "tech_digital": f"""Tu es un consultant BCG expert en transformation digitale - Synthese Executive.
+    "tech_digital": """Tu es un consultant BCG expert en transformation digitale - Synthese Executive.
 
 {time_constraint}
 
 **MISSION** : {query}
 
-**CONTEXTE** : {context[:5000]}
+**CONTEXTE** : {context}
 
 **FORMAT** : Rapport ultra-detaille (8000-10000 mots) avec 60 sources MINIMUM
 
@@ -494,13 +495,13 @@ Genere maintenant ce rapport exhaustif :""",
 
 Genere maintenant ce rapport exhaustif :""",
 
-            "retail_commerce": f"""Tu es un consultant Bain expert retail - Synthese Executive.
+    "retail_commerce": """Tu es un consultant Bain expert retail - Synthese Executive.
 
 {time_constraint}
 
 **MISSION** : {query}
 
-**CONTEXTE** : {context[:5000]}
+**CONTEXTE** : {context}
 
 **FORMAT** : Rapport ultra-detaille (8000-10000 mots) avec 60 sources MINIMUM
 
@@ -520,21 +521,16 @@ Genere maintenant ce rapport exhaustif :""",
 - Rapport 8000-10000 mots
 
 Genere maintenant ce rapport exhaustif :"""
-        }
-        
-        deep_prompt = prompt_templates_deep.get(business_type, prompt_templates_deep["finance_banque"])
-        # Ajouter contexte utilisateur et historique si disponibles
-        full_prompt = language_instruction + user_context_section + user_history_section + deep_prompt
-        return full_prompt
-    
-    # Templates standards (40-60 sources) - code existant
-    prompt_templates = {
-        "finance_banque": f"""Tu es un consultant senior McKinsey spécialisé en stratégie bancaire.
+}
+
+# Templates standards (40-60 sources)
+REPORT_TEMPLATES = {
+    "finance_banque": """Tu es un consultant senior McKinsey spécialisé en stratégie bancaire.
 
 **MISSION** : {query}
 
 **CONTEXTE DOCUMENTAIRE** :
-{context[:5000]}
+{context}
 
 **FORMAT ATTENDU** :
 
@@ -678,11 +674,11 @@ source: (Auteur, Année)
 
 Génère maintenant ce rapport ultra-documenté et précis :""",
 
-        "tech_digital": f"""Tu es un consultant BCG expert en transformation digitale.
+    "tech_digital": """Tu es un consultant BCG expert en transformation digitale.
 
 **MISSION** : {query}
 
-**CONTEXTE** : {context[:5000]}
+**CONTEXTE** : {context}
 
 **FORMAT** : Rapport stratégique professionnel (6000-8000 mots) avec :
 
@@ -782,11 +778,11 @@ EXIGENCES: MINIMUM 25 données chiffrées, 3+ tableaux, croisement sources forma
 
 Génère maintenant ce rapport :""",
 
-        "retail_commerce": f"""Tu es un consultant Bain expert en retail et commerce.
+    "retail_commerce": """Tu es un consultant Bain expert en retail et commerce.
 
 **MISSION** : {query}
 
-**CONTEXTE** : {context[:5000]}
+**CONTEXTE** : {context}
 
 **FORMAT** : Rapport stratégique professionnel (6000-8000 mots) avec :
 
@@ -886,9 +882,54 @@ En synthèse, le retail français bascule vers des modèles hybrides où l'excel
 EXIGENCES: MINIMUM 25 données chiffrées, 3+ tableaux, sources format APA (Auteur, Année)
 
 Génère maintenant ce rapport :"""
-    }
+}
+
+PROMPT_TEMPLATES.register("report/time_constraint", TIME_CONSTRAINT_TEMPLATE)
+for _business_type, _source in REPORT_TEMPLATES_DEEP.items():
+    PROMPT_TEMPLATES.register(f"report_deep/{_business_type}", _source)
+for _business_type, _source in REPORT_TEMPLATES.items():
+    PROMPT_TEMPLATES.register(f"report/{_business_type}", _source)
+
+async def create_optimized_prompt(business_type: str, analysis_type: str, query: str, context: str, include_recommendations: bool = True, language: str = "fr", user_context: str = "", user_history: str = "") -> str:
+    """Crée prompts concis et efficaces pour rapports de cabinet de conseil avec sonar-pro
+
+    Args:
+        business_type: Type de métier
+        analysis_type: Type d'analyse
+        query: Requête d'analyse
+        context: Contexte documentaire
+        include_recommendations: Si True, inclut les recommandations stratégiques
+        language: Langue de réponse ('fr' pour français, 'en' pour anglais)
+        user_context: Contextes actifs de l'utilisateur (voir gather_prompt_inputs)
+        user_history: Historique RAG de l'utilisateur (voir gather_prompt_inputs)
+    """
+    
+    # Instruction de langue
+    language_instruction = LANGUAGE_INSTRUCTIONS["en" if language == "en" else "fr"]
+    
+    # Integration du contexte utilisateur et historique (RAG)
+    # Multi-contexte: TOUS les contextes actifs, récupérés en amont en parallèle de la recherche
+    user_context_section = user_context or ""
+    user_history_section = user_history or ""
+    
+    # Synthese Executive = Rapport exhaustif (60 sources) avec contrainte temporelle 1 semaine
+    if analysis_type.lower() == "synthese_executive":
+        # Calcul des dates pour contrainte temporelle (dernière semaine)
+        date_fin = datetime.now().strftime("%d/%m/%Y")
+        date_debut = (datetime.now() - timedelta(days=7)).strftime("%d/%m/%Y")
+        time_constraint = PROMPT_TEMPLATES.render("report/time_constraint", date_debut=date_debut, date_fin=date_fin)
+        
+        deep_prompt = PROMPT_TEMPLATES.render(
+            f"report_deep/{business_type}", default="report_deep/finance_banque",
+            time_constraint=time_constraint, query=query, context=context,
+            date_debut=date_debut, date_fin=date_fin
+        )
+        # Ajouter contexte utilisateur et historique si disponibles
+        full_prompt = language_instruction + user_context_section + user_history_section + deep_prompt
+        return full_prompt
     
-    base_prompt = prompt_templates.get(business_type, prompt_templates["finance_banque"])
+    # Templates standards (40-60 sources) - code existant
+    base_prompt = PROMPT_TEMPLATES.render(f"report/{business_type}", default="report/finance_banque", query=query, context=context)
     
     # Ajouter instruction de langue
     # Ajouter contexte utilisateur et historique si disponibles
@@ -896,54 +937,18 @@ Génère maintenant ce rapport :"""
     
     # Si recommandations désactivées, ajouter instruction explicite
     if not include_recommendations:
-        no_reco_instruction = """
-
-⚠️ **INSTRUCTION SPÉCIALE - SANS RECOMMANDATIONS**:
-Ce rapport doit être une analyse FACTUELLE UNIQUEMENT.
-- NE PAS inclure de section "Recommandations Stratégiques"
-- NE PAS inclure de section "Plan d'Action"
-- NE PAS inclure de conseils ou suggestions d'amélioration
-- Se concentrer UNIQUEMENT sur l'analyse, les données et les constats
-- Remplacer la section recommandations par une section "Conclusions et Points Clés" qui résume les faits sans préconisations
-
-"""
-        base_prompt = no_reco_instruction + base_prompt
+        base_prompt = NO_RECOMMENDATIONS_INSTRUCTION + base_prompt
     
     return base_prompt
 
-def call_perplexity_safe(
-    prompt: str, 
-    business_type: str, 
-    rag_context: str = "",
-    task_type: str = "chat"  # NOUVEAU PARAMÈTRE
-) -> str:
-    """Appel Perplexity sécurisé avec RAG interne et recherche web"""
-    try:
-        if not PERPLEXITY_API_KEY or PERPLEXITY_API_KEY == "":
-            return "⚠️ **Configuration Perplexity requise**\n\nVeuillez configurer la variable PERPLEXITY_API_KEY dans votre fichier .env"
-        
-        # Vérifier SDK OpenAI (compatible Perplexity)
-        if not OPENAI_SDK_AVAILABLE:
-            return "❌ **SDK OpenAI manquant**\n\nCe SDK est requis pour la compatibilité avec Perplexity API.\nVeuillez installer: pip install openai"
-        
-        # Sélection dynamique du modèle selon la tâche
-        selected_model = get_model_for_task(task_type)
-        
-        # Ajuster max_tokens selon le modèle
-        # sonar-pro (12000 tokens) est utilisé pour TOUS les rapports (40-60 sources)
-        max_tokens_config = {
-            "sonar": 8000,        # +2000 pour chat enrichi avec paragraphes
-            "sonar-pro": 16000,   # +4000 pour rapports détaillés avec contenu narratif
-            "sonar-reasoning-pro": 20000  # +4000 pour analyses profondes (migration depuis sonar-reasoning)
-        }
-        max_tokens = max_tokens_config.get(selected_model, 6000)
-        
-        logger.info(f"Using model: {selected_model} for task: {task_type} (max_tokens: {max_tokens})")
-        
-        # System prompt générique avec sources institutionnelles et cabinets conseil uniquement
-        system_prompt = f"""Tu es un consultant senior spécialisé en stratégie d'entreprise.
+# ============================================================================
+# Messages Perplexity des rapports - partie fixe compilée à l'import
+# ============================================================================
+
+# System prompt générique avec sources institutionnelles et cabinets conseil uniquement
+REPORT_SYSTEM_PROMPT_TEMPLATE = """Tu es un consultant senior spécialisé en stratégie d'entreprise.
 
-{TRUSTED_SOURCES_INSTRUCTION}
+{trusted_sources}
 
 RÈGLES OBLIGATOIRES:
 
@@ -979,9 +984,9 @@ RÈGLES OBLIGATOIRES:
    - EXCLURE: médias, presse, blogs, forums, entreprises privées
 
 5. STYLE: Professionnel, générique, sans mention de secteur spécifique."""
-        
-        # Prompt enrichi avec instructions explicites de citation web
-        enhanced_prompt = f"""{prompt}
+
+# Prompt enrichi avec instructions explicites de citation web
+RESEARCH_INSTRUCTIONS_TEMPLATE = """{prompt}
 
 ═══════════════════════════════════════════════════════════════
 
@@ -1101,33 +1106,127 @@ QUALITÉ DU CONTENU:
 ═══════════════════════════════════════════════════════════════
 
 Réponds maintenant avec recherche approfondie et croisement systématique des sources."""
+
+# Le system prompt n'a aucun champ variable: rendu et compté une seule fois
+REPORT_SYSTEM_PROMPT = PROMPT_TEMPLATES.register(
+    "system/report", REPORT_SYSTEM_PROMPT_TEMPLATE, trusted_sources=TRUSTED_SOURCES_INSTRUCTION
+).render()
+REPORT_SYSTEM_PROMPT_TOKENS = estimate_tokens(REPORT_SYSTEM_PROMPT)
+_research_instructions = PROMPT_TEMPLATES.register("research/report", RESEARCH_INSTRUCTIONS_TEMPLATE)
+
+def build_perplexity_request(prompt: str, task_type: str = "chat") -> Dict:
+    """Construit les paramètres de l'appel Perplexity (modèle, messages, max_tokens)
+
+    Partagé par l'appel complet (call_perplexity_safe) et le streaming
+    (stream_perplexity_safe) pour que les deux envoient exactement le même prompt.
+    """
+    # Sélection dynamique du modèle selon la tâche
+    selected_model = get_model_for_task(task_type)
+    
+    # Ajuster max_tokens selon le modèle
+    # sonar-pro (12000 tokens) est utilisé pour TOUS les rapports (40-60 sources)
+    max_tokens_config = {
+        "sonar": 8000,        # +2000 pour chat enrichi avec paragraphes
+        "sonar-pro": 16000,   # +4000 pour rapports détaillés avec contenu narratif
+        "sonar-reasoning-pro": 20000  # +4000 pour analyses profondes (migration depuis sonar-reasoning)
+    }
+    max_tokens = max_tokens_config.get(selected_model, 6000)
+    
+    logger.info(f"Using model: {selected_model} for task: {task_type} (max_tokens: {max_tokens})")
+    
+    # Plafond de sécurité: seule la partie variable (prompt) est réduite, jamais
+    # les instructions de recherche ajoutées ci-dessous
+    prompt_tokens = estimate_tokens(prompt)
+    if prompt_tokens > MAX_USER_PROMPT_TOKENS:
+        logger.warning(f"Prompt très long (~{prompt_tokens} tokens), réduit à {MAX_USER_PROMPT_TOKENS} tokens")
+        prompt = truncate_to_tokens(prompt, MAX_USER_PROMPT_TOKENS, marker="[...]")
+    
+    # System prompt générique avec sources institutionnelles et cabinets conseil uniquement
+    system_prompt = REPORT_SYSTEM_PROMPT
+    
+    # Prompt enrichi avec instructions explicites de citation web
+    enhanced_prompt = _research_instructions.render(prompt=prompt)
+
+    # Partie fixe comptée à l'import, seul le prompt variable est mesuré
+    input_tokens = REPORT_SYSTEM_PROMPT_TOKENS + _research_instructions.static_tokens + estimate_tokens(prompt)
+    metrics.increment("prompt_input_tokens_total", input_tokens)
+    metrics.set_gauge("prompt_input_tokens_last", input_tokens)
+    
+    return {
+        "model": selected_model,  # ← Modèle dynamique
+        "messages": [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": enhanced_prompt}
+        ],
+        "temperature": 0.2,  # Légèrement plus créatif pour paragraphes narratifs fluides
+        "max_tokens": max_tokens,  # ← Dynamique selon modèle
+        "timeout": 600.0  # 10 minutes pour rapports longs avec paragraphes narratifs
+    }
+
+
+def perplexity_config_error() -> Optional[str]:
+    """Message d'erreur utilisateur si Perplexity n'est pas utilisable, None sinon"""
+    if not PERPLEXITY_API_KEY or PERPLEXITY_API_KEY == "":
+        return "⚠️ **Configuration Perplexity requise**\n\nVeuillez configurer la variable PERPLEXITY_API_KEY dans votre fichier .env"
+    
+    # Vérifier SDK OpenAI (compatible Perplexity)
+    if not OPENAI_SDK_AVAILABLE:
+        return "❌ **SDK OpenAI manquant**\n\nCe SDK est requis pour la compatibilité avec Perplexity API.\nVeuillez installer: pip install openai"
+    
+    return None
+
+
+def perplexity_busy_message(model: str) -> str:
+    """Message renvoyé quand Perplexity est saturé (file pleine ou 429 persistant)
+
+    Commence par ⚠️ pour ne jamais être mis en cache comme un rapport.
+    """
+    return (
+        f"⚠️ **Service Perplexity momentanément saturé ({model})**\n\n"
+        "Trop de demandes sont en cours. Votre demande n'a pas pu être traitée, "
+        "merci de réessayer dans quelques minutes."
+    )
+
+
+async def call_perplexity_safe(
+    prompt: str, 
+    business_type: str, 
+    rag_context: str = "",
+    task_type: str = "chat",  # NOUVEAU PARAMÈTRE
+    priority: Optional[Priority] = None
+) -> str:
+    """Appel Perplexity sécurisé avec RAG interne et recherche web
+
+    L'appel passe par la file d'admission du modèle (priorité déduite de
+    task_type si non fournie: chat > rapport interactif > veille planifiée).
+    """
+    try:
+        config_error = perplexity_config_error()
+        if config_error:
+            return config_error
         
-        # Client Perplexity utilisant le SDK OpenAI pour compatibilité
-        try:
-            client = OpenAI(
-                api_key=PERPLEXITY_API_KEY,
-                base_url=PERPLEXITY_BASE_URL,
-                timeout=600.0  # 10 minutes pour rapports longs avec paragraphes narratifs
-            )
-            
-            # Vérifier taille prompt
-            if len(enhanced_prompt) > 15000:
-                logger.warning(f"Prompt très long ({len(enhanced_prompt)} chars), troncature appliquée")
-                enhanced_prompt = enhanced_prompt[:15000] + "\n\n[...Prompt tronqué pour limites techniques. Continuer l'analyse avec les éléments disponibles...]"
-            
-            response = client.chat.completions.create(
-                model=selected_model,  # ← Modèle dynamique
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": enhanced_prompt}
-                ],
-                temperature=0.2,  # Légèrement plus créatif pour paragraphes narratifs fluides
-                max_tokens=max_tokens  # ← Dynamique selon modèle
-            )
-            
+        request_params = build_perplexity_request(prompt, task_type)
+        selected_model = request_params["model"]
+        if priority is None:
+            priority = priority_for_task(task_type)
+        
+        # Client Perplexity partagé (AsyncOpenAI, pool keep-alive)
+        async def create_completion() -> str:
+            client = get_perplexity_client()
+            response = await admitted_completion(client, priority, **request_params)
             return response.choices[0].message.content
+        
+        # Un prompt identique déjà en cours n'est pas renvoyé une seconde fois
+        try:
+            return await _perplexity_flights.do(make_flight_key(request_params), create_completion)
             
+        except AdmissionTimeout as queue_error:
+            logger.warning(f"Perplexity queue full ({priority.name.lower()}): {queue_error}")
+            return perplexity_busy_message(selected_model)
         except Exception as api_error:
+            if is_rate_limit_error(api_error):
+                logger.error(f"Perplexity rate limit persists for {selected_model}: {api_error}")
+                return perplexity_busy_message(selected_model)
             logger.error(f"Perplexity API error with {selected_model}: {api_error}")
             return f"❌ **Erreur API Perplexity ({selected_model})**\n\n{str(api_error)[:300]}\n\nVérifiez votre clé API et votre quota."
         
@@ -1135,44 +1234,165 @@ Réponds maintenant avec recherche approfondie et croisement systématique des s
         logger.error(f"Critical error in Perplexity call: {e}")
         return f"❌ **Erreur critique**\n\n{str(e)[:300]}"
 
-async def generate_business_analysis_safe(business_type: str, analysis_type: str, query: str, title: str = None, user_id: Optional[str] = None) -> AnalysisResponse:
-    """Génère analyse avec gestion d'erreurs complète + sauvegarde memory-service"""
+
+async def stream_perplexity_safe(
+    prompt: str,
+    business_type: str,
+    rag_context: str = "",
+    task_type: str = "analysis",
+    priority: Optional[Priority] = None
+) -> AsyncGenerator[str, None]:
+    """Variante streaming de call_perplexity_safe: produit les deltas au fil de l'eau
+
+    Les erreurs sont renvoyées comme un fragment de texte (même format que
+    call_perplexity_safe) pour que l'appelant n'ait pas à les distinguer.
+    La place dans la file d'admission est gardée jusqu'à la fin du flux.
+    """
+    config_error = perplexity_config_error()
+    if config_error:
+        yield config_error
+        return
+    
+    request_params = build_perplexity_request(prompt, task_type)
+    selected_model = request_params["model"]
+    if priority is None:
+        priority = priority_for_task(task_type)
+    estimated = estimate_request_tokens(request_params["messages"], request_params["max_tokens"])
+    
+    stream = None
+    try:
+        async with perplexity_slot(selected_model, priority, estimated) as slot:
+            client = get_perplexity_client()
+            # Relance possible tant qu'aucun delta n'a été reçu
+            stream = await retry_rate_limited(
+                selected_model,
+                lambda: client.chat.completions.create(**request_params, stream=True),
+                slot=slot
+            )
+            usage = None
+            async for event in stream:
+                usage = getattr(event, "usage", None) or usage
+                if not event.choices:
+                    continue
+                content = getattr(event.choices[0].delta, "content", None)
+                if content:
+                    yield content
+            slot.settle(usage)
+    except AdmissionTimeout as queue_error:
+        logger.warning(f"Perplexity queue full ({priority.name.lower()}): {queue_error}")
+        yield "\n\n" + perplexity_busy_message(selected_model)
+    except Exception as api_error:
+        logger.error(f"Perplexity streaming error with {selected_model}: {api_error}")
+        if is_rate_limit_error(api_error):
+            yield "\n\n" + perplexity_busy_message(selected_model)
+        else:
+            yield f"\n\n❌ **Erreur API Perplexity ({selected_model})**\n\n{str(api_error)[:300]}\n\nVérifiez votre clé API et votre quota."
+    finally:
+        # Fermer la réponse amont, y compris sur annulation (client déconnecté)
+        if stream is not None:
+            await stream.close()
+
+
+async def generate_business_analysis_safe(business_type: str, analysis_type: str, query: str, title: str = None, user_id: Optional[str] = None, use_cache: bool = True, priority: Priority = Priority.INTERACTIVE) -> AnalysisResponse:
+    """Génère analyse avec gestion d'erreurs complète + sauvegarde memory-service
+
+    Un rapport identique (même requête normalisée, type, métier, langue et
+    utilisateur) généré il y a moins de ANALYSIS_CACHE_TTL est renvoyé depuis
+    le cache sauf si use_cache=False. Si ce même rapport est déjà en cours de
+    génération, l'appel attend son résultat au lieu d'en lancer un second.
+    """
+    detected_language = detect_query_language(query)
+    cache_key = make_analysis_key(query, analysis_type, business_type, detected_language, user_id)
+    if use_cache:
+        cached = await get_cached_analysis(cache_key)
+        if cached:
+            logger.info(f"⚡ Analyse servie depuis le cache ({analysis_type}, générée le {datetime.fromtimestamp(cached['stored_at']).isoformat()})")
+            response = AnalysisResponse(**cached["value"])
+            if title:
+                response.title = title
+            response.metadata = {
+                **response.metadata,
+                "cache": "hit",
+                "cached_at": datetime.fromtimestamp(cached["stored_at"]).isoformat(),
+            }
+            if user_id:
+                asyncio.create_task(save_conversation_to_memory(
+                    user_id=user_id,
+                    query=query,
+                    response=response.content[:8000],
+                    conversation_type="analysis",
+                    analysis_type=analysis_type,
+                    business_type=business_type
+                ))
+            return response
+    
+    joined = _analysis_flights.in_flight(cache_key)
+    response = await _analysis_flights.do(
+        cache_key,
+        lambda: _run_business_analysis(
+            business_type, analysis_type, query, title, user_id,
+            detected_language, cache_key, use_cache, priority
+        )
+    )
+    if joined:
+        logger.info(f"🔗 Analyse identique déjà en cours rejointe ({analysis_type})")
+        response = response.copy(update={
+            "title": title or response.title,
+            "metadata": {**response.metadata, "coalesced": True},
+        })
+    return response
+
+
+async def _run_business_analysis(
+    business_type: str,
+    analysis_type: str,
+    query: str,
+    title: Optional[str],
+    user_id: Optional[str],
+    detected_language: str,
+    cache_key: str,
+    use_cache: bool,
+    priority: Priority = Priority.INTERACTIVE
+) -> AnalysisResponse:
+    """Pipeline complet RAG + Perplexity (une seule exécution par clé en cours)"""
     try:
         is_deep_analysis = "approfondi" in analysis_type.lower()
         logger.info(f"Starting analysis: {business_type}/{analysis_type} (Deep: {is_deep_analysis})")
         
-        # 1. Recherche documents sécurisée (augmenté à 12 pour plus de contexte)
-        logger.info("📊 [1/5] Recherche documents RAG...")
-        documents = search_documents_safe(query, top_k=12)
-        logger.info(f"✓ [1/5] Trouvé {len(documents)} documents RAG")
+        # 1. Recherche documents + contextes et historique utilisateur, en parallèle
+        logger.info("📊 [1/5] Recherche documents RAG et contexte utilisateur...")
+        inputs = await gather_prompt_inputs(query, user_id=user_id, top_k=12)
+        documents = inputs["documents"]
+        logger.info(f"✓ [1/5] Trouvé {len(documents)} documents RAG (étapes: {inputs['timings']})")
         
-        # 2. Formatage contexte sécurisé
+        # 2. Budget de tokens par section puis formatage contexte sécurisé
         logger.info("📝 [2/5] Formatage contexte documentaire...")
-        context = format_context_safe(documents)
-        logger.info(f"✓ [2/5] Contexte formaté ({len(context)} caractères)")
+        sections = fit_prompt_sections(query, documents, inputs["user_context"], inputs["user_history"])
+        context = format_context_safe(sections["documents"])
+        logger.info(f"✓ [2/5] Contexte formaté ({len(sections['documents'])} passages, tokens: {sections['tokens']})")
         
         # 3. Création prompt optimisé avec détection de langue + multi-contexte
-        detected_language = detect_query_language(query)
         logger.info(f"🌐 Langue détectée: {detected_language}")
         logger.info("🎯 [3/5] Création prompt optimisé (multi-contexte)...")
-        prompt = await create_optimized_prompt(business_type, analysis_type, query, context, include_recommendations=True, language=detected_language, user_id=user_id)
+        prompt = await create_optimized_prompt(business_type, analysis_type, sections["query"], context, include_recommendations=True, language=detected_language, user_context=sections["user_context"], user_history=sections["user_history"])
         expected_sources = "60 sources" if is_deep_analysis else "40-60 sources"
         logger.info(f"✓ [3/5] Prompt créé (type: {expected_sources})")
         
         # 4. Appel Perplexity sécurisé avec RAG
         estimated_time = "90-120s" if is_deep_analysis else "45-60s"
         logger.info(f"🌐 [4/5] Appel Perplexity API ({expected_sources}, estimation: {estimated_time})...")
-        content = call_perplexity_safe(
+        content = await call_perplexity_safe(
             prompt, 
             business_type, 
             rag_context=context,
-            task_type="analysis"  # Force sonar-pro pour rapports longs
+            task_type="analysis",  # Force sonar-pro pour rapports longs
+            priority=priority
         )
         logger.info("✓ [4/5] Contenu généré par Perplexity")
         
         # 5. Construction réponse avec sources enrichies APA
         logger.info("✅ [5/5] Finalisation du rapport...")
-        enriched_sources = [enrich_source_with_apa(d, i+1) for i, d in enumerate(documents)]
+        enriched_sources = await enrich_sources_with_apa(documents)
         logger.info(f"✓ [5/5] Rapport finalisé avec {len(enriched_sources)} sources RAG")
         
         final_title = title or f"Rapport {get_business_type_display_name(business_type)} - {analysis_type.replace('_', ' ').title()}"
@@ -1188,7 +1408,7 @@ async def generate_business_analysis_safe(business_type: str, analysis_type: str
         ))
         logger.info(f"📝 Sauvegarde async dans memory-service pour user {user_id}")
         
-        return AnalysisResponse(
+        response = AnalysisResponse(
             analysis_type=analysis_type,
             business_type=business_type,
             title=final_title,
@@ -1204,11 +1424,18 @@ async def generate_business_analysis_safe(business_type: str, analysis_type: str
                 "max_tokens": 8000,
                 "status": "success",
                 "citation_format": "APA",
-                "saved_to_memory": True
+                "saved_to_memory": True,
+                "cache": "miss" if use_cache else "bypass"
             },
             timestamp=datetime.now().isoformat()
         )
         
+        # Les erreurs Perplexity sont renvoyées sous forme de texte: ne jamais les mettre en cache
+        if not content.startswith(("❌", "⚠️")):
+            await store_analysis(cache_key, response.dict())
+        
+        return response
+        
     except Exception as e:
         logger.error(f"Error in business analysis: {e}")
         # Retourner une réponse d'erreur plutôt qu'une exception
@@ -1249,7 +1476,7 @@ RÈGLES DE RÉPONSE COURTE:
 Réponds maintenant de façon concise:"""
 
         # 3. Appel Perplexity direct (pas de RAG interne)
-        response_content = call_perplexity_safe(
+        response_content = await call_perplexity_safe(
             chat_prompt, 
             business_type or "finance_banque", 
             rag_context="",
@@ -1307,6 +1534,44 @@ def health():
         "version": "3.1-multi-model"
     }
 
+@app.get("/metrics")
+def get_metrics():
+    """Métriques internes du worker (générations annulées, caches, files d'attente...)"""
+    return {
+        "service": "backend-intelligence-perplexity",
+        "timestamp": datetime.now().isoformat(),
+        "perplexity_queues": admission_snapshot(),
+        **metrics.snapshot()
+    }
+
+@app.get("/prompt-templates")
+def get_prompt_templates():
+    """Coût fixe (tokens) de chaque template de prompt, hors texte utilisateur"""
+    return {"templates": PROMPT_TEMPLATES.static_sizes()}
+
+class DocumentInvalidationRequest(BaseModel):
+    doc_ids: List[int] = []
+
+@app.post("/internal/documents/invalidate")
+def invalidate_document_metadata(request: DocumentInvalidationRequest):
+    """Appelé par document-service après suppression ou ingestion (liste vide: tout vider)"""
+    if request.doc_ids:
+        for doc_id in request.doc_ids:
+            _document_metadata_cache.delete(doc_id)
+    else:
+        _document_metadata_cache.clear()
+    metrics.increment("document_metadata_invalidations")
+    return {"invalidated": request.doc_ids or "all", "cached": len(_document_metadata_cache)}
+
+class AssistantContextInvalidationRequest(BaseModel):
+    user_id: Optional[str] = None
+    parts: List[str] = ["watches"]
+
+@app.post("/internal/assistant-context/invalidate")
+def invalidate_assistant_context_endpoint(request: AssistantContextInvalidationRequest):
+    """Appelé par scheduler-service après modification des veilles"""
+    return invalidate_assistant_context(request.user_id, request.parts)
+
 @app.get("/business-types")
 def get_business_types():
     """Types de métier disponibles"""
@@ -1335,7 +1600,8 @@ async def extended_analysis(request: BusinessAnalysisRequest):
         request.analysis_type,
         request.query,
         request.title,
-        user_id=request.user_id
+        user_id=request.user_id,
+        use_cache=request.use_cache is not False
     )
 
 @app.post("/business-analysis", response_model=AnalysisResponse)
@@ -1346,7 +1612,8 @@ async def business_analysis(request: BusinessAnalysisRequest):
         request.analysis_type,
         request.query,
         request.title,
-        user_id=request.user_id
+        user_id=request.user_id,
+        use_cache=request.use_cache is not False
     )
 
 @app.post("/analyze", response_model=AnalysisResponse)
@@ -1373,43 +1640,171 @@ async def analyze(request: SchedulerAnalysisRequest):
             business_type=business_type,
             analysis_type=analysis_type,
             query=request.query,
-            title=title
+            title=title,
+            use_cache=request.use_cache is not False,
+            priority=Priority.SCHEDULED  # Les veilles passent après le chat et les rapports interactifs
         )
     except Exception as e:
         logger.error(f"Error in /analyze endpoint: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+# ============================================================================
+# Jobs d'analyse - le client n'attend plus 90-120 s sur une connexion ouverte
+# ============================================================================
+
+JOB_EVENTS_HEARTBEAT = 15  # Secondes entre deux événements SSE sans changement
+
+
+async def _run_analysis_job(params: Dict[str, Any]) -> Dict[str, Any]:
+    """Exécute un job: même pipeline (cache, single-flight, file Perplexity) que /extended-analysis"""
+    response = await generate_business_analysis_safe(**params)
+    if response.content.startswith(("❌", "⚠️")):
+        raise RuntimeError(response.content[:500])
+    return response.dict()
+
+
+_job_runner = AnalysisJobRunner(create_job_store(), _run_analysis_job)
+
+
+def job_view(job: Dict[str, Any], position: Optional[int] = None) -> Dict[str, Any]:
+    """Représentation publique d'un job (résultat inclus une fois terminé)"""
+    view = {
+        "job_id": job["id"],
+        "status": job["status"],
+        "created_at": datetime.fromtimestamp(job["created_at"]).isoformat(),
+        "started_at": datetime.fromtimestamp(job["started_at"]).isoformat() if job["started_at"] else None,
+        "finished_at": datetime.fromtimestamp(job["finished_at"]).isoformat() if job["finished_at"] else None,
+    }
+    if position is not None:
+        view["queue_position"] = position
+    if job["status"] in FINISHED_STATUSES:
+        view["result"] = job["result"]
+        view["error"] = job["error"]
+    return view
+
+
+@app.post("/analysis-jobs", status_code=202)
+async def create_analysis_job(request: BusinessAnalysisRequest):
+    """Met une analyse longue en file et renvoie immédiatement l'identifiant du job
+
+    Suivi: GET /analysis-jobs/{job_id} (polling) ou GET /analysis-jobs/{job_id}/events (SSE).
+    """
+    try:
+        job = await _job_runner.submit({
+            "business_type": request.business_type,
+            "analysis_type": request.analysis_type,
+            "query": request.query,
+            "title": request.title,
+            "user_id": request.user_id,
+            "use_cache": request.use_cache is not False,
+        })
+    except JobQueueFull as e:
+        logger.warning(f"Analysis job rejected: {e}")
+        raise HTTPException(status_code=503, detail="Trop d'analyses en attente, réessayez dans quelques minutes")
+
+    return {
+        **job_view(job, _job_runner.queue_position(job["id"])),
+        "status_url": f"/analysis-jobs/{job['id']}",
+        "events_url": f"/analysis-jobs/{job['id']}/events",
+    }
+
+
+@app.get("/analysis-jobs/{job_id}")
+async def get_analysis_job(job_id: str):
+    """Statut d'un job; le résultat est conservé jusqu'à sa lecture (puis ANALYSIS_JOBS_FETCHED_TTL)"""
+    job = await _job_runner.get(job_id, mark_fetched=True)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job introuvable ou expiré")
+    return job_view(job, _job_runner.queue_position(job_id))
+
+
+@app.get("/analysis-jobs/{job_id}/events")
+async def analysis_job_events(job_id: str, http_request: Request):
+    """Flux SSE du statut d'un job: 'status' à chaque changement, 'done' avec le résultat"""
+    job = await _job_runner.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job introuvable ou expiré")
+
+    async def job_events():
+        last_status = None
+        while True:
+            job = await _job_runner.get(job_id)
+            if job is None:
+                yield f"event: error\ndata: {json.dumps({'job_id': job_id, 'error': 'expired'})}\n\n"
+                return
+            if job["status"] in FINISHED_STATUSES:
+                job = await _job_runner.get(job_id, mark_fetched=True)
+                yield f"event: done\ndata: {json.dumps(job_view(job), ensure_ascii=False)}\n\n"
+                return
+            if job["status"] != last_status:
+                last_status = job["status"]
+                view = job_view(job, _job_runner.queue_position(job_id))
+                yield f"event: status\ndata: {json.dumps(view, ensure_ascii=False)}\n\n"
+            else:
+                yield ": keep-alive\n\n"
+            await _job_runner.wait_for_change(job_id, JOB_EVENTS_HEARTBEAT)
+
+    async def relay():
+        try:
+            async for event in relay_until_disconnect(http_request, job_events()):
+                yield event
+        except ClientDisconnected:
+            # Le job continue: le client peut se réabonner ou interroger le statut
+            logger.info(f"Analysis job {job_id} events client disconnected")
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return StreamingResponse(relay(), media_type="text/event-stream", headers=headers)
+
+# Longueur attendue des rapports (en tokens) pour calculer une progression réelle
+# à partir du volume de texte effectivement reçu de Perplexity
+EXPECTED_REPORT_TOKENS = {"standard": 10000, "deep": 14000}
+CHARS_PER_TOKEN = 4  # Estimation moyenne FR/EN pour sonar-pro
+SSE_FLUSH_INTERVAL = 0.25  # Secondes min entre deux événements de contenu
+
+
 @app.post("/extended-analysis/stream")
-async def extended_analysis_stream(request: BusinessAnalysisRequest):
-    """Génère rapports avec streaming SSE et barre de progression en temps réel"""
+async def extended_analysis_stream(request: BusinessAnalysisRequest, http_request: Request):
+    """Génère rapports avec streaming SSE: le contenu est transmis au fil de la génération
+
+    Chaque événement 'generate' porte un champ 'delta' (texte reçu depuis l'événement
+    précédent). L'événement final 'done' ne renvoie pas le contenu: le client le
+    reconstitue en concaténant les deltas.
+
+    Une requête identique déjà en cours de génération est rejointe: le client reçoit
+    les événements déjà émis puis le flux en direct, sans second appel Perplexity.
+    L'appel en cours n'est annulé que lorsque tous les clients se sont déconnectés
+    (après SSE_RESUME_GRACE secondes sans reconnexion).
+
+    Chaque événement porte un id "<génération>:<numéro>". Un client coupé renvoie
+    la même requête avec l'en-tête Last-Event-ID et reprend après cet événement.
+    """
+    include_reco = request.include_recommendations if request.include_recommendations is not None else True
+    # Détection automatique de la langue de la query utilisateur
+    detected_language = detect_query_language(request.query)
     
     async def generate_sse() -> AsyncGenerator[str, None]:
+        # Fonction helper pour créer les messages SSE
+        def sse_msg(progress: int, step: str, message: str, **kwargs) -> str:
+            data = {'progress': progress, 'step': step, 'message': message, **kwargs}
+            return f"data: {json.dumps(data)}\n\n"
+        
         try:
             is_deep_analysis = "approfondi" in (request.analysis_type or "").lower()
             
-            # Fonction helper pour créer les messages SSE
-            def sse_msg(progress: int, step: str, message: str, **kwargs) -> str:
-                data = {'progress': progress, 'step': step, 'message': message, **kwargs}
-                return f"data: {json.dumps(data)}\n\n"
-            
             # Étape 1: Démarrage (5%)
             yield sse_msg(5, 'start', 'Demarrage de analyse...')
-            await asyncio.sleep(0.5)
             
-            # Étape 2: Recherche documents (15%)
+            # Étape 2: Recherche documents + contexte utilisateur en parallèle (15%)
             yield sse_msg(15, 'search', 'Recherche de sources fiables...')
-            documents = search_documents_safe(request.query, top_k=12)
-            await asyncio.sleep(0.3)
+            inputs = await gather_prompt_inputs(request.query, user_id=request.user_id, top_k=12)
+            documents = inputs["documents"]
             
-            # Étape 3: Formatage contexte (25%)
-            yield sse_msg(25, 'context', 'Preparation du contexte...')
-            context = format_context_safe(documents)
-            await asyncio.sleep(0.3)
+            # Étape 3: Formatage contexte (25%) - durée de chaque étape de collecte
+            yield sse_msg(25, 'context', 'Preparation du contexte...', timings=inputs["timings"])
+            sections = fit_prompt_sections(request.query, documents, inputs["user_context"], inputs["user_history"])
+            context = format_context_safe(sections["documents"])
             
             # Étape 4: Création prompt (30%)
-            include_reco = request.include_recommendations if request.include_recommendations is not None else True
-            # Détection automatique de la langue de la query utilisateur
-            detected_language = detect_query_language(request.query)
             logger.info(f"🌐 Langue détectée automatiquement: {detected_language} pour query: '{request.query[:50]}...'")
             reco_status = "avec recommandations" if include_reco else "sans recommandations"
             lang_status = "EN" if detected_language == "en" else "FR"
@@ -1417,31 +1812,54 @@ async def extended_analysis_stream(request: BusinessAnalysisRequest):
             prompt = await create_optimized_prompt(
                 request.business_type or "general",
                 request.analysis_type,
-                request.query,
+                sections["query"],
                 context,
                 include_recommendations=include_reco,
                 language=detected_language,
-                user_id=getattr(request, 'user_id', None)
+                user_context=sections["user_context"],
+                user_history=sections["user_history"]
             )
-            await asyncio.sleep(0.3)
             
-            # Étape 5: Appel Perplexity (35-85%)
+            # Étape 5: Génération Perplexity en streaming (35-90%)
             estimated_time = "90-120s" if is_deep_analysis else "45-60s"
-            gen_msg = f"Generation du rapport ({estimated_time})..."
-            yield sse_msg(35, 'generate', gen_msg)
+            yield sse_msg(35, 'generate', f"Generation du rapport ({estimated_time})...")
+            
+            expected_tokens = EXPECTED_REPORT_TOKENS["deep" if is_deep_analysis else "standard"]
+            content_parts: List[str] = []
+            pending: List[str] = []
+            chars_received = 0
+            last_flush = time.monotonic()
             
-            # Simuler progression pendant génération
-            progress_task = asyncio.create_task(simulate_progress_updates())
+            def delta_msg() -> str:
+                tokens = chars_received // CHARS_PER_TOKEN
+                progress = 35 + int(54 * min(1.0, tokens / expected_tokens))
+                return sse_msg(
+                    progress, 'generate', f"Generation du rapport ({tokens} tokens)...",
+                    delta="".join(pending), tokens=tokens, chars=chars_received
+                )
             
-            # Appel réel à Perplexity
-            content = call_perplexity_safe(
+            upstream = stream_perplexity_safe(
                 prompt,
                 request.business_type or "general",
                 rag_context=context,
                 task_type="analysis"
             )
+            async for delta in upstream:
+                content_parts.append(delta)
+                pending.append(delta)
+                chars_received += len(delta)
+                
+                # Regrouper les deltas pour ne pas émettre un événement par token
+                if time.monotonic() - last_flush >= SSE_FLUSH_INTERVAL:
+                    yield delta_msg()
+                    pending = []
+                    last_flush = time.monotonic()
+            
+            if pending:
+                yield delta_msg()
+                pending = []
             
-            progress_task.cancel()
+            content = "".join(content_parts)
             
             # Étape 6: Extraction du titre (90%)
             yield sse_msg(90, 'title', 'Extraction du titre...')
@@ -1455,15 +1873,13 @@ async def extended_analysis_stream(request: BusinessAnalysisRequest):
                     generated_title = line.replace('# ', '').strip()
                     break
             
-            await asyncio.sleep(0.3)
-            
             # Étape 7: Finalisation (95%)
             yield sse_msg(95, 'finalize', 'Finalisation du rapport...')
             
             # Enrichir les sources
-            enriched_sources = [enrich_source_with_apa(d, i+1) for i, d in enumerate(documents)]
+            enriched_sources = await enrich_sources_with_apa(documents)
             
-            # Étape 8: Terminé (100%)
+            # Étape 8: Terminé (100%) - contenu déjà transmis via les deltas
             result = {
                 'progress': 100,
                 'step': 'done',
@@ -1473,26 +1889,67 @@ async def extended_analysis_stream(request: BusinessAnalysisRequest):
                     'analysis_type': request.analysis_type,
                     'business_type': request.business_type or 'general',
                     'title': generated_title,
-                    'content': content,
+                    'content_length': len(content),
                     'sources': enriched_sources,
                     'metadata': {
                         'query': request.query,
                         'documents_found': len(documents),
                         'model': get_model_for_task("analysis"),
-                        'provider': 'Perplexity AI'
+                        'provider': 'Perplexity AI',
+                        'tokens_estimated': len(content) // CHARS_PER_TOKEN
                     },
                     'timestamp': datetime.now().isoformat()
                 }
             }
             yield f"data: {json.dumps(result)}\n\n"
+            metrics.increment("generations_completed")
             
+        except asyncio.CancelledError:
+            logger.info(f"SSE generation cancelled (no client left): '{request.query[:50]}...'")
+            metrics.increment("generations_cancelled")
+            raise
         except Exception as e:
             logger.error(f"SSE Analysis error: {e}")
             err_msg = f"Erreur: {str(e)[:200]}"
             yield sse_msg(0, 'error', err_msg, error=True)
     
+    # Une seule génération par requête identique, partagée entre les clients
+    stream_key = make_flight_key(
+        make_analysis_key(request.query, request.analysis_type, request.business_type, detected_language, request.user_id),
+        include_reco,
+        request.title
+    )
+    last_event_id = http_request.headers.get("last-event-id")
+    resumed = _stream_hub.find(stream_key, last_event_id) if last_event_id else None
+    if resumed:
+        generation, after = resumed
+        logger.info(f"↩️ SSE client resumed generation {generation.id} after event {after}")
+        metrics.increment("generation_streams_resumed")
+    else:
+        after = 0
+        generation, joined = _stream_hub.attach(stream_key, generate_sse)
+        if joined:
+            logger.info(f"🔗 SSE client attached to running generation: '{request.query[:50]}...'")
+            metrics.increment("generation_streams_joined")
+        if last_event_id:
+            # Génération expirée: le client repart du début (nouvel id de génération)
+            logger.info(f"SSE resume unavailable for {last_event_id}, streaming from start")
+    
+    async def relay_sse() -> AsyncGenerator[str, None]:
+        # Délai de reconnexion conseillé aux clients EventSource
+        yield "retry: 3000\n\n"
+        try:
+            async for event in relay_until_disconnect(http_request, generation.subscribe(after)):
+                yield event
+        except ClientDisconnected:
+            logger.info(f"SSE client disconnected: '{request.query[:50]}...'")
+        except ReplayUnavailable as e:
+            logger.warning(f"SSE resume failed: {e}")
+            data = {'progress': 0, 'step': 'error', 'message': 'Reprise du flux impossible, relancez l\'analyse', 'error': True}
+            yield f"data: {json.dumps(data)}\n\n"
+    
     return StreamingResponse(
-        generate_sse(),
+        relay_sse(),
         media_type="text/event-stream",
         headers={
             "Cache-Control": "no-cache",
@@ -1501,14 +1958,6 @@ async def extended_analysis_stream(request: BusinessAnalysisRequest):
         }
     )
 
-async def simulate_progress_updates():
-    """Simuler des mises à jour de progression pendant la génération"""
-    try:
-        for i in range(40, 85, 5):
-            await asyncio.sleep(3)  # Toutes les 3 secondes
-    except asyncio.CancelledError:
-        pass
-
 @app.post("/chat", response_model=ChatResponse)
 async def chat_endpoint(request: ChatRequest):
     """Chat intelligent - réponses courtes et concises"""
@@ -1519,12 +1968,14 @@ async def chat_endpoint(request: ChatRequest):
     )
 
 @app.post("/chat/stream")
-async def chat_stream_endpoint(request: ChatRequest):
-    """Streaming de la réponse du chat - réponses COURTES et CONCISES."""
-    async def token_generator():
-        try:
-            # Prompt pour réponses COURTES (2-4 paragraphes)
-            chat_prompt = f"""QUESTION: {request.message}
+async def chat_stream_endpoint(request: ChatRequest, http_request: Request):
+    """Streaming de la réponse du chat - réponses COURTES et CONCISES.
+
+    L'appel Perplexity est annulé si le client ferme la connexion.
+    """
+    async def chat_deltas() -> AsyncGenerator[str, None]:
+        # Prompt pour réponses COURTES (2-4 paragraphes)
+        chat_prompt = f"""QUESTION: {request.message}
 
 RÈGLES:
 - Réponds en 2-4 paragraphes MAXIMUM
@@ -1536,6 +1987,41 @@ RÈGLES:
 
 Réponds maintenant:"""
 
+        selected_model = get_model_for_task("chat")
+        business_context = request.business_type or "Expert IA"
+        messages = [
+            {"role": "system", "content": f"Assistant spécialisé {business_context}. Utilise les documents fournis en priorité."},
+            {"role": "user", "content": chat_prompt}
+        ]
+        client = get_perplexity_client()
+        async with perplexity_slot(selected_model, Priority.CHAT, estimate_request_tokens(messages, 1500)) as slot:
+            stream = await retry_rate_limited(selected_model, lambda: client.chat.completions.create(
+                model=selected_model,  # Modèle dynamique
+                messages=messages,
+                temperature=0.1,  # Réduit pour plus de précision
+                max_tokens=1500,
+                stream=True,
+                timeout=300.0
+            ))
+
+            try:
+                async for event in stream:
+                    try:
+                        delta = event.choices[0].delta if hasattr(event.choices[0], "delta") else event.choices[0].get("delta", {})
+                        content = getattr(delta, "content", None)
+                        if content is None and isinstance(delta, dict):
+                            content = delta.get("content")
+                        if content:
+                            yield content
+                    except Exception as inner:
+                        logger.warning(f"Stream delta parse error: {inner}")
+                        continue
+            finally:
+                # Fermer la réponse amont, y compris sur annulation (client déconnecté)
+                await stream.close()
+
+    async def token_generator():
+        try:
             # 2) Streaming Perplexity
             if not PERPLEXITY_API_KEY or not OPENAI_SDK_AVAILABLE:
                 # Fallback non‑bloquant
@@ -1543,32 +2029,21 @@ Réponds maintenant:"""
                 yield "[DONE]"
                 return
 
-            selected_model = get_model_for_task("chat")
-            client = OpenAI(api_key=PERPLEXITY_API_KEY, base_url=PERPLEXITY_BASE_URL, timeout=300.0)
-            stream = client.chat.completions.create(
-                model=selected_model,  # Modèle dynamique
-                messages=[
-                    {"role": "system", "content": f"Assistant spécialisé {business_context}. Utilise les documents fournis en priorité."},
-                    {"role": "user", "content": chat_prompt}
-                ],
-                temperature=0.1,  # Réduit pour plus de précision
-                max_tokens=1500,
-                stream=True,
-            )
-
-            for event in stream:
-                try:
-                    delta = event.choices[0].delta if hasattr(event.choices[0], "delta") else event.choices[0].get("delta", {})
-                    content = getattr(delta, "content", None)
-                    if content is None and isinstance(delta, dict):
-                        content = delta.get("content")
-                    if content:
-                        yield content
-                except Exception as inner:
-                    logger.warning(f"Stream delta parse error: {inner}")
-                    continue
+            async for content in relay_until_disconnect(http_request, chat_deltas()):
+                yield content
 
             yield "[DONE]"
+        except ClientDisconnected:
+            logger.info("Chat stream client disconnected, generation cancelled")
+            metrics.increment("chat_streams_cancelled")
+        except AdmissionTimeout as queue_error:
+            logger.warning(f"Chat stream not admitted: {queue_error}")
+            yield perplexity_busy_message(get_model_for_task("chat"))
+            yield "[DONE]"
+        except asyncio.CancelledError:
+            logger.info("Chat stream cancelled")
+            metrics.increment("chat_streams_cancelled")
+            raise
         except Exception as e:
             logger.error(f"Streaming error: {e}")
             yield "\n[STREAM_ERROR]"
@@ -1586,20 +2061,17 @@ async def test_perplexity():
         if not PERPLEXITY_API_KEY:
             return {"status": "error", "message": "PERPLEXITY_API_KEY not configured"}
         
-        client = OpenAI(
-            api_key=PERPLEXITY_API_KEY,
-            base_url=PERPLEXITY_BASE_URL,
-            timeout=30.0
-        )
+        client = get_perplexity_client()
         
         # Tester chaque modèle configuré
         results = {}
         for task_type, model_name in PERPLEXITY_MODELS.items():
             try:
-                response = client.chat.completions.create(
+                response = await client.chat.completions.create(
                     model=model_name,
                     messages=[{"role": "user", "content": "Test"}],
-                    max_tokens=10
+                    max_tokens=10,
+                    timeout=30.0
                 )
                 results[task_type] = {
                     "model": model_name,
@@ -1633,20 +2105,17 @@ async def check_api_status():
                 "api_key_configured": False
             }
         
-        client = OpenAI(
-            api_key=PERPLEXITY_API_KEY,
-            base_url=PERPLEXITY_BASE_URL,
-            timeout=30.0
-        )
+        client = get_perplexity_client()
         
         # Test avec le modèle chat (le moins coûteux)
         test_model = get_model_for_task("chat")
         
         try:
-            response = client.chat.completions.create(
+            response = await client.chat.completions.create(
                 model=test_model,
                 messages=[{"role": "user", "content": "Hello"}],
-                max_tokens=10
+                max_tokens=10,
+                timeout=30.0
             )
             
             # Si on arrive ici, la clé fonctionne
@@ -1744,17 +2213,14 @@ async def diagnostics():
     # Test Perplexity
     try:
         if PERPLEXITY_API_KEY:
-            client = OpenAI(
-                api_key=PERPLEXITY_API_KEY,
-                base_url=PERPLEXITY_BASE_URL,
-                timeout=300.0
-            )
+            client = get_perplexity_client()
             # Test avec le modèle chat par défaut
             test_model = get_model_for_task("chat")
-            test_response = client.chat.completions.create(
+            test_response = await client.chat.completions.create(
                 model=test_model,
                 messages=[{"role": "user", "content": "test"}],
-                max_tokens=5
+                max_tokens=5,
+                timeout=300.0
             )
             diagnostics_result["perplexity"] = {
                 "status": "✅ Functional", 
@@ -1771,7 +2237,7 @@ async def diagnostics():
     
     # Test Vector Service
     try:
-        test_docs = search_documents_safe("test", top_k=1)
+        test_docs = await search_documents_safe("test", top_k=1)
         diagnostics_result["vector_service"] = {
             "status": "✅ Accessible" if len(test_docs) >= 0 else "⚠️ No results",
             "url": VECTOR_SERVICE_URL,
@@ -1892,7 +2358,7 @@ async def remove_context(user_id: str = "default_user"):
 async def get_memory_history(user_id: str = "default_user", limit: int = 20):
     """Recupere l'historique des conversations de l'utilisateur"""
     try:
-        history = get_full_history(user_id, limit=limit)
+        history = await asyncio.to_thread(get_full_history, user_id, limit)
         return {"conversations": history, "count": len(history)}
     except Exception as e:
         logger.error(f"Error getting memory history: {e}")
@@ -1907,7 +2373,7 @@ class SearchMemoryRequest(BaseModel):
 async def search_memory(request: SearchMemoryRequest, user_id: str = "default_user"):
     """Recherche dans l'historique des conversations"""
     try:
-        results = search_history(user_id, request.query, max_results=request.max_results)
+        results = await asyncio.to_thread(search_history, user_id, request.query, request.max_results)
         return {"results": results, "count": len(results)}
     except Exception as e:
         logger.error(f"Error searching memory: {e}")
@@ -1918,7 +2384,7 @@ async def search_memory(request: SearchMemoryRequest, user_id: str = "default_us
 async def clear_memory(user_id: str = "default_user"):
     """Supprime l'historique des conversations de l'utilisateur"""
     try:
-        success = clear_user_memory(user_id)
+        success = await asyncio.to_thread(clear_user_memory, user_id)
         return {"status": "success" if success else "not_found", "cleared": success}
     except Exception as e:
         logger.error(f"Error clearing memory: {e}")
@@ -1945,144 +2411,40 @@ def detect_intent_and_entities(message: str, conversation_history: List[Dict] =
     """
     Detecte l'intention de l'utilisateur et extrait les entites pertinentes.
     Retourne (intent, entities)
+
+    Un seul parcours du message (app.intent_matcher): les regles d'intention
+    et les indices de frequence sont des tables, pas des scans successifs.
     """
-    # #region agent log H1
-    import re as _re_debug
-    _email_pattern = r'[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}'
-    _found_emails = _re_debug.findall(_email_pattern, message)
-    logger.info(f"[DEBUG-H1] Email extraction: message='{message[:100]}', found_emails={_found_emails}")
-    # #endregion
-    message_lower = message.lower()
+    scan = scan_message(message)
     entities = {}
-    
+
     # Extraire les emails du message et les ajouter aux entites
-    email_pattern = r'[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}'
-    found_emails = re.findall(email_pattern, message)
-    if found_emails:
-        entities["emails"] = found_emails
-    
-    # Detection des intentions d'action
-    if any(word in message_lower for word in ["creer", "créer", "nouvelle", "ajouter", "configurer"]):
-        if any(word in message_lower for word in ["veille", "surveillance", "watch"]):
-            intent = "create_watch"
-            # Extraction du sujet
-            for keyword in ["sur", "concernant", "à propos de", "about"]:
-                if keyword in message_lower:
-                    idx = message_lower.find(keyword) + len(keyword)
-                    topic = message[idx:].strip().split(",")[0].split(".")[0].strip()
-                    # Nettoyer le topic: retirer les emails et les mots cles d'envoi
-                    if topic:
-                        # Retirer les emails du topic
-                        for email in found_emails:
-                            topic = topic.replace(email, "").strip()
-                        # Retirer les patterns "a envoyer a", "envoye a", etc.
-                        topic = re.sub(r'\s*(a|à)\s*(envoyer|envoyé|envoyée)\s*(a|à)?\s*$', '', topic, flags=re.IGNORECASE).strip()
-                        if topic:
-                            entities["topic"] = topic
-            # Detection de la frequence
-            if "quotidien" in message_lower or "chaque jour" in message_lower:
-                entities["frequency"] = "daily"
-            elif "hebdomadaire" in message_lower or "chaque semaine" in message_lower:
-                entities["frequency"] = "weekly_monday"
-            elif "mensuel" in message_lower:
-                entities["frequency"] = "monthly"
-            return intent, entities
-        
-        if any(word in message_lower for word in ["rapport", "analyse", "report"]):
-            intent = "generate_report"
-            for keyword in ["sur", "concernant", "à propos de", "about"]:
-                if keyword in message_lower:
-                    idx = message_lower.find(keyword) + len(keyword)
-                    query = message[idx:].strip().split(",")[0].split(".")[0].strip()
-                    if query:
-                        entities["query"] = query
-            return intent, entities
-    
-    if any(word in message_lower for word in ["liste", "lister", "voir", "afficher", "montre", "quelles sont"]):
-        if any(word in message_lower for word in ["veille", "veilles", "surveillance", "watches"]):
-            return "list_watches", {}
-    
-    if any(word in message_lower for word in ["supprimer", "effacer", "retirer", "delete"]):
-        if any(word in message_lower for word in ["veille", "watch"]):
-            return "delete_watch", entities
-    
-    if any(word in message_lower for word in ["modifier", "changer", "mettre à jour", "update", "edit"]):
-        if any(word in message_lower for word in ["veille", "watch"]):
-            return "update_watch", entities
-    
-    # Detection des questions
-    if any(word in message_lower for word in ["comment", "qu'est-ce", "c'est quoi", "explique", "how", "what", "pourquoi"]):
-        return "explanation", entities
-    
-    # Detection de demande d'aide sur les fonctionnalites
-    if any(word in message_lower for word in ["aide", "help", "fonctionnalit", "feature", "peut faire", "capable"]):
-        return "explanation", entities
-    
-    # Par defaut: conversation generale
-    return "conversation", entities
+    if scan.emails:
+        entities["emails"] = list(scan.emails)
 
+    intent = match_intent(scan)
 
-async def build_assistant_context(user_id: str, message: str) -> tuple:
-    """
-    Construit le contexte complet pour l'assistant:
-    - Connaissance de l'application
-    - Contexte RAG de l'utilisateur
-    - Historique des conversations
-    - Liste des veilles actuelles
-    
-    Retourne (context_prompt, sources_used)
-    """
-    sources_used = []
-    context_parts = []
-    
-    # 1. Connaissance de l'application
-    app_context = build_context_prompt()
-    context_parts.append(app_context)
-    sources_used.append("Documentation Prometheus")
-    
-    # 2. Contexte RAG de l'entreprise (multi-contexte via memory-service)
-    try:
-        user_context = await get_context_for_prompt(user_id)
-        if user_context and len(user_context) > 50:
-            context_parts.append(f"\n## Contexte de l'entreprise de l'utilisateur:\n{user_context[:4000]}")
-            sources_used.append("Contexte entreprise")
-    except Exception as e:
-        logger.warning(f"Could not load user context: {e}")
-    
-    # 3. Historique des conversations recentes
-    try:
-        history_context = get_history_for_prompt(user_id, message, max_length=1000)
-        if history_context and len(history_context) > 50:
-            context_parts.append(f"\n## Historique recent des conversations:\n{history_context[:1000]}")
-            sources_used.append("Historique conversations")
-    except Exception as e:
-        logger.warning(f"Could not load history: {e}")
-    
-    # 4. Liste des veilles actuelles (via API scheduler)
-    try:
-        import httpx
-        scheduler_url = os.getenv("SCHEDULER_URL", "http://scheduler-service:8007")
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            logger.info(f"Fetching watches from {scheduler_url}/watches")
-            response = await client.get(f"{scheduler_url}/watches")
-            logger.info(f"Watches response status: {response.status_code}")
-            if response.status_code == 200:
-                watches = response.json()
-                logger.info(f"Found {len(watches) if watches else 0} watches")
-                if watches:
-                    watches_info = "\n## Veilles configurees par l'utilisateur:\n"
-                    for w in watches[:10]:  # Max 10
-                        status = "Active" if w.get("is_active") else "Inactive"
-                        watches_info += f"- {w['name']} (ID: {w['id']}): {w['topic']} - {status}\n"
-                    context_parts.append(watches_info)
-                    sources_used.append("Veilles utilisateur")
-            else:
-                logger.warning(f"Failed to fetch watches: {response.status_code} - {response.text}")
-    except Exception as e:
-        logger.error(f"Error fetching watches for context: {e}", exc_info=True)
-    
-    full_context = "\n".join(context_parts)
-    return full_context, sources_used
+    if intent == "create_watch":
+        # Extraction du sujet: le dernier marqueur present dans l'ordre de la table l'emporte
+        for topic in extract_after_marker(scan):
+            # Nettoyer le topic: retirer les emails et les mots cles d'envoi
+            if topic:
+                for email in scan.emails:
+                    topic = topic.replace(email, "").strip()
+                topic = SEND_SUFFIX_RE.sub('', topic).strip()
+                if topic:
+                    entities["topic"] = topic
+        frequency = detect_frequency(scan)
+        if frequency:
+            entities["frequency"] = frequency
+    elif intent == "generate_report":
+        for query in extract_after_marker(scan):
+            if query:
+                entities["query"] = query
+    elif intent == "list_watches":
+        return intent, {}
+
+    return intent, entities
 
 
 async def generate_assistant_response(
@@ -2167,13 +2529,16 @@ propose-la explicitement.
     messages.append({"role": "user", "content": message})
     
     try:
-        client = OpenAI(api_key=PERPLEXITY_API_KEY, base_url=PERPLEXITY_BASE_URL, timeout=60.0)
+        client = get_perplexity_client()
         
-        response = client.chat.completions.create(
+        response = await admitted_completion(
+            client,
+            Priority.CHAT,
             model=get_model_for_task("chat"),
             messages=messages,
             temperature=0.3,
-            max_tokens=800
+            max_tokens=800,
+            timeout=60.0
         )
         
         return response.choices[0].message.content
@@ -2185,15 +2550,7 @@ propose-la explicitement.
 
 def is_app_help_question(message: str) -> bool:
     """Detecte si la question concerne l'aide sur l'application Prometheus."""
-    message_lower = message.lower()
-    app_keywords = [
-        "comment", "aide", "help", "expliqu", "tutoriel", "guide",
-        "prometheus", "plateforme", "application", "app",
-        "veille", "rapport", "creer", "créer", "configurer",
-        "fonctionn", "utiliser", "marche", "fonctionne",
-        "bouton", "page", "menu", "interface", "etape", "étape"
-    ]
-    return any(kw in message_lower for kw in app_keywords)
+    return scan_message(message).has("app_help")
 
 
 async def generate_smart_chat_response(
@@ -2267,16 +2624,19 @@ rappelle-lui qu'il peut generer un rapport complet depuis la page principale.
     messages.append({"role": "user", "content": message})
     
     try:
-        client = OpenAI(api_key=PERPLEXITY_API_KEY, base_url=PERPLEXITY_BASE_URL, timeout=60.0)
+        client = get_perplexity_client()
         
         # Utiliser un modele avec recherche pour les questions generales
         model = "sonar" if not is_help else get_model_for_task("chat")
         
-        response = client.chat.completions.create(
+        response = await admitted_completion(
+            client,
+            Priority.CHAT,
             model=model,
             messages=messages,
             temperature=0.3,
-            max_tokens=1000
+            max_tokens=1000,
+            timeout=60.0
         )
         
         return response.choices[0].message.content
@@ -2309,7 +2669,9 @@ async def assistant_chat_endpoint(request: AssistantChatRequest):
         
         # Sauvegarder dans l'historique (legacy RAG)
         try:
-            add_conversation(request.user_id, request.message, response_message, analysis_type="assistant_chat")
+            await asyncio.to_thread(
+                add_conversation, request.user_id, request.message, response_message, "assistant_chat"
+            )
         except Exception as e:
             logger.warning(f"Could not save to RAG memory: {e}")
         
@@ -0,0 +1,56 @@
+"""
+Métriques internes du backend - compteurs, jauges et durées en mémoire
+
+Exposées en JSON sur GET /metrics. Les valeurs sont propres au process
+(un jeu de métriques par worker uvicorn).
+"""
+
+import threading
+from typing import Dict, Any
+
+_lock = threading.Lock()
+_counters: Dict[str, float] = {}
+_gauges: Dict[str, float] = {}
+_timings: Dict[str, Dict[str, float]] = {}
+
+
+def increment(name: str, value: float = 1) -> None:
+    """Incrémente un compteur (créé à zéro si absent)"""
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def set_gauge(name: str, value: float) -> None:
+    """Fixe la valeur courante d'une jauge (profondeur de file, taille de cache...)"""
+    with _lock:
+        _gauges[name] = value
+
+
+def observe(name: str, seconds: float) -> None:
+    """Enregistre une durée: nombre, total, max et dernière valeur"""
+    with _lock:
+        stats = _timings.setdefault(name, {"count": 0, "total": 0.0, "max": 0.0, "last": 0.0})
+        stats["count"] += 1
+        stats["total"] += seconds
+        stats["max"] = max(stats["max"], seconds)
+        stats["last"] = seconds
+
+
+def get_counter(name: str) -> float:
+    """Valeur courante d'un compteur"""
+    with _lock:
+        return _counters.get(name, 0)
+
+
+def snapshot() -> Dict[str, Any]:
+    """Copie cohérente de toutes les métriques"""
+    with _lock:
+        timings = {
+            name: {**stats, "avg": round(stats["total"] / stats["count"], 4) if stats["count"] else 0.0}
+            for name, stats in _timings.items()
+        }
+        return {
+            "counters": dict(_counters),
+            "gauges": dict(_gauges),
+            "timings": timings,
+        }
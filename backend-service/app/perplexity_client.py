@@ -0,0 +1,113 @@
+"""
+Client Perplexity partagé - un seul AsyncOpenAI par process
+
+Le SDK OpenAI (compatible Perplexity) est instancié une seule fois avec un pool
+de connexions keep-alive httpx. Tous les appels Perplexity du backend passent
+par ce client pour ne jamais bloquer la boucle d'événements uvicorn.
+"""
+
+import os
+from typing import Optional
+
+import httpx
+from loguru import logger
+
+# Import SDK Perplexity (compatible OpenAI SDK)
+try:
+    from openai import AsyncOpenAI
+    OPENAI_SDK_AVAILABLE = True
+except ImportError:
+    AsyncOpenAI = None
+    OPENAI_SDK_AVAILABLE = False
+    logger.error("SDK OpenAI package not available (required for Perplexity API compatibility)")
+
+# Configuration - Perplexity API
+PERPLEXITY_API_KEY = os.getenv("PERPLEXITY_API_KEY", "")
+PERPLEXITY_BASE_URL = "https://api.perplexity.ai"
+
+# Timeout par défaut: 10 minutes pour rapports longs (surchargé par appel)
+PERPLEXITY_TIMEOUT = float(os.getenv("PERPLEXITY_TIMEOUT", "600"))
+PERPLEXITY_CONNECT_TIMEOUT = float(os.getenv("PERPLEXITY_CONNECT_TIMEOUT", "10"))
+
+# Pool de connexions partagé entre toutes les générations du worker
+PERPLEXITY_MAX_CONNECTIONS = int(os.getenv("PERPLEXITY_MAX_CONNECTIONS", "100"))
+PERPLEXITY_MAX_KEEPALIVE = int(os.getenv("PERPLEXITY_MAX_KEEPALIVE", "20"))
+PERPLEXITY_KEEPALIVE_EXPIRY = float(os.getenv("PERPLEXITY_KEEPALIVE_EXPIRY", "120"))
+
+_http_client: Optional[httpx.AsyncClient] = None
+_client = None
+
+
+def is_perplexity_configured() -> bool:
+    """True si la clé API et le SDK sont disponibles"""
+    return bool(PERPLEXITY_API_KEY) and OPENAI_SDK_AVAILABLE
+
+
+def get_perplexity_client():
+    """
+    Retourne le client AsyncOpenAI partagé (créé à la première utilisation)
+
+    Returns:
+        Instance AsyncOpenAI pointant sur l'API Perplexity
+    """
+    global _http_client, _client
+
+    if not OPENAI_SDK_AVAILABLE:
+        raise RuntimeError("SDK OpenAI manquant (pip install openai)")
+
+    if _client is None:
+        _http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=PERPLEXITY_MAX_CONNECTIONS,
+                max_keepalive_connections=PERPLEXITY_MAX_KEEPALIVE,
+                keepalive_expiry=PERPLEXITY_KEEPALIVE_EXPIRY,
+            ),
+            timeout=httpx.Timeout(PERPLEXITY_TIMEOUT, connect=PERPLEXITY_CONNECT_TIMEOUT),
+        )
+        _client = AsyncOpenAI(
+            api_key=PERPLEXITY_API_KEY,
+            base_url=PERPLEXITY_BASE_URL,
+            timeout=PERPLEXITY_TIMEOUT,
+            # Les relances (429, 5xx, connexion, timeout) sont faites par la file
+            # d'admission (admission.py): elle rend la place pendant l'attente et
+            # suspend les autres appels du modèle pendant le Retry-After d'un 429
+            max_retries=0,
+            http_client=_http_client,
+        )
+        logger.info(
+            f"Perplexity client created (pool: {PERPLEXITY_MAX_CONNECTIONS} connections, "
+            f"{PERPLEXITY_MAX_KEEPALIVE} keep-alive)"
+        )
+
+    return _client
+
+
+async def warmup_perplexity_client() -> None:
+    """
+    Crée le client et ouvre une première connexion TLS vers Perplexity au démarrage,
+    pour que la première génération ne paie pas le handshake.
+    """
+    if not is_perplexity_configured():
+        logger.info("Perplexity not configured, skipping client warmup")
+        return
+
+    get_perplexity_client()
+    try:
+        # Requête légère: seule la connexion keep-alive nous intéresse
+        await _http_client.head(PERPLEXITY_BASE_URL, timeout=5.0)
+        logger.info("Perplexity connection pool warmed up")
+    except Exception as e:
+        logger.warning(f"Perplexity warmup failed (non-blocking): {e}")
+
+
+async def close_perplexity_client() -> None:
+    """Ferme le pool de connexions à l'arrêt du service"""
+    global _http_client, _client
+
+    if _client is not None:
+        try:
+            await _client.close()
+        except Exception as e:
+            logger.warning(f"Error closing Perplexity client: {e}")
+    _client = None
+    _http_client = None
@@ -0,0 +1,191 @@
+"""
+Budget de tokens des prompts Perplexity
+
+Remplace la troncature aveugle à 15 000 caractères: chaque section variable
+du prompt (contextes utilisateur, passages RAG, historique, requête) reçoit
+un budget en tokens. Quand le total dépasse, on retire d'abord le contenu le
+moins utile (historique, puis passages RAG les moins pertinents, puis fin des
+contextes utilisateur) au lieu de couper la fin du prompt, qui contient les
+instructions de recherche.
+
+Les tokens sont comptés avec tiktoken s'il est installé, sinon avec un
+estimateur calibré sur le découpage BPE (mots longs = plusieurs tokens,
+ponctuation et emojis = un token chacun).
+"""
+
+import os
+import re
+from typing import Dict, List, Optional
+
+from loguru import logger
+
+try:
+    import tiktoken
+    _ENCODING = tiktoken.get_encoding("cl100k_base")
+except Exception:
+    _ENCODING = None
+
+# Budgets par section (tokens)
+SECTION_BUDGETS = {
+    "query": int(os.getenv("PROMPT_BUDGET_QUERY", "300")),
+    "user_context": int(os.getenv("PROMPT_BUDGET_USER_CONTEXT", "800")),
+    "rag": int(os.getenv("PROMPT_BUDGET_RAG", "800")),
+    "history": int(os.getenv("PROMPT_BUDGET_HISTORY", "150")),
+}
+# Budget total des sections variables (hors instructions fixes du template)
+VARIABLE_SECTIONS_BUDGET = int(os.getenv("PROMPT_BUDGET_VARIABLE", "1800"))
+# Plafond de sécurité du message utilisateur complet envoyé à Perplexity
+MAX_USER_PROMPT_TOKENS = int(os.getenv("PROMPT_MAX_USER_TOKENS", "9000"))
+
+# Passages RAG: longueur max d'un extrait et pertinence minimale relative au meilleur
+RAG_PASSAGE_MAX_CHARS = 500
+RAG_MIN_RELATIVE_SCORE = float(os.getenv("PROMPT_RAG_MIN_RELATIVE_SCORE", "0.6"))
+RAG_MAX_PASSAGES = 6
+
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]", re.UNICODE)
+_SENTENCE_END_RE = re.compile(r"((?<=[.!?…])[ \t]+|\s*\n\s*)")
+
+
+def estimate_tokens(text: Optional[str]) -> int:
+    """Nombre de tokens d'un texte (tiktoken si disponible, sinon estimation)"""
+    if not text:
+        return 0
+    if _ENCODING is not None:
+        return len(_ENCODING.encode(text, disallowed_special=()))
+    tokens = 0
+    for piece in _TOKEN_RE.findall(text):
+        # Les mots courants tiennent en un token, les mots longs en plusieurs
+        tokens += 1 + len(piece) // 7 if piece[0].isalnum() or piece[0] == "_" else 1
+    return tokens
+
+
+def truncate_to_tokens(text: str, max_tokens: int, marker: str = "…") -> str:
+    """
+    Réduit un texte à `max_tokens` en coupant sur une fin de phrase ou de paragraphe
+
+    Les phrases et sauts de ligne (titres markdown) sont conservés tels quels,
+    dans l'ordre; on ne coupe au milieu d'une phrase que si la première ne tient pas.
+    """
+    if not text or estimate_tokens(text) <= max_tokens:
+        return text
+    if max_tokens <= 0:
+        return ""
+
+    # split() avec groupe capturant: [phrase, séparateur, phrase, séparateur, ...]
+    pieces = _SENTENCE_END_RE.split(text)
+    kept: List[str] = []
+    used = 0
+    for i in range(0, len(pieces), 2):
+        cost = estimate_tokens(pieces[i]) + 1
+        if used + cost > max_tokens:
+            break
+        kept.append(pieces[i] + (pieces[i + 1] if i + 1 < len(pieces) else ""))
+        used += cost
+
+    if kept:
+        return "".join(kept).rstrip() + f" {marker}"
+
+    # Aucune phrase complète ne tient: coupe proportionnelle
+    ratio = max_tokens / max(estimate_tokens(text), 1)
+    return text[:max(int(len(text) * ratio) - 1, 0)].rstrip() + marker
+
+
+def select_passages(documents: List[Dict], max_tokens: int) -> List[Dict]:
+    """
+    Choisit les passages RAG à inclure dans le budget
+
+    Les passages sont pris par score décroissant; les doublons et ceux dont le
+    score est trop loin du meilleur sont écartés. Quand le budget est atteint,
+    ce sont les moins pertinents qui sautent, pas les derniers reçus.
+    """
+    if not documents or max_tokens <= 0:
+        return []
+
+    ranked = sorted(documents, key=lambda d: float(d.get("score", 0) or 0), reverse=True)
+    best_score = float(ranked[0].get("score", 0) or 0)
+    min_score = best_score * RAG_MIN_RELATIVE_SCORE
+
+    selected: List[Dict] = []
+    seen_texts = set()
+    used = 0
+    for doc in ranked:
+        if len(selected) >= RAG_MAX_PASSAGES:
+            break
+        score = float(doc.get("score", 0) or 0)
+        if best_score > 0 and score < min_score:
+            break
+        text = str(doc.get("text", "")).strip()
+        fingerprint = re.sub(r"\s+", " ", text[:200]).lower()
+        if not text or fingerprint in seen_texts:
+            continue
+        excerpt = truncate_to_tokens(text[:RAG_PASSAGE_MAX_CHARS * 2], estimate_tokens(text[:RAG_PASSAGE_MAX_CHARS]))
+        cost = estimate_tokens(excerpt) + 12  # en-tête "[Réf. n] (Score: ...)"
+        if used + cost > max_tokens:
+            continue
+        seen_texts.add(fingerprint)
+        selected.append({**doc, "text": excerpt})
+        used += cost
+
+    return selected
+
+
+def fit_prompt_sections(
+    query: str,
+    documents: List[Dict],
+    user_context: str = "",
+    user_history: str = "",
+    total_budget: int = VARIABLE_SECTIONS_BUDGET
+) -> Dict:
+    """
+    Applique les budgets aux sections variables d'un prompt de rapport
+
+    Chaque section est d'abord ramenée à son propre budget. Si la somme dépasse
+    encore `total_budget`, on réduit dans l'ordre de moindre valeur:
+    historique, passages RAG, contextes utilisateur. La requête n'est jamais
+    retirée.
+
+    Returns:
+        {"query", "documents", "user_context", "user_history", "tokens"}
+    """
+    query = truncate_to_tokens(query, SECTION_BUDGETS["query"])
+    user_context = truncate_to_tokens(user_context or "", SECTION_BUDGETS["user_context"])
+    user_history = truncate_to_tokens(user_history or "", SECTION_BUDGETS["history"])
+    passages = select_passages(documents, SECTION_BUDGETS["rag"])
+
+    tokens = {
+        "query": estimate_tokens(query),
+        "user_context": estimate_tokens(user_context),
+        "rag": sum(estimate_tokens(p["text"]) + 12 for p in passages),
+        "history": estimate_tokens(user_history),
+    }
+    overflow = sum(tokens.values()) - total_budget
+
+    # 1. Historique: utile mais secondaire
+    if overflow > 0 and tokens["history"]:
+        overflow -= tokens["history"]
+        user_history = ""
+        tokens["history"] = 0
+
+    # 2. Passages RAG les moins pertinents
+    while overflow > 0 and passages:
+        removed = passages.pop()
+        cost = estimate_tokens(removed["text"]) + 12
+        overflow -= cost
+        tokens["rag"] -= cost
+
+    # 3. Fin des contextes utilisateur
+    if overflow > 0 and tokens["user_context"]:
+        target = max(tokens["user_context"] - overflow, 0)
+        user_context = truncate_to_tokens(user_context, target)
+        tokens["user_context"] = estimate_tokens(user_context)
+
+    tokens["total"] = sum(tokens.values())
+    logger.debug(f"Prompt section budgets applied: {tokens}")
+
+    return {
+        "query": query,
+        "documents": passages,
+        "user_context": user_context,
+        "user_history": user_history,
+        "tokens": tokens,
+    }
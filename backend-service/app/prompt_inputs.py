@@ -0,0 +1,89 @@
+"""
+Collecte concurrente des entrées d'un prompt de rapport
+
+La recherche vectorielle, les contextes utilisateur (memory-service) et
+l'historique RAG sont indépendants: ils sont lancés en même temps, chacun
+avec sa propre échéance. Une dépendance lente ou en erreur est remplacée par
+une valeur vide, le rapport est généré avec ce qui est disponible.
+"""
+
+import asyncio
+import os
+import time
+from typing import Any, Awaitable, Dict, Optional
+
+from loguru import logger
+
+from app import metrics
+from app.context_manager import get_context_for_prompt
+from app.document_client import search_documents, VECTOR_SEARCH_TIMEOUT
+from app.rag_memory import get_history_for_prompt
+
+# Échéance par étape (secondes)
+USER_CONTEXT_TIMEOUT = float(os.getenv("USER_CONTEXT_TIMEOUT", "5"))
+USER_HISTORY_TIMEOUT = float(os.getenv("USER_HISTORY_TIMEOUT", "2"))
+
+
+async def _timed_stage(
+    name: str,
+    awaitable: Awaitable[Any],
+    timeout: float,
+    default: Any,
+    timings: Dict[str, float]
+) -> Any:
+    """Attend une étape avec échéance; renvoie `default` en cas d'échec"""
+    start = time.perf_counter()
+    try:
+        return await asyncio.wait_for(awaitable, timeout=timeout)
+    except asyncio.TimeoutError:
+        logger.warning(f"Prompt stage '{name}' timed out after {timeout}s, continuing without it")
+        metrics.increment("prompt_stage_timeouts")
+        return default
+    except Exception as e:
+        logger.warning(f"Prompt stage '{name}' failed, continuing without it: {e}")
+        return default
+    finally:
+        elapsed = time.perf_counter() - start
+        timings[name] = round(elapsed, 3)
+        metrics.observe(f"prompt_stage_{name}", elapsed)
+
+
+async def gather_prompt_inputs(query: str, user_id: Optional[str] = None, top_k: int = 12) -> Dict[str, Any]:
+    """
+    Récupère en parallèle tout ce dont le prompt a besoin avant l'appel LLM
+
+    Args:
+        query: Requête d'analyse
+        user_id: Utilisateur (contextes et historique), None pour les veilles
+        top_k: Nombre de passages RAG
+
+    Returns:
+        {"documents", "user_context", "user_history", "timings"}: timings donne
+        la durée de chaque étape et le total (la plus lente, pas la somme)
+    """
+    timings: Dict[str, float] = {}
+    start = time.perf_counter()
+
+    stages = [
+        _timed_stage("search", search_documents(query, top_k=top_k), VECTOR_SEARCH_TIMEOUT, [], timings),
+    ]
+    if user_id:
+        stages.append(_timed_stage(
+            "user_context", get_context_for_prompt(user_id, max_length=6000, query=query),
+            USER_CONTEXT_TIMEOUT, "", timings
+        ))
+        # Lecture fichier synchrone: exécutée hors de la boucle d'événements
+        stages.append(_timed_stage(
+            "user_history", asyncio.to_thread(get_history_for_prompt, user_id, query, 800),
+            USER_HISTORY_TIMEOUT, "", timings
+        ))
+
+    results = await asyncio.gather(*stages)
+    timings["total"] = round(time.perf_counter() - start, 3)
+
+    return {
+        "documents": results[0],
+        "user_context": results[1] if user_id else "",
+        "user_history": results[2] if user_id else "",
+        "timings": timings,
+    }
@@ -0,0 +1,105 @@
+"""
+Registre des templates de prompts - parsés une seule fois à l'import
+
+Les prompts de rapport font plusieurs kilo-octets de texte fixe. Plutôt que de
+reconstruire tous les templates à chaque requête (dictionnaires de f-strings),
+chaque template est découpé une fois en segments statiques et champs
+variables; une requête ne fait que concaténer les segments du template choisi.
+
+Le registre connaît aussi la taille statique (en tokens) de chaque template,
+c'est-à-dire ce que coûte un type d'analyse avant tout texte utilisateur.
+"""
+
+from string import Formatter
+from typing import Dict, List, Optional, Tuple
+
+from app.prompt_budget import estimate_tokens
+
+
+class PromptTemplate:
+    """Template précompilé: texte fixe découpé autour des champs {nom}"""
+
+    __slots__ = ("name", "_literals", "_fields", "fields", "static_tokens", "static_chars")
+
+    def __init__(self, name: str, source: str, **static_values: str):
+        """
+        Args:
+            name: Nom dans le registre (ex. "report/finance_banque")
+            source: Texte au format str.format ({champ}, {{ et }} pour les accolades)
+            static_values: Champs connus dès l'import, substitués une fois pour toutes
+        """
+        self.name = name
+        literals: List[str] = []
+        fields: List[str] = []
+        pending = ""
+        for literal, field, spec, conversion in Formatter().parse(source):
+            pending += literal
+            if field is None:
+                continue
+            if spec or conversion:
+                raise ValueError(f"Template {name}: format spec not supported for field '{field}'")
+            if field in static_values:
+                pending += static_values[field]
+                continue
+            literals.append(pending)
+            fields.append(field)
+            pending = ""
+        literals.append(pending)
+
+        self._literals: Tuple[str, ...] = tuple(literals)
+        self._fields: Tuple[str, ...] = tuple(fields)
+        self.fields = frozenset(fields)
+        self.static_chars = sum(len(part) for part in literals)
+        self.static_tokens = sum(estimate_tokens(part) for part in literals)
+
+    def render(self, **values: str) -> str:
+        """Assemble le prompt: seuls les champs variables sont fournis"""
+        literals = self._literals
+        parts = [literals[0]]
+        for i, field in enumerate(self._fields, 1):
+            parts.append(values[field])
+            parts.append(literals[i])
+        return "".join(parts)
+
+
+class TemplateRegistry:
+    """Templates nommés, compilés à l'enregistrement"""
+
+    def __init__(self):
+        self._templates: Dict[str, PromptTemplate] = {}
+
+    def register(self, name: str, source: str, **static_values: str) -> PromptTemplate:
+        template = PromptTemplate(name, source, **static_values)
+        self._templates[name] = template
+        return template
+
+    def get(self, name: str, default: Optional[str] = None) -> PromptTemplate:
+        """Template `name`, ou `default` s'il n'existe pas"""
+        template = self._templates.get(name)
+        if template is None and default is not None:
+            template = self._templates[default]
+        if template is None:
+            raise KeyError(f"Unknown prompt template: {name}")
+        return template
+
+    def render(self, name: str, default: Optional[str] = None, **values: str) -> str:
+        return self.get(name, default).render(**values)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._templates
+
+    def static_sizes(self) -> Dict[str, Dict]:
+        """Coût fixe de chaque template, du plus cher au moins cher"""
+        sizes = {
+            name: {
+                "static_tokens": t.static_tokens,
+                "static_chars": t.static_chars,
+                "fields": sorted(t.fields),
+            }
+            for name, t in self._templates.items()
+        }
+        return dict(sorted(sizes.items(), key=lambda item: item[1]["static_tokens"], reverse=True))
+
+
+# Registre partagé (alimenté par business_prompts et main à l'import)
+PROMPT_TEMPLATES = TemplateRegistry()
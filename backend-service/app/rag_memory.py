@@ -1,18 +1,36 @@
 """
 RAG Memory - Memoire conversationnelle pour Prometheus
+
+Stockage SQLite (WAL) partage par les workers: chaque conversation est
+ajoutee dans sa propre transaction (pas de reecriture du fichier, pas d'ajout
+perdu en cas d'ecritures concurrentes, pas de fichier tronque en cas de crash).
+Un index inverse (terme -> conversations) est tenu a jour a chaque ajout: la
+recherche d'historique ne lit que les conversations qui contiennent les termes
+demandes.
+
+Les anciens fichiers memory_*.json sont importes au premier acces a
+l'utilisateur puis renommes en .json.migrated.
 """
 
 import os
 import json
-from typing import List, Dict, Any, Optional
+import sqlite3
+import threading
+from typing import List, Dict, Any, Iterable, Optional
 from datetime import datetime
 from loguru import logger
 import hashlib
 
 # Directory for storing conversation history
 MEMORY_DIR = os.getenv("MEMORY_DIR", "/data/memory")
+MEMORY_DB_PATH = os.getenv("MEMORY_DB_PATH", os.path.join(MEMORY_DIR, "rag_memory.sqlite3"))
 MAX_HISTORY_ITEMS = 50  # Maximum number of conversations to keep per user
 
+# Limite de termes par requete SQL (variables SQLite)
+MAX_LOOKUP_TERMS = 500
+# Borne haute d'une recherche par prefixe: term <= x < term + _PREFIX_END
+_PREFIX_END = "\U0010ffff"
+
 
 def ensure_memory_dir():
     """Cree le repertoire de memoire si necessaire"""
@@ -20,67 +38,226 @@ def ensure_memory_dir():
 
 
 def get_user_memory_path(user_id: str) -> str:
-    """Retourne le chemin du fichier de memoire pour un utilisateur"""
-    ensure_memory_dir()
+    """Retourne le chemin de l'ancien fichier JSON de memoire d'un utilisateur"""
     user_hash = hashlib.md5(user_id.encode()).hexdigest()[:12]
     return os.path.join(MEMORY_DIR, f"memory_{user_hash}.json")
 
 
+def _terms(text: str) -> set:
+    """Termes indexes: minuscules, separes par les espaces (comme l'ancien appariement)"""
+    return set(text.lower().split())
+
+
+class ConversationStore:
+    """Historique par utilisateur: table append-only et index inverse des termes"""
+
+    def __init__(self, path: str = MEMORY_DB_PATH, max_items: int = MAX_HISTORY_ITEMS):
+        self.path = path
+        self.max_items = max_items
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS conversations ("
+                " seq INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " user_id TEXT NOT NULL,"
+                " id TEXT NOT NULL,"
+                " timestamp TEXT NOT NULL,"
+                " query TEXT NOT NULL,"
+                " response_summary TEXT NOT NULL,"
+                " analysis_type TEXT,"
+                " metadata TEXT NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_conversations_user ON conversations(user_id, seq)")
+            # in_query: le terme apparait dans la requete (pertinence), sinon seulement dans la reponse
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS conversation_terms ("
+                " user_id TEXT NOT NULL,"
+                " term TEXT NOT NULL,"
+                " seq INTEGER NOT NULL,"
+                " in_query INTEGER NOT NULL,"
+                " PRIMARY KEY (user_id, term, seq)) WITHOUT ROWID"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_conversation_terms_seq ON conversation_terms(user_id, seq)")
+
+    def _connect(self) -> sqlite3.Connection:
+        """Connexion ouverte une fois par processus, utilisee sous self._lock"""
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, timeout=30.0, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn = conn
+        return self._conn
+
+    @staticmethod
+    def _row_to_conversation(row) -> Dict[str, Any]:
+        _, conv_id, timestamp, query, response_summary, analysis_type, metadata = row
+        return {
+            "id": conv_id,
+            "timestamp": timestamp,
+            "query": query,
+            "response_summary": response_summary,
+            "analysis_type": analysis_type,
+            "metadata": json.loads(metadata),
+        }
+
+    def _fetch(self, conn: sqlite3.Connection, seqs: List[int]) -> Dict[int, Dict[str, Any]]:
+        if not seqs:
+            return {}
+        placeholders = ",".join("?" * len(seqs))
+        rows = conn.execute(
+            "SELECT seq, id, timestamp, query, response_summary, analysis_type, metadata"
+            f" FROM conversations WHERE seq IN ({placeholders})",
+            seqs
+        ).fetchall()
+        return {row[0]: self._row_to_conversation(row) for row in rows}
+
+    def append(self, user_id: str, conversations: Iterable[Dict[str, Any]]) -> None:
+        """Ajoute des conversations (une transaction) puis ne garde que les max_items dernieres"""
+        with self._lock, self._connect() as conn:
+            for conv in conversations:
+                query = conv.get("query", "")
+                response_summary = conv.get("response_summary", "")
+                cursor = conn.execute(
+                    "INSERT INTO conversations"
+                    " (user_id, id, timestamp, query, response_summary, analysis_type, metadata)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        user_id, conv.get("id", ""), conv.get("timestamp", ""), query, response_summary,
+                        conv.get("analysis_type"), json.dumps(conv.get("metadata") or {}, ensure_ascii=False)
+                    )
+                )
+                seq = cursor.lastrowid
+                query_terms = _terms(query)
+                conn.executemany(
+                    "INSERT OR IGNORE INTO conversation_terms (user_id, term, seq, in_query) VALUES (?, ?, ?, ?)",
+                    [(user_id, term, seq, 1) for term in query_terms]
+                    + [(user_id, term, seq, 0) for term in _terms(response_summary) - query_terms]
+                )
+            cutoff = conn.execute(
+                "SELECT seq FROM conversations WHERE user_id = ? ORDER BY seq DESC LIMIT 1 OFFSET ?",
+                (user_id, self.max_items - 1)
+            ).fetchone()
+            if cutoff is not None:
+                conn.execute("DELETE FROM conversations WHERE user_id = ? AND seq < ?", (user_id, cutoff[0]))
+                conn.execute("DELETE FROM conversation_terms WHERE user_id = ? AND seq < ?", (user_id, cutoff[0]))
+
+    def relevant(self, user_id: str, words: Iterable[str], limit: int) -> List[Dict[str, Any]]:
+        """Conversations dont la requete partage le plus de mots (egalite: la plus ancienne d'abord)"""
+        words = list(words)[:MAX_LOOKUP_TERMS]
+        if not words:
+            return []
+        placeholders = ",".join("?" * len(words))
+        # "+seq": force la lecture par (user_id, term) plutot que l'index par seq
+        with self._lock, self._connect() as conn:
+            ranked = conn.execute(
+                "SELECT seq FROM conversation_terms"
+                f" WHERE user_id = ? AND in_query = 1 AND term IN ({placeholders})"
+                " GROUP BY +seq ORDER BY COUNT(*) DESC, seq ASC LIMIT ?",
+                (user_id, *words, limit)
+            ).fetchall()
+            seqs = [row[0] for row in ranked]
+            found = self._fetch(conn, seqs)
+        return [found[seq] for seq in seqs if seq in found]
+
+    def search(self, user_id: str, terms: List[str], limit: int) -> List[Dict[str, Any]]:
+        """
+        Conversations contenant un des termes (prefixe d'un mot de la requete ou
+        de la reponse), classees par nombre de termes trouves
+        """
+        scores: Dict[int, int] = {}
+        with self._lock, self._connect() as conn:
+            matches_by_term: Dict[str, List[int]] = {}
+            for term in terms[:MAX_LOOKUP_TERMS]:
+                if term not in matches_by_term:
+                    matches_by_term[term] = [row[0] for row in conn.execute(
+                        "SELECT DISTINCT seq FROM conversation_terms WHERE user_id = ? AND term >= ? AND term < ?",
+                        (user_id, term, term + _PREFIX_END)
+                    )]
+                for seq in matches_by_term[term]:
+                    scores[seq] = scores.get(seq, 0) + 1
+            seqs = sorted(scores, key=lambda seq: (-scores[seq], seq))[:limit]
+            found = self._fetch(conn, seqs)
+        return [found[seq] for seq in seqs if seq in found]
+
+    def recent(self, user_id: str, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Conversations les plus recentes d'abord"""
+        with self._lock, self._connect() as conn:
+            rows = conn.execute(
+                "SELECT seq, id, timestamp, query, response_summary, analysis_type, metadata"
+                " FROM conversations WHERE user_id = ? ORDER BY timestamp DESC, seq DESC LIMIT ?",
+                (user_id, -1 if limit is None else limit)
+            ).fetchall()
+        return [self._row_to_conversation(row) for row in rows]
+
+    def clear(self, user_id: str) -> bool:
+        with self._lock, self._connect() as conn:
+            deleted = conn.execute("DELETE FROM conversations WHERE user_id = ?", (user_id,)).rowcount
+            conn.execute("DELETE FROM conversation_terms WHERE user_id = ?", (user_id,))
+        return deleted > 0
+
+
+_store: Optional[ConversationStore] = None
+_store_lock = threading.Lock()
+_migrated_users: set = set()
+
+
+def get_conversation_store() -> ConversationStore:
+    """Store partage (cree au premier usage)"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = ConversationStore()
+    return _store
+
+
+def _store_for(user_id: str) -> ConversationStore:
+    """Store de l'utilisateur, apres import eventuel de son ancien fichier JSON"""
+    store = get_conversation_store()
+    if user_id not in _migrated_users:
+        legacy_path = get_user_memory_path(user_id)
+        claimed_path = legacy_path + ".importing"
+        try:
+            # Le renommage est atomique: un seul worker obtient le fichier et l'importe
+            os.replace(legacy_path, claimed_path)
+        except FileNotFoundError:
+            pass  # Pas d'ancien fichier, ou importe par un autre worker
+        else:
+            try:
+                with open(claimed_path, 'r', encoding='utf-8') as f:
+                    conversations = json.load(f).get("conversations", [])
+                store.append(user_id, conversations[-store.max_items:])
+                os.replace(claimed_path, legacy_path + ".migrated")
+                logger.info(f"Imported {len(conversations)} legacy conversations for user {user_id[:8]}...")
+            except Exception as e:
+                # append est une seule transaction: rien n'a ete ecrit, le fichier est rendu
+                os.replace(claimed_path, legacy_path)
+                logger.error(f"Error importing legacy memory for user {user_id[:8]}...: {e}")
+        _migrated_users.add(user_id)
+    return store
+
+
 def load_user_memory(user_id: str) -> List[Dict[str, Any]]:
     """
     Charge l'historique de memoire d'un utilisateur
-    
+
     Args:
         user_id: Identifiant de l'utilisateur
-    
+
     Returns:
-        Liste des conversations passees
+        Liste des conversations passees (ordre chronologique)
     """
-    memory_path = get_user_memory_path(user_id)
-    
-    if not os.path.exists(memory_path):
-        return []
-    
     try:
-        with open(memory_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-            return data.get("conversations", [])
+        return list(reversed(_store_for(user_id).recent(user_id)))
     except Exception as e:
         logger.error(f"Error loading memory for user {user_id[:8]}...: {e}")
         return []
 
 
-def save_user_memory(user_id: str, conversations: List[Dict[str, Any]]) -> bool:
-    """
-    Sauvegarde l'historique de memoire d'un utilisateur
-    
-    Args:
-        user_id: Identifiant de l'utilisateur
-        conversations: Liste des conversations
-    
-    Returns:
-        True si sauvegarde reussie
-    """
-    memory_path = get_user_memory_path(user_id)
-    
-    # Limiter le nombre de conversations
-    if len(conversations) > MAX_HISTORY_ITEMS:
-        conversations = conversations[-MAX_HISTORY_ITEMS:]
-    
-    try:
-        data = {
-            "user_id": user_id,
-            "updated_at": datetime.now().isoformat(),
-            "conversations": conversations
-        }
-        with open(memory_path, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
-        return True
-    except Exception as e:
-        logger.error(f"Error saving memory for user {user_id[:8]}...: {e}")
-        return False
-
-
 def add_conversation(
     user_id: str,
     query: str,
@@ -90,19 +267,17 @@ def add_conversation(
 ) -> bool:
     """
     Ajoute une conversation a l'historique de l'utilisateur
-    
+
     Args:
         user_id: Identifiant de l'utilisateur
         query: Requete de l'utilisateur
         response: Reponse generee
         analysis_type: Type d'analyse
         metadata: Metadonnees optionnelles
-    
+
     Returns:
         True si ajout reussi
     """
-    conversations = load_user_memory(user_id)
-    
     new_conversation = {
         "id": hashlib.md5(f"{user_id}{datetime.now().isoformat()}".encode()).hexdigest()[:16],
         "timestamp": datetime.now().isoformat(),
@@ -111,9 +286,13 @@ def add_conversation(
         "analysis_type": analysis_type,
         "metadata": metadata or {}
     }
-    
-    conversations.append(new_conversation)
-    return save_user_memory(user_id, conversations)
+
+    try:
+        _store_for(user_id).append(user_id, [new_conversation])
+        return True
+    except Exception as e:
+        logger.error(f"Error saving memory for user {user_id[:8]}...: {e}")
+        return False
 
 
 def get_relevant_history(
@@ -123,69 +302,57 @@ def get_relevant_history(
 ) -> List[Dict[str, Any]]:
     """
     Recupere l'historique pertinent pour une requete
-    
+
     Args:
         user_id: Identifiant de l'utilisateur
         query: Requete actuelle
         max_items: Nombre maximum d'elements a retourner
-    
+
     Returns:
         Liste des conversations pertinentes
     """
-    conversations = load_user_memory(user_id)
-    
-    if not conversations:
-        return []
-    
-    # Simple keyword matching for now
+    # Score = nombre de mots communs avec la requete, lu dans l'index inverse
     # In production, use vector similarity search
-    query_words = set(query.lower().split())
-    
-    scored_conversations = []
-    for conv in conversations:
-        conv_words = set(conv.get("query", "").lower().split())
-        # Score = intersection of words
-        score = len(query_words & conv_words)
-        if score > 0:
-            scored_conversations.append((score, conv))
-    
-    # Sort by score descending
-    scored_conversations.sort(key=lambda x: x[0], reverse=True)
-    
-    # Return top items
-    return [conv for _, conv in scored_conversations[:max_items]]
+    query_words = _terms(query)
+    if not query_words:
+        return []
+    try:
+        return _store_for(user_id).relevant(user_id, query_words, max_items)
+    except Exception as e:
+        logger.error(f"Error reading memory for user {user_id[:8]}...: {e}")
+        return []
 
 
 def get_history_for_prompt(user_id: str, query: str, max_length: int = 1000) -> str:
     """
     Recupere l'historique formate pour inclusion dans un prompt
-    
+
     Args:
         user_id: Identifiant de l'utilisateur
         query: Requete actuelle
         max_length: Longueur maximale du texte
-    
+
     Returns:
         Historique formate ou chaine vide
     """
     relevant = get_relevant_history(user_id, query, max_items=3)
-    
+
     if not relevant:
         return ""
-    
+
     history_parts = []
     total_length = 0
-    
+
     for conv in relevant:
         entry = f"- {conv.get('analysis_type', 'analyse')}: {conv.get('query', '')[:100]}"
         if total_length + len(entry) > max_length:
             break
         history_parts.append(entry)
         total_length += len(entry)
-    
+
     if not history_parts:
         return ""
-    
+
     return f"""
 ## HISTORIQUE DES ANALYSES PRECEDENTES
 {chr(10).join(history_parts)}
@@ -195,42 +362,39 @@ def get_history_for_prompt(user_id: str, query: str, max_length: int = 1000) ->
 def get_full_history(user_id: str, limit: int = 20) -> List[Dict[str, Any]]:
     """
     Recupere l'historique complet d'un utilisateur
-    
+
     Args:
         user_id: Identifiant de l'utilisateur
         limit: Nombre maximum d'elements
-    
+
     Returns:
-        Liste des conversations
+        Liste des conversations (plus recentes d'abord)
     """
-    conversations = load_user_memory(user_id)
-    # Sort by timestamp descending (most recent first)
-    conversations.sort(key=lambda x: x.get("timestamp", ""), reverse=True)
-    return conversations[:limit]
+    try:
+        return _store_for(user_id).recent(user_id, limit)
+    except Exception as e:
+        logger.error(f"Error loading memory for user {user_id[:8]}...: {e}")
+        return []
 
 
 def clear_user_memory(user_id: str) -> bool:
     """
     Supprime l'historique d'un utilisateur
-    
+
     Args:
         user_id: Identifiant de l'utilisateur
-    
+
     Returns:
         True si suppression reussie
     """
-    memory_path = get_user_memory_path(user_id)
-    
-    if os.path.exists(memory_path):
-        try:
-            os.remove(memory_path)
-            logger.info(f"Memory cleared for user {user_id[:8]}...")
-            return True
-        except Exception as e:
-            logger.error(f"Error clearing memory: {e}")
-            return False
-    
-    return False
+    try:
+        cleared = _store_for(user_id).clear(user_id)
+    except Exception as e:
+        logger.error(f"Error clearing memory: {e}")
+        return False
+    if cleared:
+        logger.info(f"Memory cleared for user {user_id[:8]}...")
+    return cleared
 
 
 def search_history(
@@ -240,31 +404,24 @@ def search_history(
 ) -> List[Dict[str, Any]]:
     """
     Recherche dans l'historique d'un utilisateur
-    
+
+    Un terme correspond au debut d'un mot de la requete ou du resume de la
+    reponse ("fin" trouve "fintech"); les conversations sont classees par
+    nombre de termes trouves.
+
     Args:
         user_id: Identifiant de l'utilisateur
         search_query: Terme de recherche
         max_results: Nombre maximum de resultats
-    
+
     Returns:
         Liste des conversations correspondantes
     """
-    conversations = load_user_memory(user_id)
     search_terms = search_query.lower().split()
-    
-    results = []
-    for conv in conversations:
-        text = f"{conv.get('query', '')} {conv.get('response_summary', '')}".lower()
-        if any(term in text for term in search_terms):
-            results.append(conv)
-    
-    # Sort by relevance (number of matching terms)
-    results.sort(
-        key=lambda c: sum(
-            1 for term in search_terms 
-            if term in f"{c.get('query', '')} {c.get('response_summary', '')}".lower()
-        ),
-        reverse=True
-    )
-    
-    return results[:max_results]
+    if not search_terms:
+        return []
+    try:
+        return _store_for(user_id).search(user_id, search_terms, max_results)
+    except Exception as e:
+        logger.error(f"Error searching memory for user {user_id[:8]}...: {e}")
+        return []
@@ -0,0 +1,249 @@
+"""
+Cache des résultats d'analyses - évite de régénérer un rapport identique
+
+Les veilles planifiées et les utilisateurs qui relancent après un timeout
+redemandent souvent exactement la même analyse. La clé est construite sur la
+requête normalisée (query, analysis_type, business_type, langue, utilisateur)
+et la durée de vie par défaut correspond à la fenêtre de recherche de 7 jours
+imposée au modèle.
+
+Deux backends interchangeables (variable ANALYSIS_CACHE_BACKEND):
+- "memory": LRU en mémoire, propre au worker
+- "disk": SQLite local, partagé entre workers et conservé au redémarrage
+- "none": cache désactivé
+"""
+
+import os
+import re
+import json
+import time
+import sqlite3
+import asyncio
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Optional, Dict, Any
+
+from loguru import logger
+
+from app import metrics
+
+# Configuration
+ANALYSIS_CACHE_BACKEND = os.getenv("ANALYSIS_CACHE_BACKEND", "memory").lower()
+ANALYSIS_CACHE_TTL = int(os.getenv("ANALYSIS_CACHE_TTL", str(7 * 24 * 3600)))  # 7 jours
+ANALYSIS_CACHE_MAX_ENTRIES = int(os.getenv("ANALYSIS_CACHE_MAX_ENTRIES", "500"))
+ANALYSIS_CACHE_DIR = os.getenv("ANALYSIS_CACHE_DIR", "/data/cache")
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_text(value: Optional[str]) -> str:
+    """Minuscules, sans accents ni espaces superflus (clé de cache stable)"""
+    if not value:
+        return ""
+    value = unicodedata.normalize("NFKD", value)
+    value = "".join(c for c in value if not unicodedata.combining(c))
+    return _WHITESPACE_RE.sub(" ", value).strip().lower()
+
+
+def make_analysis_key(
+    query: str,
+    analysis_type: str,
+    business_type: Optional[str],
+    language: Optional[str],
+    user_id: Optional[str] = None
+) -> str:
+    """
+    Clé de cache d'une analyse
+
+    user_id fait partie de la clé car les contextes utilisateur sont injectés
+    dans le prompt: deux utilisateurs n'obtiennent pas le même rapport.
+    """
+    parts = [
+        normalize_text(query),
+        normalize_text(analysis_type),
+        normalize_text(business_type or "general"),
+        normalize_text(language or "fr"),
+        str(user_id or ""),
+    ]
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+
+class MemoryResultCache:
+    """LRU en mémoire avec expiration par entrée"""
+
+    blocking = False
+
+    def __init__(self, max_entries: int = ANALYSIS_CACHE_MAX_ENTRIES, ttl: int = ANALYSIS_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            stored_at, value = entry
+            if time.time() - stored_at > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return {"value": value, "stored_at": stored_at}
+
+    def set(self, key: str, value: Dict[str, Any]) -> None:
+        with self._lock:
+            self._entries[key] = (time.time(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class DiskResultCache:
+    """Cache SQLite: survit aux redémarrages, éviction LRU sur last_access"""
+
+    blocking = True
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        max_entries: int = ANALYSIS_CACHE_MAX_ENTRIES,
+        ttl: int = ANALYSIS_CACHE_TTL
+    ):
+        self.path = path or os.path.join(ANALYSIS_CACHE_DIR, "analysis_cache.sqlite3")
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS analysis_cache ("
+                " key TEXT PRIMARY KEY,"
+                " value TEXT NOT NULL,"
+                " stored_at REAL NOT NULL,"
+                " last_access REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_analysis_cache_access ON analysis_cache(last_access)"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=5.0)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            row = conn.execute(
+                "SELECT value, stored_at FROM analysis_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            value, stored_at = row
+            if now - stored_at > self.ttl:
+                conn.execute("DELETE FROM analysis_cache WHERE key = ?", (key,))
+                return None
+            conn.execute("UPDATE analysis_cache SET last_access = ? WHERE key = ?", (now, key))
+            return {"value": json.loads(value), "stored_at": stored_at}
+
+    def set(self, key: str, value: Dict[str, Any]) -> None:
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO analysis_cache (key, value, stored_at, last_access) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), now, now)
+            )
+            conn.execute("DELETE FROM analysis_cache WHERE stored_at < ?", (now - self.ttl,))
+            conn.execute(
+                "DELETE FROM analysis_cache WHERE key IN ("
+                " SELECT key FROM analysis_cache ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+
+    def delete(self, key: str) -> None:
+        with self._lock, self._connect() as conn:
+            conn.execute("DELETE FROM analysis_cache WHERE key = ?", (key,))
+
+    def clear(self) -> None:
+        with self._lock, self._connect() as conn:
+            conn.execute("DELETE FROM analysis_cache")
+
+    def __len__(self) -> int:
+        with self._lock, self._connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM analysis_cache").fetchone()[0]
+
+
+def create_result_cache(backend: str = ANALYSIS_CACHE_BACKEND):
+    """Instancie le backend configuré (None si désactivé ou indisponible)"""
+    if backend in ("none", "off", "disabled", ""):
+        logger.info("Analysis result cache disabled")
+        return None
+    if backend == "disk":
+        try:
+            cache = DiskResultCache()
+            logger.info(f"Analysis result cache: disk ({cache.path}, TTL {ANALYSIS_CACHE_TTL}s)")
+            return cache
+        except Exception as e:
+            logger.warning(f"Disk analysis cache unavailable, falling back to memory: {e}")
+    logger.info(f"Analysis result cache: memory (max {ANALYSIS_CACHE_MAX_ENTRIES}, TTL {ANALYSIS_CACHE_TTL}s)")
+    return MemoryResultCache()
+
+
+_cache = create_result_cache()
+
+
+def get_result_cache():
+    """Retourne le cache partagé du process"""
+    return _cache
+
+
+async def get_cached_analysis(key: str) -> Optional[Dict[str, Any]]:
+    """
+    Lit une analyse en cache sans bloquer la boucle d'événements
+
+    Returns:
+        {"value": <AnalysisResponse dict>, "stored_at": <epoch>} ou None
+    """
+    cache = _cache
+    if cache is None:
+        return None
+    try:
+        if cache.blocking:
+            entry = await asyncio.to_thread(cache.get, key)
+        else:
+            entry = cache.get(key)
+    except Exception as e:
+        logger.warning(f"Analysis cache read failed (non-blocking): {e}")
+        return None
+    metrics.increment("analysis_cache_hits" if entry else "analysis_cache_misses")
+    return entry
+
+
+async def store_analysis(key: str, value: Dict[str, Any]) -> None:
+    """Enregistre une analyse réussie dans le cache"""
+    cache = _cache
+    if cache is None:
+        return
+    try:
+        if cache.blocking:
+            await asyncio.to_thread(cache.set, key, value)
+        else:
+            cache.set(key, value)
+    except Exception as e:
+        logger.warning(f"Analysis cache write failed (non-blocking): {e}")
@@ -0,0 +1,80 @@
+"""
+Single-flight - une seule exécution pour des appels identiques simultanés
+
+Quand deux requêtes identiques arrivent pendant qu'une génération est en cours
+(double clic, deux utilisateurs sur la même veille), la seconde attend le
+résultat de la première au lieu de lancer un nouvel appel sonar-pro.
+"""
+
+import asyncio
+import hashlib
+import json
+from typing import Any, Awaitable, Callable, Dict, TypeVar
+
+from app import metrics
+
+T = TypeVar("T")
+
+
+def make_flight_key(*parts: Any) -> str:
+    """Clé stable à partir de valeurs sérialisables en JSON"""
+    raw = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class _Call:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: "asyncio.Task"):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Regroupe les appels concurrents portant la même clé
+
+    L'appel est exécuté dans une tâche indépendante: l'annulation d'un appelant
+    (client déconnecté) n'interrompt pas les autres. La tâche n'est annulée que
+    lorsque plus personne n'attend son résultat.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: Dict[str, _Call] = {}
+
+    def in_flight(self, key: str) -> bool:
+        """True si un appel portant cette clé est en cours"""
+        return key in self._calls
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[T]]) -> T:
+        """
+        Exécute fn() ou rejoint l'exécution en cours pour la même clé
+
+        Args:
+            key: Clé de regroupement (voir make_flight_key)
+            fn: Fabrique de la coroutine à exécuter (appelée une seule fois)
+        """
+        call = self._calls.get(key)
+        if call is None:
+            call = _Call(asyncio.ensure_future(fn()))
+            self._calls[key] = call
+            call.task.add_done_callback(lambda _: self._forget(key, call))
+        else:
+            metrics.increment(f"{self.name}_coalesced")
+
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                call.task.cancel()
+                self._forget(key, call)
+
+    def _forget(self, key: str, call: _Call) -> None:
+        if self._calls.get(key) is call:
+            del self._calls[key]
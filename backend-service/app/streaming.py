@@ -0,0 +1,270 @@
+"""
+Utilitaires de streaming - relais des flux LLM vers les clients HTTP
+
+Détecte la déconnexion du client (onglet fermé, requête annulée) pendant une
+génération et propage l'annulation jusqu'à l'appel Perplexity en cours, pour
+ne pas consommer des tokens sonar-pro que personne ne lira.
+
+Une génération SSE peut être partagée entre plusieurs clients (GenerationHub):
+les abonnés arrivés en cours de route reçoivent les événements déjà émis puis
+le flux en direct, et l'appel amont n'est annulé que lorsque tous sont partis.
+Les événements portent un identifiant: un client coupé reprend avec
+Last-Event-ID sans relancer la génération.
+"""
+
+import asyncio
+import os
+import time
+import uuid
+from collections import deque
+from itertools import islice
+from typing import AsyncIterator, AsyncGenerator, Callable, Deque, Dict, Optional, Tuple, TypeVar
+
+from fastapi import Request
+from loguru import logger
+
+T = TypeVar("T")
+
+# Intervalle de vérification de la connexion client pendant un flux
+DISCONNECT_POLL_INTERVAL = 1.0
+
+# Reprise des flux SSE (Last-Event-ID)
+SSE_REPLAY_EVENTS = int(os.getenv("SSE_REPLAY_EVENTS", "2000"))  # Événements conservés par génération
+SSE_RESUME_GRACE = float(os.getenv("SSE_RESUME_GRACE", "30"))  # Délai de reconnexion avant annulation (s)
+SSE_REPLAY_RETENTION = float(os.getenv("SSE_REPLAY_RETENTION", "300"))  # Conservation après la fin (s)
+
+
+class ClientDisconnected(Exception):
+    """Le client HTTP a fermé la connexion pendant le streaming"""
+
+
+async def relay_until_disconnect(
+    http_request: Request,
+    source: AsyncIterator[T],
+    poll_interval: float = DISCONNECT_POLL_INTERVAL
+) -> AsyncGenerator[T, None]:
+    """
+    Relaie les éléments de `source` tant que le client reste connecté.
+
+    La connexion est vérifiée au plus toutes les `poll_interval` secondes, y compris
+    quand l'amont ne produit rien (recherche web sonar-pro avant le premier token).
+    Si le client est parti, l'élément en attente est annulé, `source` est fermé
+    (ce qui ferme la réponse HTTP amont) et ClientDisconnected est levée.
+
+    Args:
+        http_request: Requête Starlette du client
+        source: Générateur asynchrone amont (deltas Perplexity)
+        poll_interval: Intervalle de vérification de la connexion (secondes)
+    """
+    pending = None
+    last_check = time.monotonic()
+    try:
+        while True:
+            pending = asyncio.ensure_future(source.__anext__())
+            while True:
+                done, _ = await asyncio.wait({pending}, timeout=poll_interval)
+                if done:
+                    break
+                last_check = time.monotonic()
+                if await http_request.is_disconnected():
+                    raise ClientDisconnected()
+
+            try:
+                item = pending.result()
+            except StopAsyncIteration:
+                return
+            finally:
+                pending = None
+
+            # Flux rapide: vérifier aussi entre deux éléments
+            if time.monotonic() - last_check >= poll_interval:
+                last_check = time.monotonic()
+                if await http_request.is_disconnected():
+                    raise ClientDisconnected()
+
+            yield item
+    finally:
+        if pending is not None and not pending.done():
+            pending.cancel()
+            try:
+                await pending
+            except (asyncio.CancelledError, StopAsyncIteration):
+                pass
+            except Exception as e:
+                logger.debug(f"Upstream stream ended with error after cancellation: {e}")
+        aclose = getattr(source, "aclose", None)
+        if aclose is not None:
+            await aclose()
+
+
+class ReplayUnavailable(Exception):
+    """Les événements demandés (Last-Event-ID) ne sont plus dans le tampon de reprise"""
+
+
+class SharedGeneration:
+    """
+    Génération SSE diffusée à plusieurs abonnés
+
+    Le producteur tourne dans une tâche indépendante des requêtes HTTP. Chaque
+    événement reçoit un identifiant "<génération>:<numéro>" et les derniers
+    événements sont conservés (tampon borné): un abonné arrivé en cours de route
+    reçoit le flux depuis le début, un client reconnecté avec Last-Event-ID
+    reprend juste après le dernier événement reçu.
+
+    Quand le dernier abonné part, l'appel amont n'est annulé qu'après
+    `resume_grace` secondes, le temps pour un client coupé de se reconnecter.
+    """
+
+    def __init__(
+        self,
+        key: str,
+        source: AsyncIterator[str],
+        replay_limit: int = SSE_REPLAY_EVENTS,
+        resume_grace: float = SSE_RESUME_GRACE
+    ):
+        self.key = key
+        self.id = uuid.uuid4().hex[:12]
+        self.events: Deque[Tuple[int, str]] = deque(maxlen=replay_limit)
+        self.last_seq = 0
+        self.finished = False
+        self.subscribers = 0
+        self.abandoned = False
+        self.resume_grace = resume_grace
+        self._changed = asyncio.Condition()
+        self._source = source
+        self._abandon_handle: Optional[asyncio.TimerHandle] = None
+        self.task: Optional[asyncio.Task] = None
+
+    def start(self) -> "asyncio.Task":
+        self.task = asyncio.ensure_future(self._run())
+        return self.task
+
+    async def _run(self) -> None:
+        try:
+            async for event in self._source:
+                async with self._changed:
+                    self.last_seq += 1
+                    self.events.append((self.last_seq, event))
+                    self._changed.notify_all()
+        finally:
+            async with self._changed:
+                self.finished = True
+                self._changed.notify_all()
+
+    def parse_event_id(self, event_id: Optional[str]) -> Optional[int]:
+        """Numéro d'événement si `event_id` appartient à cette génération"""
+        generation_id, _, seq = (event_id or "").partition(":")
+        if generation_id != self.id or not seq.isdigit():
+            return None
+        return int(seq)
+
+    async def subscribe(self, after: int = 0) -> AsyncGenerator[str, None]:
+        """
+        Rejoue les événements de numéro > `after` puis suit le flux jusqu'à la fin
+
+        Raises:
+            ReplayUnavailable: des événements après `after` ont quitté le tampon
+        """
+        self.subscribers += 1
+        if self._abandon_handle is not None:
+            self._abandon_handle.cancel()
+            self._abandon_handle = None
+        position = after
+        try:
+            while True:
+                async with self._changed:
+                    while position >= self.last_seq and not self.finished:
+                        await self._changed.wait()
+                    first_seq = self.events[0][0] if self.events else self.last_seq + 1
+                    if position + 1 < first_seq:
+                        raise ReplayUnavailable(
+                            f"events {position + 1}-{first_seq - 1} of generation {self.id} no longer buffered"
+                        )
+                    batch = list(islice(self.events, position + 1 - first_seq, None))
+                    finished = self.finished
+                for seq, event in batch:
+                    position = seq
+                    yield f"id: {self.id}:{seq}\n{event}"
+                if finished and position >= self.last_seq:
+                    return
+        finally:
+            self.subscribers -= 1
+            if self.subscribers == 0 and self.task is not None and not self.task.done():
+                if self.resume_grace > 0:
+                    self._abandon_handle = asyncio.get_running_loop().call_later(
+                        self.resume_grace, self._abandon_if_idle
+                    )
+                else:
+                    self._abandon_if_idle()
+
+    def _abandon_if_idle(self) -> None:
+        self._abandon_handle = None
+        if self.subscribers == 0 and self.task is not None and not self.task.done():
+            logger.info("No SSE subscriber came back, cancelling shared generation")
+            self.abandoned = True
+            self.task.cancel()
+
+
+class GenerationHub:
+    """
+    Registre des générations SSE, indexées par clé de requête
+
+    Les générations terminées restent disponibles `retention` secondes pour
+    les reprises (Last-Event-ID); une nouvelle requête sans Last-Event-ID
+    démarre une nouvelle génération.
+    """
+
+    def __init__(self, retention: float = SSE_REPLAY_RETENTION):
+        self.retention = retention
+        self._generations: Dict[str, SharedGeneration] = {}
+        self._by_id: Dict[str, SharedGeneration] = {}
+
+    def __len__(self) -> int:
+        return len(self._generations)
+
+    def attach(
+        self,
+        key: str,
+        source_factory: Callable[[], AsyncIterator[str]]
+    ) -> Tuple[SharedGeneration, bool]:
+        """
+        Retourne la génération en cours pour `key`, ou en démarre une
+
+        Returns:
+            (génération, True si une génération existante a été rejointe)
+        """
+        generation = self._generations.get(key)
+        if generation is not None and not generation.abandoned:
+            return generation, True
+
+        generation = SharedGeneration(key, source_factory())
+        self._generations[key] = generation
+        self._by_id[generation.id] = generation
+        generation.start().add_done_callback(lambda _: self._finished(key, generation))
+        return generation, False
+
+    def find(self, key: str, event_id: Optional[str]) -> Optional[Tuple[SharedGeneration, int]]:
+        """
+        Génération à reprendre pour un Last-Event-ID, si elle existe encore
+
+        La clé doit correspondre: un identifiant d'événement ne donne pas accès
+        à la génération d'une autre requête.
+
+        Returns:
+            (génération, numéro du dernier événement reçu) ou None
+        """
+        generation = self._by_id.get((event_id or "").partition(":")[0])
+        if generation is None or generation.key != key or generation.abandoned:
+            return None
+        seq = generation.parse_event_id(event_id)
+        if seq is None:
+            return None
+        return generation, seq
+
+    def _finished(self, key: str, generation: SharedGeneration) -> None:
+        if self._generations.get(key) is generation:
+            del self._generations[key]
+        if generation.abandoned or self.retention <= 0:
+            self._by_id.pop(generation.id, None)
+            return
+        asyncio.get_running_loop().call_later(self.retention, self._by_id.pop, generation.id, None)
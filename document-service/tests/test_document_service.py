@@ -126,6 +126,41 @@ def test_delete_document(mock_extract_text, mock_vector_service, sample_pdf_cont
     get_response = client.get(f"/document/{doc_id}")
     assert get_response.status_code == 404
 
+@patch('app.main.send_to_vector_service')
+@patch('app.main.extract_text_from_pdf')
+def test_get_documents_metadata(mock_extract_text, mock_vector_service, sample_pdf_content):
+    mock_extract_text.return_value = ("Metadata test content", 3)
+    mock_vector_service.return_value = AsyncMock(return_value={"upserted": 1})
+    
+    files = {"file": ("metadata_test.pdf", io.BytesIO(sample_pdf_content), "application/pdf")}
+    doc_id = client.post("/ingest", files=files).json()["id"]
+    
+    response = client.post("/documents/metadata", json={"ids": [doc_id, 999]})
+    
+    assert response.status_code == 200
+    data = response.json()
+    assert len(data) == 1
+    assert data[0]["id"] == doc_id
+    assert data[0]["filename"] == "metadata_test.pdf"
+    assert data[0]["pages_count"] == 3
+    assert "content" not in data[0]
+
+@patch('app.main.notify_documents_changed')
+@patch('app.main.send_to_vector_service')
+@patch('app.main.extract_text_from_pdf')
+def test_delete_document_invalidates_backend_cache(mock_extract_text, mock_vector_service, mock_notify, sample_pdf_content):
+    mock_extract_text.return_value = ("Invalidation test content", 1)
+    mock_vector_service.return_value = AsyncMock(return_value={"upserted": 1})
+    
+    files = {"file": ("invalidate_test.pdf", io.BytesIO(sample_pdf_content), "application/pdf")}
+    doc_id = client.post("/ingest", files=files).json()["id"]
+    mock_notify.reset_mock()
+    
+    response = client.delete(f"/document/{doc_id}")
+    
+    assert response.status_code == 200
+    mock_notify.assert_called_once_with([doc_id])
+
 def test_delete_nonexistent_document():
     response = client.delete("/document/999")
     assert response.status_code == 404
@@ -38,6 +38,8 @@ interface SSEProgress {
   done?: boolean
   error?: boolean
   data?: any
+  delta?: string
+  tokens?: number
 }
 
 interface ProgressDetail {
@@ -47,6 +49,10 @@ interface ProgressDetail {
   color: string
 }
 
+// Reprise du flux SSE après une coupure réseau (en-tête Last-Event-ID)
+const MAX_STREAM_RECONNECTS = 5
+const STREAM_RECONNECT_DELAY_MS = 1000
+
 export default function AnalysisPanel({ analysisTypes, initialAnalysisType }: AnalysisPanelProps) {
   const { t, language } = useTranslation()
   const { user } = useSupabaseAuth()
@@ -147,110 +153,160 @@ export default function AnalysisPanel({ analysisTypes, initialAnalysisType }: An
 
       setLogs(prev => [...prev, 'Connexion au backend...'])
 
-      // Appel SSE pour streaming
-      const response = await fetch(`${BACKEND_URL}/extended-analysis/stream`, {
-        method: 'POST',
-        headers: {
-          'Content-Type': 'application/json',
-        },
-        body: JSON.stringify({
-          analysis_type: selectedAnalysisType.id,
-          query: query,
-          title: `${selectedAnalysisType.name} - ${query.substring(0, 50)}...`,
-          include_recommendations: includeRecommendations,
-          language: language,
-          user_id: user?.id
-        }),
-        signal: abortControllerRef.current.signal
+      // Appel SSE pour streaming. En cas de coupure réseau, la même requête est
+      // renvoyée avec Last-Event-ID: le backend reprend après le dernier événement
+      // reçu, sans relancer la génération.
+      const requestBody = JSON.stringify({
+        analysis_type: selectedAnalysisType.id,
+        query: query,
+        title: `${selectedAnalysisType.name} - ${query.substring(0, 50)}...`,
+        include_recommendations: includeRecommendations,
+        language: language,
+        user_id: user?.id
       })
+      // Le contenu du rapport arrive par morceaux (champ delta des événements 'generate')
+      let streamedContent = ''
+      let lastEventId: string | null = null
+      let finished = false
+      let reconnects = 0
+
+      while (!finished) {
+        const headers: Record<string, string> = { 'Content-Type': 'application/json' }
+        if (lastEventId) {
+          headers['Last-Event-ID'] = lastEventId
+        }
 
-      if (!response.ok) {
-        throw new Error(`Erreur HTTP: ${response.status}`)
-      }
+        try {
+          const response = await fetch(`${BACKEND_URL}/extended-analysis/stream`, {
+            method: 'POST',
+            headers,
+            body: requestBody,
+            signal: abortControllerRef.current.signal
+          })
 
-      setLogs(prev => [...prev, 'Connexion établie, streaming démarré'])
+          if (!response.ok) {
+            throw new Error(`Erreur HTTP: ${response.status}`)
+          }
 
-      const reader = response.body?.getReader()
-      const decoder = new TextDecoder()
-      let buffer = ''
+          setLogs(prev => [...prev, reconnects ? 'Connexion rétablie, reprise du flux' : 'Connexion établie, streaming démarré'])
 
-      if (!reader) {
-        throw new Error('Streaming non supporté')
-      }
+          const reader = response.body?.getReader()
+          const decoder = new TextDecoder()
+          let buffer = ''
 
-      while (true) {
-        const { done, value } = await reader.read()
+          if (!reader) {
+            throw new Error('Streaming non supporté')
+          }
 
-        if (done) break
+          while (true) {
+            const { done, value } = await reader.read()
 
-        buffer += decoder.decode(value, { stream: true })
+            if (done) break
 
-        // Traiter les événements SSE
-        const lines = buffer.split('\n\n')
-        buffer = lines.pop() || '' // Garder le dernier fragment incomplet
+            buffer += decoder.decode(value, { stream: true })
 
-        for (const line of lines) {
-          if (line.startsWith('data: ')) {
-            try {
-              const data: SSEProgress = JSON.parse(line.substring(6))
+            // Traiter les événements SSE (lignes "id:" puis "data:")
+            const events = buffer.split('\n\n')
+            buffer = events.pop() || '' // Garder le dernier fragment incomplet
 
-              // Mettre à jour la progression
-              setProgress(data.progress)
-              setProgressMessage(data.message)
-              setProgressStep(data.step)
+            for (const event of events) {
+              let eventId: string | null = null
+              let payload: string | null = null
+              for (const field of event.split('\n')) {
+                if (field.startsWith('id: ')) eventId = field.substring(4)
+                else if (field.startsWith('data: ')) payload = field.substring(6)
+              }
+              if (eventId) {
+                // Nouvelle génération (reprise impossible côté serveur): repartir de zéro
+                if (lastEventId && eventId.split(':')[0] !== lastEventId.split(':')[0]) {
+                  streamedContent = ''
+                }
+                lastEventId = eventId
+              }
+              if (!payload) continue
 
-              // Ajouter au log
-              setLogs(prev => [...prev.slice(-9), `${data.progress}% - ${data.message}`])
+              try {
+                const data: SSEProgress = JSON.parse(payload)
 
-              // Extraire le nombre de sources si présent
-              const sourcesMatch = data.message.match(/(\d+)\s+sources?/i)
-              if (sourcesMatch) {
-                setSourcesCount(parseInt(sourcesMatch[1]))
-              }
+                // Mettre à jour la progression
+                setProgress(data.progress)
+                setProgressMessage(data.message)
+                setProgressStep(data.step)
+
+                // Accumuler le contenu streamé (pas de log par delta)
+                if (data.delta) {
+                  streamedContent += data.delta
+                } else {
+                  setLogs(prev => [...prev.slice(-9), `${data.progress}% - ${data.message}`])
+                }
 
-              // Si terminé avec succès
-              if (data.done && data.data) {
-                const finalResult: AnalysisResult = {
-                  id: resultId,
-                  title: data.data.title,
-                  content: data.data.content,
-                  timestamp: new Date(),
-                  type: selectedAnalysisType.id,
-                  sources: data.data.sources || []
+                // Extraire le nombre de sources si présent
+                const sourcesMatch = data.message.match(/(\d+)\s+sources?/i)
+                if (sourcesMatch) {
+                  setSourcesCount(parseInt(sourcesMatch[1]))
                 }
 
-                setResults(prev => [finalResult, ...prev])
-                setLogs(prev => [...prev, 'Rapport généré avec succès !'])
-                toast.success(t('analysis.reportSuccess'))
-
-                // Auto-save report to database (without triggering PDF download)
-                try {
-                  await fetch(`${REPORT_URL}/generate`, {
-                    method: 'POST',
-                    headers: { 'Content-Type': 'application/json' },
-                    body: JSON.stringify({
-                      user_id: user?.id,
-                      analysis_type: selectedAnalysisType.id,
-                      title: data.data.title,
-                      content: data.data.content,
-                      sources: data.data.sources || [],
-                      metadata: { generated_at: new Date().toISOString() }
+                // Si terminé avec succès
+                if (data.done && data.data) {
+                  finished = true
+                  const reportContent = data.data.content ?? streamedContent
+                  const finalResult: AnalysisResult = {
+                    id: resultId,
+                    title: data.data.title,
+                    content: reportContent,
+                    timestamp: new Date(),
+                    type: selectedAnalysisType.id,
+                    sources: data.data.sources || []
+                  }
+
+                  setResults(prev => [finalResult, ...prev])
+                  setLogs(prev => [...prev, 'Rapport généré avec succès !'])
+                  toast.success(t('analysis.reportSuccess'))
+
+                  // Auto-save report to database (without triggering PDF download)
+                  try {
+                    await fetch(`${REPORT_URL}/generate`, {
+                      method: 'POST',
+                      headers: { 'Content-Type': 'application/json' },
+                      body: JSON.stringify({
+                        user_id: user?.id,
+                        analysis_type: selectedAnalysisType.id,
+                        title: data.data.title,
+                        content: reportContent,
+                        sources: data.data.sources || [],
+                        metadata: { generated_at: new Date().toISOString() }
+                      })
                     })
-                  })
-                  console.log('Report auto-saved to database')
-                } catch (saveError) {
-                  console.error('Auto-save failed:', saveError)
+                    console.log('Report auto-saved to database')
+                  } catch (saveError) {
+                    console.error('Auto-save failed:', saveError)
+                  }
                 }
-              }
 
-              // Si erreur
-              if (data.error) {
-                throw new Error(data.message)
+                // Si erreur
+                if (data.error) {
+                  finished = true
+                  throw new Error(data.message)
+                }
+              } catch (parseError) {
+                // Ignorer les erreurs de parsing JSON partiel
               }
-            } catch (parseError) {
-              // Ignorer les erreurs de parsing JSON partiel
             }
           }
+
+          if (!finished) {
+            // Flux fermé avant l'événement final (proxy, réseau): reprise
+            throw new TypeError('Flux interrompu')
+          }
+        } catch (streamError: any) {
+          // Seules les coupures réseau (TypeError) sont reprises, pas les erreurs HTTP ni l'annulation
+          const canResume = streamError instanceof TypeError && lastEventId !== null && reconnects < MAX_STREAM_RECONNECTS
+          if (!canResume) {
+            throw streamError
+          }
+          reconnects += 1
+          setLogs(prev => [...prev, `Connexion perdue, reprise (${reconnects}/${MAX_STREAM_RECONNECTS})...`])
+          await new Promise(resolve => setTimeout(resolve, STREAM_RECONNECT_DELAY_MS * reconnects))
         }
       }
 
@@ -0,0 +1,194 @@
+"""
+Context chunking and query-relevant retrieval
+
+Contexts are split into paragraph-aligned, slightly overlapping chunks when
+they are created or their content changes. Retrieval ranks the chunks of the
+user's active contexts against the query with Postgres full-text search and
+packs the best ones into a character budget, so callers receive a few KB
+instead of every active context in full.
+"""
+import os
+import re
+from typing import Any, Dict, Iterator, List, Optional
+
+from sqlalchemy import func, insert
+from sqlalchemy.orm import Session
+from loguru import logger
+
+from app.models import UserContext, UserContextChunk
+
+CONTEXT_CHUNK_CHARS = int(os.environ.get("CONTEXT_CHUNK_CHARS", "1200"))
+CONTEXT_CHUNK_OVERLAP = int(os.environ.get("CONTEXT_CHUNK_OVERLAP", "150"))
+SEARCH_CONFIG = "simple"  # FR and EN contexts: no stemming, stopwords filtered below
+MAX_QUERY_TERMS = 32
+
+_TERM_RE = re.compile(r"[^\W_]{2,}")
+_PARAGRAPH_RE = re.compile(r"\n\s*\n")
+
+STOPWORDS = frozenset("""
+    au aux avec ce ces cet cette dans de des du elle en est et il ils je la le les leur leurs lui ma mais
+    me mes moi mon ne nos notre nous on ou par pas pour qu que qui sa se ses son sont sur ta te tes toi
+    ton tu un une vos votre vous quel quelle quels quelles comment quoi
+    a an and are as at be but by can do does for from has have how in is it its of on or our that the
+    their this to was we what when where which who why will with you your
+""".split())
+
+
+def _pieces(text: str, max_chars: int) -> Iterator[str]:
+    """Paragraphs, long ones split at the last space before max_chars"""
+    for paragraph in _PARAGRAPH_RE.split(text):
+        paragraph = paragraph.strip()
+        while len(paragraph) > max_chars:
+            cut = paragraph.rfind(" ", 0, max_chars)
+            if cut < max_chars // 2:
+                cut = max_chars
+            yield paragraph[:cut].rstrip()
+            paragraph = paragraph[cut:].lstrip()
+        if paragraph:
+            yield paragraph
+
+
+def chunk_text(
+    text: str,
+    max_chars: int = CONTEXT_CHUNK_CHARS,
+    overlap: int = CONTEXT_CHUNK_OVERLAP
+) -> List[str]:
+    """
+    Split text into chunks of at most max_chars, packing whole paragraphs.
+    Each chunk starts with the last words (up to overlap chars) of the previous
+    one so a sentence cut at a boundary stays searchable.
+    """
+    chunks: List[str] = []
+    current = ""
+    for piece in _pieces(text or "", max_chars):
+        if current and len(current) + 2 + len(piece) > max_chars:
+            chunks.append(current)
+            tail = current[-overlap:].split(" ", 1)[-1] if overlap > 0 else ""
+            current = f"{tail}\n\n{piece}" if tail and len(tail) + 2 + len(piece) <= max_chars else piece
+        else:
+            current = f"{current}\n\n{piece}" if current else piece
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def query_terms(query: str) -> List[str]:
+    """Distinct significant words of the query, in order"""
+    terms = []
+    for term in _TERM_RE.findall((query or "").lower()):
+        if term not in STOPWORDS and term not in terms:
+            terms.append(term)
+    return terms[:MAX_QUERY_TERMS]
+
+
+def index_context(db: Session, context: UserContext) -> int:
+    """
+    (Re)build the chunks of a context in the current transaction.
+    The context must have an id (flush first). Returns the number of chunks.
+    """
+    db.query(UserContextChunk).filter(
+        UserContextChunk.context_id == context.id
+    ).delete(synchronize_session=False)
+    chunks = chunk_text(context.content)
+    if chunks:
+        db.execute(insert(UserContextChunk), [
+            {"context_id": context.id, "user_id": context.user_id, "position": position, "content": chunk}
+            for position, chunk in enumerate(chunks)
+        ])
+    return len(chunks)
+
+
+def index_missing_chunks(db: Session, user_id: int) -> int:
+    """Chunk the user's active contexts created before chunking existed"""
+    missing = db.query(UserContext).filter(
+        UserContext.user_id == user_id,
+        UserContext.is_active == True,
+        UserContext.content_size > 0,
+        ~db.query(UserContextChunk.id).filter(UserContextChunk.context_id == UserContext.id).exists()
+    ).all()
+    for context in missing:
+        index_context(db, context)
+    if missing:
+        db.commit()
+        logger.info(f"Indexed {len(missing)} legacy contexts for user {user_id}")
+    return len(missing)
+
+
+def retrieve_context_chunks(
+    db: Session,
+    user_id: int,
+    query: str,
+    max_chars: int,
+    max_chunks: int
+) -> List[Dict[str, Any]]:
+    """
+    Most useful chunks of the user's active contexts within max_chars:
+    1. short contexts (a single chunk, e.g. the company profile), always;
+    2. chunks of larger contexts ranked by full-text relevance to the query;
+    3. without any match, the opening chunk of each larger context.
+
+    Returned in reading order (context order, then position).
+    """
+    contexts = db.query(
+        UserContext.id, UserContext.name, UserContext.context_type, UserContext.content_size
+    ).filter(
+        UserContext.user_id == user_id,
+        UserContext.is_active == True
+    ).order_by(UserContext.created_at.desc()).all()
+    if not contexts:
+        return []
+
+    index_missing_chunks(db, user_id)
+    context_ids = [c.id for c in contexts]
+    short_ids = [c.id for c in contexts if c.content_size <= CONTEXT_CHUNK_CHARS]
+    long_ids = [c.id for c in contexts if c.content_size > CONTEXT_CHUNK_CHARS]
+    chunk_columns = (UserContextChunk.context_id, UserContextChunk.position, UserContextChunk.content)
+
+    selected: List[Dict[str, Any]] = []
+    used = 0
+
+    def take(rows, score: Optional[float] = None) -> None:
+        nonlocal used
+        for row in rows:
+            if len(selected) >= max_chunks:
+                return
+            if used + len(row.content) > max_chars:
+                continue  # A shorter chunk further down may still fit
+            selected.append({
+                "context_id": row.context_id,
+                "position": row.position,
+                "content": row.content,
+                "score": round(float(getattr(row, "score", score) or 0.0), 4),
+            })
+            used += len(row.content)
+
+    if short_ids:
+        take(db.query(*chunk_columns).filter(UserContextChunk.context_id.in_(short_ids)).order_by(
+            UserContextChunk.context_id, UserContextChunk.position
+        ).all(), score=1.0)
+
+    terms = query_terms(query)
+    matched = False
+    if long_ids and terms:
+        ts_query = func.to_tsquery(SEARCH_CONFIG, " | ".join(f"{term}:*" for term in terms))
+        rank = func.ts_rank_cd(UserContextChunk.search_vector, ts_query).label("score")
+        rows = db.query(*chunk_columns, rank).filter(
+            UserContextChunk.user_id == user_id,
+            UserContextChunk.context_id.in_(long_ids),
+            UserContextChunk.search_vector.op("@@")(ts_query)
+        ).order_by(rank.desc(), UserContextChunk.id).limit(max_chunks * 4).all()
+        matched = bool(rows)
+        take(rows)
+    if long_ids and not matched:
+        take(db.query(*chunk_columns).filter(
+            UserContextChunk.context_id.in_(long_ids),
+            UserContextChunk.position == 0
+        ).all(), score=0.0)
+
+    order = {context_id: index for index, context_id in enumerate(context_ids)}
+    meta = {c.id: c for c in contexts}
+    selected.sort(key=lambda chunk: (order[chunk["context_id"]], chunk["position"]))
+    for chunk in selected:
+        chunk["name"] = meta[chunk["context_id"]].name
+        chunk["type"] = meta[chunk["context_id"]].context_type
+    return selected
@@ -3,9 +3,10 @@ Memory Service - FastAPI Application
 Handles conversation history and document storage for Insight MVP
 """
 import os
+import tempfile
 from datetime import datetime
 from typing import Optional, List
-from fastapi import FastAPI, HTTPException, Depends, Query, UploadFile, File
+from fastapi import FastAPI, HTTPException, Depends, Query, UploadFile, File, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from jose import jwt, JWTError
@@ -24,10 +25,12 @@ from app.schemas import (
     HealthResponse, ErrorResponse,
     # Context schemas
     ContextCreate, ContextUpdate, ContextResponse, ContextDetailResponse,
-    ContextListResponse, StorageQuotaResponse, InternalContextCreate
+    ContextListResponse, StorageQuotaResponse, InternalContextCreate,
+    ContextRetrieveRequest, ContextRetrieveResponse
 )
 from app.migration import migrate_user_data, check_migration_status
-from app.text_extractor import extract_text_from_file
+from app.text_extractor import extract_text_in_pool, shutdown_extraction_pool
+from app.context_chunks import index_context, retrieve_context_chunks
 
 # Configuration
 # Prioritize Supabase JWT secret for token validation
@@ -858,6 +861,8 @@ async def create_context(
         is_active=context.is_active
     )
     db.add(new_context)
+    db.flush()
+    index_context(db, new_context)
 
     # Update quota
     quota.total_used_bytes += content_size
@@ -937,6 +942,7 @@ async def update_context(
         context.preview = update.content[:200]
         context.content_size = new_size
         quota.total_used_bytes += size_diff
+        index_context(db, context)
 
     if update.name is not None:
         context.name = update.name
@@ -977,8 +983,36 @@ async def delete_context(
     logger.info(f"Context deleted for user {user_id}: {context.name}")
 
 
+MAX_UPLOAD_BYTES = 10 * 1024 * 1024  # 10MB
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+
+
+async def spool_upload(file: UploadFile, suffix: str, max_bytes: int = MAX_UPLOAD_BYTES) -> str:
+    """
+    Copy an upload to a temporary file chunk by chunk, rejecting it as soon as
+    it exceeds max_bytes. Returns the path (the caller removes it).
+    """
+    fd, path = tempfile.mkstemp(prefix="context_upload_", suffix=suffix)
+    size = 0
+    try:
+        with os.fdopen(fd, "wb") as spooled:
+            while chunk := await file.read(UPLOAD_CHUNK_BYTES):
+                size += len(chunk)
+                if size > max_bytes:
+                    raise HTTPException(
+                        status_code=400,
+                        detail="Fichier trop volumineux (max 10 Mo)"
+                    )
+                spooled.write(chunk)
+    except BaseException:
+        os.unlink(path)
+        raise
+    return path
+
+
 @app.post("/api/v1/contexts/upload", response_model=ContextResponse, status_code=201)
 async def upload_context_document(
+    request: Request,
     file: UploadFile = File(...),
     name: Optional[str] = Query(None, description="Custom name for the context"),
     user_id: int = Depends(get_current_user_id),
@@ -999,18 +1033,21 @@ async def upload_context_document(
             detail=f"Type de fichier non supporté: {file_ext}. Types acceptés: {', '.join(allowed_types)}"
         )
 
-    # Read file content
-    file_content = await file.read()
-
-    # Check file size (max 10MB)
-    if len(file_content) > 10 * 1024 * 1024:
+    # Declared body size (multipart overhead aside): refuse before copying anything
+    declared_size = request.headers.get("content-length")
+    if declared_size and declared_size.isdigit() and int(declared_size) > MAX_UPLOAD_BYTES + UPLOAD_CHUNK_BYTES:
         raise HTTPException(
             status_code=400,
             detail="Fichier trop volumineux (max 10 Mo)"
         )
 
-    # Extract text from file
-    extracted_text = extract_text_from_file(file_content, file_ext)
+    # Spool to disk with the size limit enforced while copying, then extract
+    # text in the process pool (keeps the event loop free for other requests)
+    file_path = await spool_upload(file, suffix=f".{file_ext}")
+    try:
+        extracted_text = await extract_text_in_pool(file_path, file_ext)
+    finally:
+        os.unlink(file_path)
 
     if not extracted_text:
         raise HTTPException(
@@ -1043,6 +1080,8 @@ async def upload_context_document(
         is_active=True
     )
     db.add(new_context)
+    db.flush()
+    index_context(db, new_context)
 
     # Update quota
     quota.total_used_bytes += content_size
@@ -1091,6 +1130,31 @@ async def get_active_contexts_internal(
     }
 
 
+@app.post("/internal/contexts/retrieve", response_model=ContextRetrieveResponse)
+async def retrieve_contexts_internal(
+    request: ContextRetrieveRequest,
+    db: Session = Depends(get_db)
+):
+    """
+    Internal endpoint: chunks of the active contexts most relevant to a query,
+    within a character budget. Used by backend-service for prompt building
+    instead of downloading every context in full.
+    """
+    try:
+        resolved_id = int(request.user_id)
+    except ValueError:
+        resolved_id = resolve_supabase_user_id(str(request.user_id), db)
+
+    chunks = retrieve_context_chunks(
+        db, resolved_id, request.query,
+        max_chars=request.max_chars, max_chunks=request.max_chunks
+    )
+    return ContextRetrieveResponse(
+        chunks=chunks,
+        total_chars=sum(len(chunk["content"]) for chunk in chunks)
+    )
+
+
 @app.post("/internal/contexts", response_model=ContextResponse, status_code=201)
 async def create_context_internal(
     context: InternalContextCreate,
@@ -1127,6 +1191,8 @@ async def create_context_internal(
         is_active=context.is_active
     )
     db.add(new_context)
+    db.flush()
+    index_context(db, new_context)
     quota.total_used_bytes += content_size
     db.commit()
     db.refresh(new_context)
@@ -1183,6 +1249,12 @@ async def startup_event():
     logger.info(f"Database URL: {os.environ.get('DATABASE_URL', 'Not set')}")
 
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop the text extraction workers"""
+    shutdown_extraction_pool()
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8008)
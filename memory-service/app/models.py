@@ -1,8 +1,8 @@
 """
 SQLAlchemy models for Memory Service
 """
-from sqlalchemy import Column, Integer, BigInteger, String, Text, DateTime, Boolean, ForeignKey, Index
-from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy import Column, Integer, BigInteger, String, Text, DateTime, Boolean, ForeignKey, Index, Computed
+from sqlalchemy.dialects.postgresql import JSONB, TSVECTOR
 from datetime import datetime
 from app.database import Base
 
@@ -138,6 +138,30 @@ class UserContext(Base):
     )
 
 
+class UserContextChunk(Base):
+    """
+    Searchable slice of a context, rebuilt whenever the context content changes.
+    Postgres generates the full-text vector from content (GIN index), so
+    retrieval reads only the chunks matching a query.
+    """
+    __tablename__ = "user_context_chunks"
+
+    id = Column(Integer, primary_key=True)
+    context_id = Column(Integer, ForeignKey("user_contexts.id", ondelete="CASCADE"), nullable=False)
+    user_id = Column(Integer, nullable=False)
+
+    # Order of the chunk within its context
+    position = Column(Integer, nullable=False)
+    content = Column(Text, nullable=False)
+    search_vector = Column(TSVECTOR, Computed("to_tsvector('simple', content)", persisted=True))
+
+    __table_args__ = (
+        Index('idx_context_chunks_context', 'context_id', 'position'),
+        Index('idx_context_chunks_user', 'user_id'),
+        Index('idx_context_chunks_search', 'search_vector', postgresql_using='gin'),
+    )
+
+
 class UserStorageQuota(Base):
     """
     Tracks storage usage per user for quota enforcement (2GB default limit)
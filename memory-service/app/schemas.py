@@ -165,6 +165,30 @@ class InternalContextCreate(ContextCreate):
     user_id: Union[int, str]
 
 
+class ContextRetrieveRequest(BaseModel):
+    """Schema for retrieving the context chunks relevant to a query"""
+    user_id: Union[int, str]
+    query: str = ""
+    max_chars: int = Field(default=4000, ge=200, le=100000)
+    max_chunks: int = Field(default=12, ge=1, le=100)
+
+
+class ContextChunk(BaseModel):
+    """A retrieved slice of a context"""
+    context_id: int
+    name: str
+    type: str
+    position: int
+    content: str
+    score: float
+
+
+class ContextRetrieveResponse(BaseModel):
+    """Relevant chunks of the user's active contexts, in reading order"""
+    chunks: list[ContextChunk]
+    total_chars: int
+
+
 # ============================================================================
 # Migration Schemas
 # ============================================================================
@@ -1,32 +1,49 @@
 """
 Text Extractor - Extract text from PDF, DOCX, TXT files
 Centralized in memory-service for unified context management.
+
+Uploads are extracted from a file on disk in a process pool
+(extract_text_in_pool): parsing a large PDF or DOCX never blocks the event
+loop, and page text is collected then joined once instead of re-concatenated.
 """
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional, Union
 
 from loguru import logger
 
+EXTRACTION_WORKERS = int(os.environ.get("EXTRACTION_WORKERS", "2"))
+EXTRACTION_TIMEOUT = float(os.environ.get("EXTRACTION_TIMEOUT", "120"))
+# Worker processes are replaced after this many files (parser memory is not always released)
+EXTRACTION_TASKS_PER_WORKER = int(os.environ.get("EXTRACTION_TASKS_PER_WORKER", "50"))
+
+_pool: Optional[ProcessPoolExecutor] = None
+
 
-def extract_text_from_pdf(file_content: bytes) -> str:
-    """Extract text from PDF file content"""
+def extract_text_from_pdf(source: Union[bytes, str]) -> str:
+    """Extract text from PDF file content or path"""
     try:
         import fitz  # PyMuPDF
-        doc = fitz.open(stream=file_content, filetype="pdf")
-        text = ""
-        for page in doc:
-            text += page.get_text()
-        doc.close()
-        return text.strip()
+        doc = fitz.open(stream=source, filetype="pdf") if isinstance(source, bytes) else fitz.open(source)
+        try:
+            pages = [page.get_text() for page in doc]
+        finally:
+            doc.close()
+        return "".join(pages).strip()
     except Exception as e:
         logger.error(f"Error extracting PDF text: {e}")
         return ""
 
 
-def extract_text_from_docx(file_content: bytes) -> str:
-    """Extract text from DOCX file content"""
+def extract_text_from_docx(source: Union[bytes, str]) -> str:
+    """Extract text from DOCX file content or path"""
     try:
         from docx import Document
         import io
-        doc = Document(io.BytesIO(file_content))
+        doc = Document(io.BytesIO(source) if isinstance(source, bytes) else source)
         text = "\n".join([para.text for para in doc.paragraphs])
         return text.strip()
     except Exception as e:
@@ -34,25 +51,28 @@ def extract_text_from_docx(file_content: bytes) -> str:
         return ""
 
 
-def extract_text_from_txt(file_content: bytes) -> str:
-    """Extract text from TXT file content"""
+def extract_text_from_txt(source: Union[bytes, str]) -> str:
+    """Extract text from TXT file content or path"""
     try:
+        if not isinstance(source, bytes):
+            with open(source, "rb") as f:
+                source = f.read()
         # Try UTF-8 first, then fallback to latin-1
         try:
-            return file_content.decode('utf-8').strip()
+            return source.decode('utf-8').strip()
         except UnicodeDecodeError:
-            return file_content.decode('latin-1').strip()
+            return source.decode('latin-1').strip()
     except Exception as e:
         logger.error(f"Error extracting TXT text: {e}")
         return ""
 
 
-def extract_text_from_file(file_content: bytes, file_type: str) -> str:
+def extract_text_from_file(source: Union[bytes, str], file_type: str) -> str:
     """
     Extract text from file based on type.
 
     Args:
-        file_content: Raw file bytes
+        source: Raw file bytes or path to the file
         file_type: File extension (pdf, docx, txt)
 
     Returns:
@@ -61,11 +81,64 @@ def extract_text_from_file(file_content: bytes, file_type: str) -> str:
     file_type = file_type.lower().strip('.')
 
     if file_type == "pdf":
-        return extract_text_from_pdf(file_content)
+        return extract_text_from_pdf(source)
     elif file_type == "docx":
-        return extract_text_from_docx(file_content)
+        return extract_text_from_docx(source)
     elif file_type == "txt":
-        return extract_text_from_txt(file_content)
+        return extract_text_from_txt(source)
     else:
         logger.warning(f"Unsupported file type: {file_type}")
         return ""
+
+
+def get_extraction_pool() -> ProcessPoolExecutor:
+    """Shared extraction pool (spawned workers: safe to start from the running service)"""
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(
+            max_workers=EXTRACTION_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+            max_tasks_per_child=EXTRACTION_TASKS_PER_WORKER
+        )
+    return _pool
+
+
+def shutdown_extraction_pool(kill: bool = False) -> None:
+    """
+    Stop the extraction workers (service shutdown). With kill=True the worker
+    processes are terminated too: a stuck parse must not hold a pool slot.
+    """
+    global _pool
+    pool, _pool = _pool, None
+    if pool is None:
+        return
+    processes = list((pool._processes or {}).values())
+    pool.shutdown(wait=False, cancel_futures=True)
+    if kill:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+
+
+async def extract_text_in_pool(file_path: str, file_type: str) -> str:
+    """
+    Extract text from a file on disk in the process pool.
+    Returns an empty string on error or after EXTRACTION_TIMEOUT seconds.
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        return await asyncio.wait_for(
+            loop.run_in_executor(get_extraction_pool(), extract_text_from_file, file_path, file_type),
+            timeout=EXTRACTION_TIMEOUT
+        )
+    except asyncio.TimeoutError:
+        # The parse keeps running in its worker: kill the pool, the next upload gets a fresh one
+        logger.error(f"Text extraction timed out after {EXTRACTION_TIMEOUT}s ({file_type})")
+        shutdown_extraction_pool(kill=True)
+    except BrokenProcessPool:
+        # A worker died (e.g. parser crash): start a fresh pool for the next upload
+        logger.error(f"Text extraction worker crashed ({file_type})")
+        shutdown_extraction_pool(kill=True)
+    except Exception as e:
+        logger.error(f"Text extraction failed ({file_type}): {e}")
+    return ""
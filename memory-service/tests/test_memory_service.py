@@ -0,0 +1,68 @@
+import asyncio
+import os
+from unittest.mock import patch
+
+from app import text_extractor
+from app.context_chunks import MAX_QUERY_TERMS, chunk_text, query_terms
+from app.text_extractor import extract_text_in_pool, shutdown_extraction_pool
+
+
+def test_extraction_timeout_frees_the_pool(tmp_path):
+    # Reading a FIFO without a writer blocks for ever: a parse that never ends
+    stuck = tmp_path / "stuck.txt"
+    os.mkfifo(stuck)
+    ok = tmp_path / "ok.txt"
+    ok.write_text("Contenu du document")
+
+    async def run():
+        stuck_upload = asyncio.create_task(extract_text_in_pool(str(stuck), "txt"))
+        await asyncio.sleep(0.5)
+        workers = list(text_extractor.get_extraction_pool()._processes.values())
+        assert await stuck_upload == ""
+        return workers, await extract_text_in_pool(str(ok), "txt")
+
+    with patch.object(text_extractor, "EXTRACTION_WORKERS", 1), \
+         patch.object(text_extractor, "EXTRACTION_TIMEOUT", 5):
+        shutdown_extraction_pool(kill=True)
+        try:
+            workers, text = asyncio.run(run())
+        finally:
+            shutdown_extraction_pool(kill=True)
+
+    # The next upload gets a fresh worker instead of queueing behind the stuck one
+    assert text == "Contenu du document"
+    assert workers and not any(process.is_alive() for process in workers)
+
+
+def test_chunk_text_packs_paragraphs_with_overlap():
+    text = "Acme fabrique des turbines.\n\nLe marché principal est l'Europe.\n\nLa croissance vient de l'export."
+    chunks = chunk_text(text, max_chars=70, overlap=20)
+
+    assert chunks == [
+        "Acme fabrique des turbines.\n\nLe marché principal est l'Europe.",
+        "est l'Europe.\n\nLa croissance vient de l'export.",
+    ]
+    assert chunk_text(text, max_chars=1000) == [text]
+    assert chunk_text("") == [] and chunk_text(None) == []
+
+
+def test_chunk_text_splits_oversized_paragraphs_at_spaces():
+    words = [f"mot{i}" for i in range(200)]
+    chunks = chunk_text(" ".join(words), max_chars=100, overlap=0)
+
+    assert len(chunks) > 1
+    assert all(len(chunk) <= 100 for chunk in chunks)
+    # Cut between words: nothing lost, nothing split
+    assert " ".join(chunks).split() == words
+
+    # A word longer than a chunk is cut hard
+    assert chunk_text("x" * 250, max_chars=100, overlap=0) == ["x" * 100, "x" * 100, "x" * 50]
+
+
+def test_query_terms_keeps_significant_words_once():
+    query = "Quelle est la stratégie de la BNP sur les taux, les TAUX et l'inflation en 2026 ?"
+
+    assert query_terms(query) == ["stratégie", "bnp", "taux", "inflation", "2026"]
+    assert query_terms("What is the growth of the market?") == ["growth", "market"]
+    assert query_terms("") == [] and query_terms(None) == []
+    assert len(query_terms(" ".join(f"terme{i}" for i in range(100)))) == MAX_QUERY_TERMS
@@ -0,0 +1,192 @@
+"""
+Module de détection automatique de la langue (français / anglais).
+
+Détecteur déterministe sans dépendance: un seul passage sur les mots du texte,
+chaque mot-outil français ou anglais votant pour sa langue (les mots accentués
+votent pour le français). Les requêtes courtes sans mot-outil ("Semiconductor
+supply chain risks") sont départagées par un vocabulaire métier propre à chaque
+langue et par l'orthographe des mots (terminaisons, lettres et digrammes
+typiques). Les longs documents sont échantillonnés (début, milieu, fin) et le
+résultat est mémorisé par empreinte de l'échantillon.
+
+Copie identique dans backend-service/app et report-service/app (images Docker
+séparées): toute modification doit être reportée dans les deux fichiers.
+"""
+
+import hashlib
+import os
+import re
+from collections import Counter, OrderedDict
+from threading import Lock
+
+from loguru import logger
+
+# Taille de chaque fenêtre d'échantillonnage (début, milieu, fin)
+LANG_SAMPLE_CHARS = int(os.getenv("LANG_SAMPLE_CHARS", "2000"))
+# Nombre de résultats mémorisés (LRU, clé = empreinte blake2b de l'échantillon)
+LANG_CACHE_SIZE = int(os.getenv("LANG_CACHE_SIZE", "2048"))
+# En dessous de cette longueur, pas de détection fiable: français par défaut
+MIN_DETECTION_CHARS = 10
+
+DEFAULT_LANGUAGE = 'fr'
+
+ENGLISH_WORDS = frozenset((
+    'the', 'and', 'of', 'to', 'in', 'is', 'are', 'was', 'were', 'for', 'with', 'that',
+    'this', 'these', 'those', 'from', 'by', 'at', 'it', 'its', 'be', 'been', 'has',
+    'have', 'will', 'would', 'which', 'what', 'how', 'why', 'who', 'an', 'not', 'into',
+    'their', 'our', 'should', 'can', 'about', 'between', 'does', 'do',
+    'analysis', 'market', 'markets', 'business', 'strategy', 'recommendations',
+    'executive', 'summary', 'key', 'findings', 'overview', 'trends', 'growth', 'sector',
+))
+
+FRENCH_WORDS = frozenset((
+    'le', 'la', 'les', 'de', 'du', 'des', 'et', 'en', 'un', 'une', 'est', 'sont',
+    'dans', 'pour', 'par', 'sur', 'avec', 'au', 'aux', 'ce', 'cette', 'ces', 'qui',
+    'que', 'qu', 'quel', 'quelle', 'quels', 'quelles', 'comment', 'pourquoi', 'il',
+    'elle', 'ils', 'nous', 'vous', 'leur', 'leurs', 'pas', 'ne', 'se', 'sa', 'ses',
+    'mais', 'ou', 'entre', 'l',
+    'analyse', 'marché', 'marchés', 'stratégie', 'secteur', 'croissance', 'tendances',
+    'évolution', 'synthèse', 'recommandations', 'entreprise', 'entreprises',
+))
+
+# Départage des textes sans mot-outil: vocabulaire métier dont la forme diffère
+# d'une langue à l'autre (les requêtes françaises tapées sans accents comprises)
+ENGLISH_TERMS = frozenset((
+    'private', 'public', 'equity', 'fundraising', 'funding', 'investment', 'investments',
+    'investor', 'investors', 'outlook', 'forecast', 'forecasts', 'supply', 'chain', 'chains',
+    'risk', 'risks', 'regulation', 'regulations', 'regulatory', 'policy', 'policies', 'bank',
+    'banks', 'banking', 'insurance', 'industry', 'industries', 'technology', 'technologies',
+    'tech', 'energy', 'healthcare', 'health', 'retail', 'price', 'prices', 'pricing', 'rate',
+    'rates', 'interest', 'competition', 'competitors', 'competitive', 'landscape', 'report',
+    'reports', 'company', 'companies', 'consumer', 'consumers', 'customer', 'customers',
+    'sales', 'revenue', 'revenues', 'share', 'shares', 'trade', 'tariffs', 'challenges',
+    'opportunities', 'emerging', 'global', 'new', 'latest', 'top', 'leading', 'semiconductor',
+    'semiconductors', 'artificial', 'electric', 'vehicle', 'vehicles', 'battery', 'real',
+    'estate', 'housing', 'labor', 'labour', 'workforce', 'jobs', 'mergers', 'deals', 'year',
+    'quarterly', 'annual', 'startups', 'adoption', 'outlooks', 'impact', 'impacts', 'venture',
+    'exit', 'exits',
+))
+
+FRENCH_TERMS = frozenset((
+    'banque', 'banques', 'bancaire', 'bancaires', 'assurance', 'assurances', 'marche',
+    'marches', 'strategie', 'taux', 'prix', 'societe', 'societes', 'industrie',
+    'energie', 'sante', 'vente', 'ventes', 'chiffre', 'affaires', 'financement', 'levee',
+    'fonds', 'rachat', 'fusion', 'fusions', 'politique', 'politiques', 'reglementation',
+    'concurrence', 'concurrents', 'paysage', 'prevision', 'previsions', 'perspectives',
+    'immobilier', 'logement', 'emploi', 'emplois', 'chaine', 'approvisionnement', 'risque',
+    'risques', 'nouveau', 'nouvelle', 'nouvelles', 'mondial', 'mondiale', 'europeen',
+    'europeenne', 'francais', 'francaise', 'annee', 'annuel', 'annuelle', 'trimestriel',
+    'voiture', 'voitures', 'vehicule', 'vehicules', 'electrique', 'electriques', 'donnees',
+    'rapport', 'etude', 'bilan', 'objectifs', 'numerique', 'clients', 'consommateurs',
+    'technologie', 'artificielle', 'defis', 'enjeux',
+))
+
+# Terminaisons et graphies typiques, pour les mots absents des deux vocabulaires
+_ENGLISH_SUFFIXES = ('ing', 'ings', 'ship', 'ness', 'ly', 'ity', 'ities', 'ful', 'less', 'ward', 'ough', 'or', 'ors')
+_FRENCH_SUFFIXES = ('eau', 'eaux', 'aux', 'eux', 'eur', 'eurs', 'euse', 'ique', 'iques', 'aire', 'aires',
+                    'oir', 'oire', 'elle', 'ette', 'ais', 'ait', 'aient', 'ement', 'que')
+_ENGLISH_GRAPHS = re.compile(r"[wk]|th|sh|wh|oo|ee|ck|gh|y$")
+
+# +1 anglais, -1 français: un seul dictionnaire consulté par mot
+_WORD_VOTES = {word: 1 for word in ENGLISH_WORDS}
+_WORD_VOTES.update({word: -1 for word in FRENCH_WORDS})
+_TERM_VOTES = {word: 1 for word in ENGLISH_TERMS}
+_TERM_VOTES.update({word: -1 for word in FRENCH_TERMS})
+
+_WORD_RE = re.compile(r"[^\W\d_]+")
+
+_cache: "OrderedDict[bytes, str]" = OrderedDict()
+_cache_lock = Lock()
+
+
+def _sample(text: str) -> str:
+    """Début, milieu et fin d'un long texte; le texte entier s'il est court"""
+    window = LANG_SAMPLE_CHARS
+    if len(text) <= 3 * window:
+        return text
+    middle = (len(text) - window) // 2
+    return " ".join((text[:window], text[middle:middle + window], text[-window:]))
+
+
+def _spelling_vote(word: str) -> int:
+    """+1 si l'orthographe du mot est typiquement anglaise, -1 française, 0 sinon"""
+    if len(word) < 3:
+        return 0
+    if word.endswith(_FRENCH_SUFFIXES):
+        return -1
+    if word.endswith(_ENGLISH_SUFFIXES) or _ENGLISH_GRAPHS.search(word):
+        return 1
+    return 0
+
+
+def _fallback_score(words: Counter) -> int:
+    """Départage sans mot-outil: vocabulaire métier, sinon orthographe du mot"""
+    score = 0
+    for word, count in words.items():
+        vote = _TERM_VOTES.get(word)
+        if vote is None:
+            vote = _spelling_vote(word)
+        score += vote * count
+    return score
+
+
+def _score(sample: str) -> int:
+    """Score > 0: anglais, score < 0: français"""
+    votes = _WORD_VOTES
+    score = 0
+    # Comptage en C, puis un seul passage sur les mots distincts
+    words = Counter(_WORD_RE.findall(sample.lower()))
+    for word, count in words.items():
+        vote = votes.get(word)
+        if vote is not None:
+            score += vote * count
+        elif not word.isascii():
+            score -= count
+    # Aucun vote décisif (requête courte de mots-clés): départage
+    return score or _fallback_score(words)
+
+
+def detect_language(text: str) -> str:
+    """
+    Détecte si un texte est en anglais ou en français.
+
+    Args:
+        text: Texte à analyser (requête utilisateur ou rapport complet)
+
+    Returns:
+        'en' pour anglais, 'fr' pour français (défaut si vide, trop court ou indécis)
+    """
+    if not text or len(text.strip()) < MIN_DETECTION_CHARS:
+        return DEFAULT_LANGUAGE
+
+    sample = _sample(text)
+    key = hashlib.blake2b(sample.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+    with _cache_lock:
+        language = _cache.get(key)
+        if language is not None:
+            _cache.move_to_end(key)
+            return language
+
+    language = 'en' if _score(sample) > 0 else DEFAULT_LANGUAGE
+
+    with _cache_lock:
+        _cache[key] = language
+        if len(_cache) > LANG_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return language
+
+
+def detect_query_language(query: str) -> str:
+    """
+    Détecte automatiquement la langue de la query utilisateur.
+
+    Args:
+        query: La requête texte de l'utilisateur
+
+    Returns:
+        'fr' pour français, 'en' pour anglais.
+        Retourne 'fr' par défaut si la langue n'est pas détectable ou autre.
+    """
+    language = detect_language(query)
+    logger.debug(f"Langue détectée: {language} pour query: '{(query or '')[:50]}...'")
+    return language
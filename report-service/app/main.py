@@ -29,6 +29,8 @@ import matplotlib.patches as mpatches
 import re
 import ast
 
+from app.language_detector import detect_language
+
 
 # Fonction de détection de langue basée sur le contenu
 def detect_content_language(content: str) -> str:
@@ -36,29 +38,7 @@ def detect_content_language(content: str) -> str:
     Détecte si le contenu est en anglais ou en français.
     Retourne 'en' pour anglais, 'fr' pour français.
     """
-    if not content:
-        return 'fr'
-    
-    # Mots-clés anglais typiques dans les rapports
-    english_indicators = [
-        'the ', 'and ', 'of ', 'to ', 'in ', 'is ', 'for ', 'with ', 'that ', 'are ',
-        'analysis', 'market', 'business', 'strategy', 'recommendations', 'executive summary',
-        'key findings', 'conclusion', 'overview', 'trends', 'growth', 'sector'
-    ]
-    
-    # Mots-clés français typiques
-    french_indicators = [
-        ' le ', ' la ', ' les ', ' de ', ' du ', ' des ', ' et ', ' en ', ' un ', ' une ',
-        'analyse', 'marché', 'stratégie', 'recommandations', 'synthèse', 'conclusion',
-        'secteur', 'croissance', 'tendances', 'évolution'
-    ]
-    
-    content_lower = content.lower()
-    
-    english_score = sum(1 for word in english_indicators if word in content_lower)
-    french_score = sum(1 for word in french_indicators if word in content_lower)
-    
-    return 'en' if english_score > french_score else 'fr'
+    return detect_language(content)
 
 
 # Traductions pour le PDF
@@ -269,3 +269,30 @@ def test_sources_table_generation():
     
     assert isinstance(pdf_bytes, bytes)
     assert len(pdf_bytes) > 1000
+
+def test_detect_content_language():
+    from app.main import detect_content_language
+    from app.language_detector import LANG_SAMPLE_CHARS
+
+    assert detect_content_language("") == "fr"
+    assert detect_content_language("Rapport") == "fr"
+    assert detect_content_language("Les banques et la croissance du crédit en France") == "fr"
+    assert detect_content_language("The banks and the growth of credit in France") == "en"
+
+    # Long rapport: seul l'échantillon (début, milieu, fin) est analysé
+    long_report = "The market analysis shows strong growth in the sector. " * (LANG_SAMPLE_CHARS // 10)
+    assert detect_content_language(long_report) == "en"
+    assert detect_content_language(long_report) == "en"
+
+
+def test_detect_language_keyword_queries():
+    from app.language_detector import detect_query_language
+
+    # Requêtes sans mot-outil: départagées par le vocabulaire et l'orthographe
+    assert detect_query_language("Private equity fundraising outlook") == "en"
+    assert detect_query_language("Semiconductor supply chain risks") == "en"
+    assert detect_query_language("Fintech regulation Europe 2025") == "en"
+    assert detect_query_language("Levee de fonds private equity France") == "fr"
+    assert detect_query_language("Perspectives croissance secteur bancaire") == "fr"
+    assert detect_query_language("Assurance vie rendement 2025") == "fr"
+    assert detect_query_language("Réglementation fintech Europe") == "fr"
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Benchmark du dispatcher d'embeddings du vector-service
+
+Fournisseur simulé (latence fixe + coût par texte, nombre limité de requêtes
+traitées en parallèle comme les limites de débit d'un compte OpenAI):
+
+- indexation d'un PDF de ~300 pages: un seul appel avec tous les segments
+  (ancien /index) face aux lots bornés exécutés en parallèle;
+- recherches simultanées: un appel par requête (ancien /search) face au
+  regroupement des requêtes concurrentes.
+
+Usage: python scripts/bench_embedding_dispatcher.py
+"""
+
+import sys
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "vector-service"))
+
+from app.embedding_dispatcher import EmbeddingDispatcher  # noqa: E402
+
+CALL_LATENCY = 0.08        # secondes par requête
+PER_TEXT_LATENCY = 0.0003  # secondes par texte dans la requête
+PROVIDER_PARALLELISM = 8   # requêtes traitées simultanément par le fournisseur
+PDF_SEGMENTS = 1500        # ~300 pages, 5 segments par page
+SEARCH_CLIENTS = 50
+SEARCHES_PER_CLIENT = 10
+
+
+class SimulatedProvider:
+    def __init__(self):
+        self.calls = 0
+        self._slots = threading.Semaphore(PROVIDER_PARALLELISM)
+        self._lock = threading.Lock()
+
+    def embed(self, texts):
+        with self._lock:
+            self.calls += 1
+        with self._slots:
+            time.sleep(CALL_LATENCY + PER_TEXT_LATENCY * len(texts))
+        return [[0.0] for _ in texts]
+
+
+def run_clients(embed_one) -> float:
+    def client(n):
+        for k in range(SEARCHES_PER_CLIENT):
+            embed_one(f"requête {n} {k}")
+
+    threads = [threading.Thread(target=client, args=(n,)) for n in range(SEARCH_CLIENTS)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start
+
+
+def main():
+    segments = [f"segment {i} " + "texte " * 150 for i in range(PDF_SEGMENTS)]
+
+    print("=" * 72)
+    print(f"Fournisseur simulé: {CALL_LATENCY * 1000:.0f} ms + {PER_TEXT_LATENCY * 1000:.1f} ms/texte, "
+          f"{PROVIDER_PARALLELISM} requêtes en parallèle")
+    print("=" * 72)
+
+    provider = SimulatedProvider()
+    start = time.perf_counter()
+    provider.embed(segments)
+    single = time.perf_counter() - start
+
+    provider = SimulatedProvider()
+    dispatcher = EmbeddingDispatcher(provider.embed)
+    start = time.perf_counter()
+    dispatcher.embed_many(segments)
+    batched = time.perf_counter() - start
+    print(f"\nIndexation ({PDF_SEGMENTS} segments)")
+    print(f"  un seul appel: {single:6.2f} s   lots parallèles: {batched:6.2f} s ({provider.calls} appels)")
+
+    searches = SEARCH_CLIENTS * SEARCHES_PER_CLIENT
+    provider = SimulatedProvider()
+    elapsed = run_clients(lambda text: provider.embed([text])[0])
+    before_calls = provider.calls
+    before = searches / elapsed
+
+    provider = SimulatedProvider()
+    dispatcher = EmbeddingDispatcher(provider.embed)
+    elapsed = run_clients(dispatcher.embed_one)
+    after = searches / elapsed
+    print(f"\nRecherches ({SEARCH_CLIENTS} clients x {SEARCHES_PER_CLIENT})")
+    print(f"  un appel par requête: {before:6.1f} req/s ({before_calls} appels)")
+    print(f"  requêtes regroupées:  {after:6.1f} req/s ({provider.calls} appels)")
+
+
+if __name__ == "__main__":
+    main()
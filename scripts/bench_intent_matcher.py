@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark de la détection d'intention de l'assistant
+
+Compare l'ancienne détection (dizaines de `any(word in message_lower ...)`,
+regex email appliquée deux fois dont un bloc de debug journalisé à chaque
+message, second parcours pour is_app_help_question) au matcher piloté par
+tables (app/intent_matcher.py: règles déclaratives, groupes évalués à la
+demande, analyse mémorisée par message).
+
+Mesure aussi la recherche de tous les mots-clés par une regex unique en trie
+(automate compilé) face aux recherches `in`, selon la longueur du message.
+
+Vérifie d'abord que les deux implémentations donnent exactement le même
+résultat sur le corpus et sur des messages générés aléatoirement.
+
+Usage: python scripts/bench_intent_matcher.py
+"""
+
+import random
+import re
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend-service"))
+
+from loguru import logger  # noqa: E402
+
+from app.intent_matcher import (  # noqa: E402
+    KEYWORD_GROUPS, SEND_SUFFIX_RE, detect_frequency, extract_after_marker, match_intent, scan_message,
+)
+
+# Les logs du bloc de debug sont formatés mais jetés
+logger.remove()
+logger.add(lambda _: None, level="INFO")
+
+ITERATIONS = 5000
+
+MESSAGES = [
+    "Créer une veille hebdomadaire sur la fintech européenne, à envoyer à marie.durand@example.com",
+    "Peux-tu configurer une nouvelle surveillance concernant les néobanques. Merci",
+    "Ajouter un rapport sur le marché de l'assurance vie en 2026",
+    "Quelles sont mes veilles actives ?",
+    "Supprimer la veille numéro 3",
+    "Modifier ma veille sur l'énergie pour qu'elle soit quotidienne",
+    "Comment fonctionne la génération de rapports ?",
+    "What features does the platform offer?",
+    "Quel est le taux directeur actuel de la BCE et son impact sur le crédit immobilier ?",
+    "Merci beaucoup, c'était très utile",
+    "Create a new watch about semiconductor supply chains, send to team@corp.io",
+]
+
+
+def legacy_detect(message: str):
+    """Ancien detect_intent_and_entities (bloc de debug H1 inclus)"""
+    _found_emails = re.findall(r'[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}', message)
+    logger.info(f"[DEBUG-H1] Email extraction: message='{message[:100]}', found_emails={_found_emails}")
+    message_lower = message.lower()
+    entities = {}
+    email_pattern = r'[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}'
+    found_emails = re.findall(email_pattern, message)
+    if found_emails:
+        entities["emails"] = found_emails
+    if any(word in message_lower for word in ["creer", "créer", "nouvelle", "ajouter", "configurer"]):
+        if any(word in message_lower for word in ["veille", "surveillance", "watch"]):
+            intent = "create_watch"
+            for keyword in ["sur", "concernant", "à propos de", "about"]:
+                if keyword in message_lower:
+                    idx = message_lower.find(keyword) + len(keyword)
+                    topic = message[idx:].strip().split(",")[0].split(".")[0].strip()
+                    if topic:
+                        for email in found_emails:
+                            topic = topic.replace(email, "").strip()
+                        topic = re.sub(r'\s*(a|à)\s*(envoyer|envoyé|envoyée)\s*(a|à)?\s*$', '', topic, flags=re.IGNORECASE).strip()
+                        if topic:
+                            entities["topic"] = topic
+            if "quotidien" in message_lower or "chaque jour" in message_lower:
+                entities["frequency"] = "daily"
+            elif "hebdomadaire" in message_lower or "chaque semaine" in message_lower:
+                entities["frequency"] = "weekly_monday"
+            elif "mensuel" in message_lower:
+                entities["frequency"] = "monthly"
+            return intent, entities
+        if any(word in message_lower for word in ["rapport", "analyse", "report"]):
+            intent = "generate_report"
+            for keyword in ["sur", "concernant", "à propos de", "about"]:
+                if keyword in message_lower:
+                    idx = message_lower.find(keyword) + len(keyword)
+                    query = message[idx:].strip().split(",")[0].split(".")[0].strip()
+                    if query:
+                        entities["query"] = query
+            return intent, entities
+    if any(word in message_lower for word in ["liste", "lister", "voir", "afficher", "montre", "quelles sont"]):
+        if any(word in message_lower for word in ["veille", "veilles", "surveillance", "watches"]):
+            return "list_watches", {}
+    if any(word in message_lower for word in ["supprimer", "effacer", "retirer", "delete"]):
+        if any(word in message_lower for word in ["veille", "watch"]):
+            return "delete_watch", entities
+    if any(word in message_lower for word in ["modifier", "changer", "mettre à jour", "update", "edit"]):
+        if any(word in message_lower for word in ["veille", "watch"]):
+            return "update_watch", entities
+    if any(word in message_lower for word in ["comment", "qu'est-ce", "c'est quoi", "explique", "how", "what", "pourquoi"]):
+        return "explanation", entities
+    if any(word in message_lower for word in ["aide", "help", "fonctionnalit", "feature", "peut faire", "capable"]):
+        return "explanation", entities
+    return "conversation", entities
+
+
+def legacy_is_help(message: str) -> bool:
+    message_lower = message.lower()
+    return any(kw in message_lower for kw in KEYWORD_GROUPS["app_help"])
+
+
+def compiled_detect(message: str):
+    """Même logique que app.main.detect_intent_and_entities"""
+    scan = scan_message(message)
+    entities = {}
+    if scan.emails:
+        entities["emails"] = list(scan.emails)
+    intent = match_intent(scan)
+    if intent == "create_watch":
+        for topic in extract_after_marker(scan):
+            if topic:
+                for email in scan.emails:
+                    topic = topic.replace(email, "").strip()
+                topic = SEND_SUFFIX_RE.sub('', topic).strip()
+                if topic:
+                    entities["topic"] = topic
+        frequency = detect_frequency(scan)
+        if frequency:
+            entities["frequency"] = frequency
+    elif intent == "generate_report":
+        for query in extract_after_marker(scan):
+            if query:
+                entities["query"] = query
+    elif intent == "list_watches":
+        return intent, {}
+    return intent, entities
+
+
+def compiled_is_help(message: str) -> bool:
+    return scan_message(message).has("app_help")
+
+
+def random_messages(count: int, seed: int = 7):
+    """Messages aléatoires mêlant mots-clés, bruit, ponctuation et emails"""
+    rng = random.Random(seed)
+    vocabulary = sorted({word for words in KEYWORD_GROUPS.values() for word in words})
+    noise = ["le", "marché", "BCE", "taux", "x@y.fr", ",", ".", "à", "envoyer", "EDIT", "Veilles", "2026"]
+    return [
+        " ".join(rng.choice(vocabulary + noise) for _ in range(rng.randint(1, 14)))
+        for _ in range(count)
+    ]
+
+
+def trie_pattern(words) -> str:
+    """Alternation en trie (préfixes communs factorisés, mot le plus long d'abord)"""
+    trie: dict = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = True
+
+    def build(node) -> str:
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        return "(?:" + body + ")?" if "" in node else body
+
+    return build(trie)
+
+
+def keyword_search_rows():
+    """Recherche de tous les mots-clés: automate regex (anticipation à chaque position) vs `in`"""
+    keywords = sorted({word for words in KEYWORD_GROUPS.values() for word in words})
+    automaton = re.compile("(?=(" + trie_pattern(keywords) + "))")
+    base = "Quel est le taux directeur actuel de la BCE et son impact sur le crédit immobilier ? ".lower()
+    print(f"\nRecherche des {len(keywords)} mots-clés distincts")
+    print("-" * 72)
+    for repeat in (1, 3, 10, 30):
+        text = base * repeat
+        assert set(automaton.findall(text)) <= {word for word in keywords if word in text}
+        iterations = ITERATIONS // repeat
+        start = time.perf_counter()
+        for _ in range(iterations):
+            automaton.findall(text)
+        regex_us = (time.perf_counter() - start) / iterations * 1e6
+        start = time.perf_counter()
+        for _ in range(iterations):
+            [word for word in keywords if word in text]
+        in_us = (time.perf_counter() - start) / iterations * 1e6
+        print(f"  {len(text):5d} car.   regex en trie: {regex_us:8.2f} µs   recherches `in`: {in_us:8.2f} µs")
+
+
+def timed(fn, messages, clear_cache: bool) -> float:
+    start = time.perf_counter()
+    for _ in range(ITERATIONS):
+        for message in messages:
+            if clear_cache:
+                scan_message.cache_clear()
+            fn(message)
+    return (time.perf_counter() - start) / (ITERATIONS * len(messages)) * 1e6
+
+
+def main():
+    corpus = MESSAGES + random_messages(2000)
+    for message in corpus:
+        assert legacy_detect(message) == compiled_detect(message), message
+        assert legacy_is_help(message) == compiled_is_help(message), message
+
+    print("=" * 72)
+    print(f"Détection d'intention ({len(MESSAGES)} messages, {ITERATIONS} itérations)")
+    print(f"Résultats identiques sur {len(corpus)} messages (corpus + aléatoires)")
+    print("=" * 72)
+
+    def legacy_turn(message):
+        legacy_detect(message)
+        legacy_is_help(message)
+
+    def compiled_turn(message):
+        compiled_detect(message)
+        compiled_is_help(message)
+
+    rows = [
+        ("intent + entités", legacy_detect, compiled_detect),
+        ("aide application", legacy_is_help, compiled_is_help),
+        ("tour de chat complet", legacy_turn, compiled_turn),
+    ]
+    for label, legacy, compiled in rows:
+        before = timed(legacy, MESSAGES, clear_cache=False)
+        cold = timed(compiled, MESSAGES, clear_cache=True)
+        print(f"\n{label}")
+        print(f"  avant: {before:7.2f} µs   après: {cold:7.2f} µs"
+              f"   ({100 * (cold - before) / before:+.1f}%)")
+
+    keyword_search_rows()
+
+
+if __name__ == "__main__":
+    main()
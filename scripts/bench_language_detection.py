@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Benchmark de la détection de langue FR/EN
+
+Compare le détecteur partagé (app/language_detector.py, mots-outils en un seul
+passage, échantillonnage et mémoïsation) aux deux anciennes implémentations:
+langdetect côté backend (requêtes) et le score par sous-chaînes du
+report-service (rapports complets). Mesure le temps par appel sur des requêtes
+courtes et des rapports longs, à froid (cache vide) et à chaud, ainsi que
+l'accord avec la langue attendue.
+
+Usage: python scripts/bench_language_detection.py
+"""
+
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend-service"))
+
+from app import language_detector  # noqa: E402
+
+try:
+    from langdetect import DetectorFactory, detect as langdetect_detect
+    DetectorFactory.seed = 0
+except ImportError:  # langdetect n'est plus une dépendance du backend
+    langdetect_detect = None
+
+ITERATIONS = 200
+
+QUERIES = [
+    ("Impact de la hausse des taux directeurs de la BCE sur les banques françaises", "fr"),
+    ("Quelles sont les tendances du marché de l'assurance vie en 2026 ?", "fr"),
+    ("Analyse concurrentielle des néobanques européennes", "fr"),
+    ("Stratégie de décarbonation des acteurs du transport maritime", "fr"),
+    ("What is the impact of rising ECB rates on French retail banks?", "en"),
+    ("Competitive landscape of European neobanks and their growth strategy", "en"),
+    ("Market overview of the life insurance sector in 2026", "en"),
+    ("How are maritime shipping companies handling decarbonization?", "en"),
+    ("Fintech et startups: état du marché du paiement", "fr"),
+    ("Benchmark cloud souverain", "fr"),
+    ("AI strategy for retail banks", "en"),
+    ("Private equity fundraising outlook", "en"),
+]
+
+FR_PARAGRAPH = (
+    "## Synthèse exécutive\n\nLe marché bancaire français connaît une évolution marquée par la hausse "
+    "des taux et la pression réglementaire. Les banques de détail ont vu leur marge nette d'intérêt se "
+    "redresser en 2024, mais la croissance du crédit immobilier reste faible. Cette analyse présente les "
+    "tendances du secteur, les risques identifiés et nos recommandations stratégiques [1][2].\n\n"
+)
+EN_PARAGRAPH = (
+    "## Executive summary\n\nThe French banking market is shaped by rising rates and regulatory pressure. "
+    "Retail banks have seen their net interest margin recover in 2024, but mortgage growth remains weak. "
+    "This analysis presents the key trends in the sector, the identified risks and our strategic "
+    "recommendations [1][2].\n\n"
+)
+REPORTS = [(FR_PARAGRAPH * 120, "fr"), (EN_PARAGRAPH * 120, "en")]
+
+
+def legacy_substring_language(content: str) -> str:
+    """Ancien detect_content_language du report-service (score par sous-chaînes)"""
+    if not content:
+        return 'fr'
+    english_indicators = [
+        'the ', 'and ', 'of ', 'to ', 'in ', 'is ', 'for ', 'with ', 'that ', 'are ',
+        'analysis', 'market', 'business', 'strategy', 'recommendations', 'executive summary',
+        'key findings', 'conclusion', 'overview', 'trends', 'growth', 'sector'
+    ]
+    french_indicators = [
+        ' le ', ' la ', ' les ', ' de ', ' du ', ' des ', ' et ', ' en ', ' un ', ' une ',
+        'analyse', 'marché', 'stratégie', 'recommandations', 'synthèse', 'conclusion',
+        'secteur', 'croissance', 'tendances', 'évolution'
+    ]
+    content_lower = content.lower()
+    english_score = sum(1 for word in english_indicators if word in content_lower)
+    french_score = sum(1 for word in french_indicators if word in content_lower)
+    return 'en' if english_score > french_score else 'fr'
+
+
+def legacy_langdetect_language(query: str) -> str:
+    """Ancien detect_query_language du backend (langdetect, 'fr' par défaut)"""
+    if not query or len(query.strip()) < 10:
+        return 'fr'
+    try:
+        detected = langdetect_detect(query)
+    except Exception:
+        return 'fr'
+    return detected if detected in ('en', 'fr') else 'fr'
+
+
+def cold_detect(text: str) -> str:
+    language_detector._cache.clear()
+    return language_detector.detect_language(text)
+
+
+def measure(detect, samples):
+    start = time.perf_counter()
+    for _ in range(ITERATIONS):
+        for text, _ in samples:
+            detect(text)
+    per_call_us = (time.perf_counter() - start) / (ITERATIONS * len(samples)) * 1e6
+    agreement = sum(detect(text) == expected for text, expected in samples)
+    return per_call_us, agreement
+
+
+def report(title, samples, candidates):
+    print(f"\n{title} ({len(samples)} textes, {ITERATIONS} itérations)")
+    print("-" * 72)
+    for name, detect in candidates:
+        per_call_us, agreement = measure(detect, samples)
+        print(f"  {name:34s} {per_call_us:10.1f} µs/appel   justes: {agreement}/{len(samples)}")
+
+
+def main():
+    print("=" * 72)
+    print("Détection de langue FR/EN")
+    print("=" * 72)
+
+    candidates = [
+        ("score par sous-chaînes (report)", legacy_substring_language),
+        ("détecteur partagé, cache vide", cold_detect),
+        ("détecteur partagé, cache chaud", language_detector.detect_language),
+    ]
+    if langdetect_detect is not None:
+        candidates.insert(0, ("langdetect (backend)", legacy_langdetect_language))
+    else:
+        print("\nlangdetect non installé: comparaison limitée au score par sous-chaînes")
+
+    report("Requêtes utilisateur", QUERIES, candidates)
+    report(f"Rapports complets (~{len(REPORTS[0][0]) // 1000} Ko)", REPORTS, candidates)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Benchmark du budget de tokens des prompts de rapport
+
+Compare, sur un jeu d'entrées représentatif (12 passages RAG, contextes
+entreprise longs, historique), les tokens d'entrée envoyés à Perplexity avec
+l'ancienne troncature par caractères et avec fit_prompt_sections.
+
+Usage: python scripts/bench_prompt_budget.py
+"""
+
+import asyncio
+import os
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend-service"))
+
+from app.prompt_budget import estimate_tokens, fit_prompt_sections  # noqa: E402
+from app import main as backend  # noqa: E402
+
+QUERY = "Impact de la hausse des taux directeurs de la BCE sur la rentabilité des banques de détail françaises"
+
+PASSAGE = (
+    "La marge nette d'intérêt des banques de détail françaises s'est redressée en 2024 "
+    "sous l'effet de la hausse des taux directeurs. Les crédits immobiliers à taux fixe "
+    "pèsent toutefois sur le rendement moyen des encours. L'ACPR souligne la sensibilité "
+    "du coût de la ressource aux transferts vers les livrets réglementés. "
+)
+
+
+def sample_inputs(with_user_context: bool = True):
+    documents = [
+        {"doc_id": i, "text": f"[Extrait {i}] " + PASSAGE * 3, "score": round(0.92 - i * 0.06, 2), "segment_index": i}
+        for i in range(12)
+    ]
+    # Deux passages en double (segments qui se recouvrent dans vector-service)
+    documents[4]["text"] = documents[1]["text"]
+    user_context = "## CONTEXTES ENTREPRISE\n\n### Profil\n" + (
+        "Banque régionale de 2 400 collaborateurs, 1,1 million de clients particuliers, "
+        "forte exposition au crédit immobilier à taux fixe. "
+    ) * 60
+    user_history = "\n## HISTORIQUE\n" + "- synthese_executive: marge d'intérêt et taux BCE\n" * 20
+    if not with_user_context:
+        return documents, "", ""
+    return documents, user_context, user_history
+
+
+def legacy_sections(documents, user_context, user_history):
+    """Troncatures historiques: 6 passages x 500 caractères, 4000 / 800 caractères"""
+    return {
+        "context": backend.format_context_safe(documents)[:5000],
+        "user_context": user_context[:4000],
+        "user_history": user_history[:800],
+    }
+
+
+async def build_messages(query, context, user_context, user_history):
+    prompt = await backend.create_optimized_prompt(
+        "finance_banque", "synthese_executive", query, context,
+        language="fr", user_context=user_context, user_history=user_history
+    )
+    return backend.build_perplexity_request(prompt, "analysis")["messages"]
+
+
+async def compare(label, documents, user_context, user_history):
+    # Avant: troncatures par caractères puis coupe du message utilisateur à 15 000 caractères
+    legacy = legacy_sections(documents, user_context, user_history)
+    system, user = await build_messages(QUERY, legacy["context"], legacy["user_context"], legacy["user_history"])
+    cut_chars = max(len(user["content"]) - 15000, 0)
+    legacy_total = estimate_tokens(system["content"]) + estimate_tokens(user["content"][:15000])
+    legacy_variable = sum(estimate_tokens(v) for v in legacy.values())
+
+    # Après: budget par section, aucune coupe du message complet
+    sections = fit_prompt_sections(QUERY, documents, user_context, user_history)
+    context = backend.format_context_safe(sections["documents"])
+    system, user = await build_messages(sections["query"], context, sections["user_context"], sections["user_history"])
+    budget_total = estimate_tokens(system["content"]) + estimate_tokens(user["content"])
+
+    print(f"\n{label}")
+    print("-" * 64)
+    print(f"Sections variables  - avant: {legacy_variable:6d}   après: {sections['tokens']['total']:6d}"
+          f"   ({100 * (sections['tokens']['total'] - legacy_variable) / legacy_variable:+.1f}%)")
+    print(f"Requête complète    - avant: {legacy_total:6d}   après: {budget_total:6d}"
+          f"   ({100 * (budget_total - legacy_total) / legacy_total:+.1f}%)")
+    print(f"Instructions coupées (limite 15 000 car.) - avant: {cut_chars} car.   après: 0")
+    print(f"Détail après budget - {sections['tokens']}")
+    print(f"Passages conservés  - {[d['doc_id'] for d in sections['documents']]}")
+
+
+async def main():
+    print("=" * 64)
+    print("Tokens d'entrée par appel sonar-pro (synthese_executive)")
+    print("=" * 64)
+    await compare("Veille planifiée (pas de contexte utilisateur)", *sample_inputs(with_user_context=False))
+    await compare("Utilisateur avec contextes entreprise longs", *sample_inputs())
+
+
+if __name__ == "__main__":
+    os.environ.setdefault("PERPLEXITY_API_KEY", "")
+    asyncio.run(main())
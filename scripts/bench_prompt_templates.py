@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Benchmark de la construction des prompts de rapport
+
+Compare l'ancienne construction (dictionnaire de f-strings: tous les templates
+d'un type de rapport sont formatés à chaque requête, puis un seul est gardé)
+au registre précompilé (seul le template choisi est assemblé). Mesure le
+temps CPU et le pic mémoire par requête, puis affiche le coût fixe en
+tokens de chaque template.
+
+Usage: python scripts/bench_prompt_templates.py
+"""
+
+import os
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend-service"))
+os.environ.setdefault("PERPLEXITY_API_KEY", "")
+
+from app import main as backend  # noqa: E402
+from app.prompt_templates import PROMPT_TEMPLATES  # noqa: E402
+
+ITERATIONS = 2000
+QUERY = "Impact de la hausse des taux directeurs de la BCE sur la rentabilité des banques de détail françaises"
+CONTEXT = "**[Réf. 1]** (Score: 0.912):\nLa marge nette d'intérêt des banques s'est redressée en 2024...\n\n" * 6
+DATES = {"date_debut": "10/10/2026", "date_fin": "17/10/2026"}
+
+
+def legacy_build(analysis_type: str) -> str:
+    """Émulation de l'ancien code: chaque template du dictionnaire est formaté"""
+    time_constraint = backend.TIME_CONSTRAINT_TEMPLATE.format(**DATES)
+    if analysis_type == "synthese_executive":
+        templates = {
+            name: source.format(time_constraint=time_constraint, query=QUERY, context=CONTEXT, **DATES)
+            for name, source in backend.REPORT_TEMPLATES_DEEP.items()
+        }
+    else:
+        templates = {
+            name: source.format(query=QUERY, context=CONTEXT)
+            for name, source in backend.REPORT_TEMPLATES.items()
+        }
+    prompt = backend.LANGUAGE_INSTRUCTIONS["fr"] + templates["finance_banque"]
+    system_prompt = backend.REPORT_SYSTEM_PROMPT_TEMPLATE.format(trusted_sources=backend.TRUSTED_SOURCES_INSTRUCTION)
+    return system_prompt + backend.RESEARCH_INSTRUCTIONS_TEMPLATE.format(prompt=prompt)
+
+
+def registry_build(analysis_type: str) -> str:
+    """Construction actuelle: un seul template assemblé, system prompt déjà rendu"""
+    if analysis_type == "synthese_executive":
+        time_constraint = PROMPT_TEMPLATES.render("report/time_constraint", **DATES)
+        body = PROMPT_TEMPLATES.render(
+            "report_deep/finance_banque", time_constraint=time_constraint, query=QUERY, context=CONTEXT, **DATES
+        )
+    else:
+        body = PROMPT_TEMPLATES.render("report/finance_banque", query=QUERY, context=CONTEXT)
+    prompt = backend.LANGUAGE_INSTRUCTIONS["fr"] + body
+    return backend.REPORT_SYSTEM_PROMPT + PROMPT_TEMPLATES.render("research/report", prompt=prompt)
+
+
+def measure(build, analysis_type: str):
+    start = time.perf_counter()
+    for _ in range(ITERATIONS):
+        build(analysis_type)
+    cpu_us = (time.perf_counter() - start) / ITERATIONS * 1e6
+
+    tracemalloc.start()
+    for _ in range(100):
+        build(analysis_type)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return cpu_us, peak
+
+
+def main():
+    assert legacy_build("synthese_executive") == registry_build("synthese_executive")
+    assert legacy_build("analyse_concurrentielle") == registry_build("analyse_concurrentielle")
+
+    print("=" * 72)
+    print(f"Construction d'un prompt de rapport ({ITERATIONS} itérations)")
+    print("=" * 72)
+    for analysis_type in ("synthese_executive", "analyse_concurrentielle"):
+        legacy_us, legacy_peak = measure(legacy_build, analysis_type)
+        new_us, new_peak = measure(registry_build, analysis_type)
+        print(f"\n{analysis_type}")
+        print(f"  CPU / requête   - avant: {legacy_us:8.1f} µs   après: {new_us:8.1f} µs"
+              f"   ({100 * (new_us - legacy_us) / legacy_us:+.1f}%)")
+        print(f"  Pic mémoire     - avant: {legacy_peak / 1024:8.1f} Ko   après: {new_peak / 1024:8.1f} Ko")
+
+    print("\nCoût fixe par template (tokens hors texte utilisateur)")
+    print("-" * 72)
+    for name, size in PROMPT_TEMPLATES.static_sizes().items():
+        print(f"  {name:45s} {size['static_tokens']:6d} tokens  {size['static_chars']:7d} car.")
+
+
+if __name__ == "__main__":
+    main()
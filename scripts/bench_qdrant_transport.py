@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Benchmark du transport Qdrant du vector-service
+
+50 recherches simultanées, répétées, sur une collection de test remplie de
+vecteurs aléatoires (1536 dimensions), avec trois clients:
+
+- client synchrone REST appelé depuis un pool de threads (ancien /search);
+- client asynchrone REST (QDRANT_PREFER_GRPC=false);
+- client asynchrone gRPC (QDRANT_PREFER_GRPC=true).
+
+Affiche les latences p50/p99 par recherche et le débit. Nécessite une
+instance Qdrant accessible (REST 6333, gRPC 6334); la collection de test
+est supprimée à la fin.
+
+Usage: QDRANT_HOST=localhost python scripts/bench_qdrant_transport.py
+"""
+
+import asyncio
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "vector-service"))
+
+from qdrant_client import AsyncQdrantClient, QdrantClient  # noqa: E402
+from qdrant_client.http.models import Distance, PointStruct, VectorParams  # noqa: E402
+
+HOST = os.environ.get("QDRANT_HOST", "localhost")
+PORT = int(os.environ.get("QDRANT_PORT", 6333))
+GRPC_PORT = int(os.environ.get("QDRANT_GRPC_PORT", 6334))
+COLLECTION = "bench_transport"
+DIM = 1536
+POINTS = 5000
+CONCURRENCY = 50
+ROUNDS = 20
+THREADPOOL_WORKERS = 40  # Pool par défaut de FastAPI pour les endpoints synchrones
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))]
+
+
+def report(label, latencies, elapsed):
+    ms = [latency * 1000 for latency in latencies]
+    print(f"  {label:<26} p50 {percentile(ms, 50):7.2f} ms   p99 {percentile(ms, 99):7.2f} ms   "
+          f"moy {statistics.mean(ms):7.2f} ms   {len(ms) / elapsed:7.1f} req/s")
+
+
+def queries(rng):
+    return [rng.random(DIM, dtype=np.float32).tolist() for _ in range(CONCURRENCY)]
+
+
+def bench_sync_rest(rng):
+    client = QdrantClient(host=HOST, port=PORT)
+    latencies = []
+
+    def one(vector):
+        start = time.perf_counter()
+        client.search(collection_name=COLLECTION, query_vector=vector, limit=5)
+        return time.perf_counter() - start
+
+    with ThreadPoolExecutor(max_workers=THREADPOOL_WORKERS) as pool:
+        one(queries(rng)[0])  # Connexion établie avant la mesure
+        start = time.perf_counter()
+        for _ in range(ROUNDS):
+            latencies.extend(pool.map(one, queries(rng)))
+        elapsed = time.perf_counter() - start
+    client.close()
+    return latencies, elapsed
+
+
+async def bench_async(rng, prefer_grpc):
+    client = AsyncQdrantClient(host=HOST, port=PORT, grpc_port=GRPC_PORT, prefer_grpc=prefer_grpc)
+
+    async def one(vector):
+        start = time.perf_counter()
+        await client.search(collection_name=COLLECTION, query_vector=vector, limit=5)
+        return time.perf_counter() - start
+
+    await one(queries(rng)[0])
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        latencies.extend(await asyncio.gather(*(one(vector) for vector in queries(rng))))
+    elapsed = time.perf_counter() - start
+    await client.close()
+    return latencies, elapsed
+
+
+def main():
+    rng = np.random.default_rng(42)
+    admin = QdrantClient(host=HOST, port=PORT)
+    try:
+        admin.get_collections()
+    except Exception as e:
+        sys.exit(f"Qdrant injoignable sur {HOST}:{PORT} ({e})")
+
+    admin.recreate_collection(
+        collection_name=COLLECTION,
+        vectors_config=VectorParams(size=DIM, distance=Distance.COSINE),
+    )
+    vectors = rng.random((POINTS, DIM), dtype=np.float32)
+    for start in range(0, POINTS, 500):
+        admin.upsert(collection_name=COLLECTION, wait=True, points=[
+            PointStruct(id=i, vector=vectors[i].tolist(), payload={"text": f"segment {i}"})
+            for i in range(start, min(start + 500, POINTS))
+        ])
+
+    print("=" * 72)
+    print(f"Qdrant {HOST}: {POINTS} vecteurs {DIM}d, {CONCURRENCY} recherches simultanées x {ROUNDS}")
+    print("=" * 72)
+    try:
+        report("REST sync (threads)", *bench_sync_rest(rng))
+        report("REST async", *asyncio.run(bench_async(rng, prefer_grpc=False)))
+        report("gRPC async", *asyncio.run(bench_async(rng, prefer_grpc=True)))
+    finally:
+        admin.delete_collection(COLLECTION)
+        admin.close()
+
+
+if __name__ == "__main__":
+    main()
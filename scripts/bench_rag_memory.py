@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Benchmark de l'historique RAG des conversations
+
+Compare l'ancien stockage (un fichier JSON par utilisateur, relu et réécrit
+entièrement à chaque ajout, recherche par parcours de toutes les
+conversations) au store SQLite append-only avec index inversé des termes
+(app/rag_memory.py). Mesure l'ajout, la recherche d'historique pertinent et
+la perte d'ajouts lorsque plusieurs threads écrivent en même temps.
+
+Usage: python scripts/bench_rag_memory.py
+"""
+
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend-service"))
+
+os.environ["MEMORY_DIR"] = tempfile.mkdtemp(prefix="bench_rag_memory_")
+os.environ["MEMORY_DB_PATH"] = os.path.join(os.environ["MEMORY_DIR"], "rag_memory.sqlite3")
+
+from loguru import logger  # noqa: E402
+
+from app import rag_memory  # noqa: E402
+
+logger.remove()
+
+ITERATIONS = 500
+THREADS = 8
+APPENDS_PER_THREAD = 20
+
+VOCABULARY = (
+    "fintech banque assurance marché taux directeur bce crédit immobilier énergie europe néobanque "
+    "paiement cloud souverain stratégie concurrence régulation croissance risque tendance"
+).split()
+
+
+class LegacyJsonMemory:
+    """Ancien stockage: fichier JSON complet relu et réécrit à chaque ajout"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, user_id: str) -> str:
+        return os.path.join(self.directory, f"memory_{user_id}.json")
+
+    def load(self, user_id: str):
+        try:
+            with open(self._path(user_id), "r", encoding="utf-8") as f:
+                return json.load(f).get("conversations", [])
+        except Exception:  # Fichier absent ou en cours de réécriture: historique perdu
+            return []
+
+    def add(self, user_id: str, query: str, response: str):
+        conversations = self.load(user_id)
+        conversations.append({"query": query, "response_summary": response[:500], "metadata": {}})
+        with open(self._path(user_id), "w", encoding="utf-8") as f:
+            json.dump({"user_id": user_id, "conversations": conversations[-rag_memory.MAX_HISTORY_ITEMS:]}, f)
+
+    def relevant(self, user_id: str, query: str, max_items: int = 3):
+        query_words = set(query.lower().split())
+        scored = []
+        for conv in self.load(user_id):
+            score = len(query_words & set(conv.get("query", "").lower().split()))
+            if score > 0:
+                scored.append((score, conv))
+        scored.sort(key=lambda x: x[0], reverse=True)
+        return [conv for _, conv in scored[:max_items]]
+
+
+def sentence(rng: random.Random, low: int, high: int) -> str:
+    return " ".join(rng.choice(VOCABULARY) for _ in range(rng.randint(low, high)))
+
+
+def per_call_us(fn, iterations: int = ITERATIONS) -> float:
+    start = time.perf_counter()
+    for i in range(iterations):
+        fn(i)
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def concurrent_appends(add) -> int:
+    def worker(n):
+        for k in range(APPENDS_PER_THREAD):
+            add(n, k)
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return THREADS * APPENDS_PER_THREAD
+
+
+def main():
+    rng = random.Random(11)
+    legacy = LegacyJsonMemory(os.path.join(os.environ["MEMORY_DIR"], "legacy"))
+    queries = [sentence(rng, 3, 12) for _ in range(ITERATIONS)]
+    responses = [sentence(rng, 60, 80) for _ in range(ITERATIONS)]
+
+    print("=" * 72)
+    print(f"Historique RAG ({rag_memory.MAX_HISTORY_ITEMS} conversations conservées par utilisateur)")
+    print("=" * 72)
+
+    legacy_add = per_call_us(lambda i: legacy.add("u", queries[i], responses[i]))
+    store_add = per_call_us(lambda i: rag_memory.add_conversation("u", queries[i], responses[i], "bench"))
+    print(f"\najout (historique plein)      avant: {legacy_add:8.1f} µs   après: {store_add:8.1f} µs")
+
+    legacy_read = per_call_us(lambda i: legacy.relevant("u", queries[-i]))
+    store_read = per_call_us(lambda i: rag_memory.get_relevant_history("u", queries[-i], 3))
+    print(f"historique pertinent          avant: {legacy_read:8.1f} µs   après: {store_read:8.1f} µs")
+
+    # Écritures simultanées d'un même utilisateur: l'ancien stockage perd des ajouts
+    rag_memory.MAX_HISTORY_ITEMS = THREADS * APPENDS_PER_THREAD
+    rag_memory.get_conversation_store().max_items = rag_memory.MAX_HISTORY_ITEMS
+    sent = concurrent_appends(lambda n, k: legacy.add("c", f"q {n} {k}", "r"))
+    legacy_kept = len(legacy.load("c"))
+    concurrent_appends(lambda n, k: rag_memory.add_conversation("c", f"q {n} {k}", "r", "bench"))
+    store_kept = len(rag_memory.get_full_history("c", limit=sent))
+    print(f"\n{THREADS} threads x {APPENDS_PER_THREAD} ajouts     avant: {legacy_kept}/{sent} conservés"
+          f"   après: {store_kept}/{sent} conservés")
+
+
+if __name__ == "__main__":
+    main()
@@ -69,7 +69,8 @@ echo ""
 
 # Vérifier l'indexation dans Qdrant
 echo "🔍 Vérification Qdrant..."
-vectors_info=$(curl -s http://localhost:6333/collections/documents | python3 -c "import sys,json; d=json.load(sys.stdin); print(f\"Vecteurs: {d['result']['vectors_count']}, Points: {d['result']['points_count']}\")" 2>/dev/null)
+# pdf_segments: alias de la collection du modèle d'embedding courant (vector-service)
+vectors_info=$(curl -s -X POST http://localhost:6333/collections/pdf_segments/points/count -H 'Content-Type: application/json' -d '{"exact": true}' | python3 -c "import sys,json; d=json.load(sys.stdin); print(f\"Segments indexés: {d['result']['count']}\")" 2>/dev/null)
 if [ $? -eq 0 ]; then
     echo "✅ $vectors_info"
 else
@@ -0,0 +1,131 @@
+"""
+Persistent, content-addressed embedding cache
+
+Vectors are keyed by (model, dimension, sha256(text)) and stored as float32
+blobs in SQLite (WAL), so re-indexing a document or repeating a search does
+not call the embedding provider again, even after a restart. Least recently
+used entries are evicted beyond max_entries.
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from loguru import logger
+
+EMBEDDING_CACHE_PATH = os.environ.get("EMBEDDING_CACHE_PATH", "/data/embedding_cache.sqlite3")
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.environ.get("EMBEDDING_CACHE_MAX_ENTRIES", "500000"))
+
+
+def cache_key(model: str, dim: int, text: str) -> str:
+    return f"{model}:{dim}:{hashlib.sha256(text.encode('utf-8')).hexdigest()}"
+
+
+class EmbeddingCache:
+    """SQLite embedding store with LRU eviction and hit/miss counters"""
+
+    def __init__(self, path: str = EMBEDDING_CACHE_PATH, max_entries: int = EMBEDDING_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        directory = os.path.dirname(path)
+        if directory and path != ":memory:":
+            os.makedirs(directory, exist_ok=True)
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                " key TEXT PRIMARY KEY,"
+                " vector BLOB NOT NULL,"
+                " last_access REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_access ON embeddings(last_access)")
+            # Upper bound (replaced keys are counted again): recounted only when it passes max_entries
+            self._entries = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def _connect(self) -> sqlite3.Connection:
+        """One connection per process, used under self._lock"""
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn = conn
+        return self._conn
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, List[float]]:
+        """Cached vectors for the given keys (missing keys are absent)"""
+        keys = list(dict.fromkeys(keys))
+        found: Dict[str, List[float]] = {}
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            # Stay under SQLite's bound-variable limit
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                for key, blob in conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                ):
+                    found[key] = np.frombuffer(blob, dtype=np.float32).tolist()
+            if found:
+                conn.executemany(
+                    "UPDATE embeddings SET last_access = ? WHERE key = ?",
+                    [(now, key) for key in found]
+                )
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, items: Iterable[Tuple[str, List[float]]]) -> None:
+        """Store vectors, then evict the least recently used entries beyond max_entries"""
+        now = time.time()
+        rows = [(key, np.asarray(vector, dtype=np.float32).tobytes(), now) for key, vector in items]
+        if not rows:
+            return
+        with self._lock, self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, last_access) VALUES (?, ?, ?)", rows
+            )
+            self._entries += len(rows)
+            if self._entries > self.max_entries:
+                self._entries = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+                excess = self._entries - self.max_entries
+                if excess > 0:
+                    conn.execute(
+                        "DELETE FROM embeddings WHERE key IN"
+                        " (SELECT key FROM embeddings ORDER BY last_access LIMIT ?)",
+                        (excess,)
+                    )
+                    self._entries -= excess
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            entries = self._connect().execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "entries": entries,
+            }
+
+
+_cache: Optional[EmbeddingCache] = None
+_cache_failed = False
+
+
+def get_embedding_cache() -> Optional[EmbeddingCache]:
+    """Shared cache, None when disabled (EMBEDDING_CACHE_PATH empty) or unavailable"""
+    global _cache, _cache_failed
+    if _cache is None and EMBEDDING_CACHE_PATH and not _cache_failed:
+        try:
+            _cache = EmbeddingCache()
+        except Exception as e:
+            _cache_failed = True
+            logger.error(f"Embedding cache unavailable at {EMBEDDING_CACHE_PATH}: {e}")
+    return _cache
@@ -0,0 +1,129 @@
+"""
+Embedding dispatcher: bounded batches, bounded concurrency, query coalescing
+
+Large inputs (a long PDF) are split into batches bounded by item count and
+estimated tokens, and the batches run in parallel on a shared pool, which
+also caps concurrent provider calls for the whole process. Concurrent
+single-query requests are coalesced: while a provider call is in flight, the
+next query waits a few milliseconds for others and they go out as one batch.
+"""
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional
+
+EMBEDDING_BATCH_SIZE = int(os.environ.get("EMBEDDING_BATCH_SIZE", "256"))
+EMBEDDING_BATCH_TOKENS = int(os.environ.get("EMBEDDING_BATCH_TOKENS", "100000"))
+EMBEDDING_CONCURRENCY = int(os.environ.get("EMBEDDING_CONCURRENCY", "4"))
+EMBEDDING_COALESCE_MS = float(os.environ.get("EMBEDDING_COALESCE_MS", "5"))
+
+EmbedFn = Callable[[List[str]], List[List[float]]]
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token)"""
+    return len(text) // 4 + 1
+
+
+def make_batches(
+    texts: List[str],
+    max_items: int = EMBEDDING_BATCH_SIZE,
+    max_tokens: int = EMBEDDING_BATCH_TOKENS
+) -> List[List[str]]:
+    """Consecutive batches of at most max_items texts and about max_tokens tokens"""
+    batches: List[List[str]] = []
+    current: List[str] = []
+    tokens = 0
+    for text in texts:
+        cost = estimate_tokens(text)
+        if current and (len(current) >= max_items or tokens + cost > max_tokens):
+            batches.append(current)
+            current, tokens = [], 0
+        current.append(text)
+        tokens += cost
+    if current:
+        batches.append(current)
+    return batches
+
+
+class _PendingQuery:
+    __slots__ = ("text", "done", "vector", "error")
+
+    def __init__(self, text: str):
+        self.text = text
+        self.done = threading.Event()
+        self.vector: Optional[List[float]] = None
+        self.error: Optional[BaseException] = None
+
+
+class EmbeddingDispatcher:
+    """Runs provider calls for one embedding function"""
+
+    def __init__(
+        self,
+        embed: EmbedFn,
+        concurrency: int = EMBEDDING_CONCURRENCY,
+        coalesce_ms: float = EMBEDDING_COALESCE_MS,
+        batch_size: int = EMBEDDING_BATCH_SIZE,
+        batch_tokens: int = EMBEDDING_BATCH_TOKENS
+    ):
+        self._embed = embed
+        self._batch_size = batch_size
+        self._batch_tokens = batch_tokens
+        self._pool = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="embeddings")
+        self._window = coalesce_ms / 1000
+        self._lock = threading.Lock()
+        self._queue: List[_PendingQuery] = []
+        self._leader = False
+        self._in_flight = 0
+
+    def _call(self, batch: List[str]) -> List[List[float]]:
+        with self._lock:
+            self._in_flight += 1
+        try:
+            return self._embed(batch)
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+    def embed_many(self, texts: List[str]) -> List[List[float]]:
+        """Embed texts in bounded batches, run concurrently, results in input order"""
+        batches = make_batches(texts, self._batch_size, self._batch_tokens)
+        if len(batches) == 1:
+            return self._pool.submit(self._call, batches[0]).result()
+        vectors: List[List[float]] = []
+        for result in self._pool.map(self._call, batches):
+            vectors.extend(result)
+        return vectors
+
+    def embed_one(self, text: str) -> List[float]:
+        """Embed a single query, batched with concurrent queries"""
+        item = _PendingQuery(text)
+        with self._lock:
+            self._queue.append(item)
+            lead = not self._leader
+            self._leader = True
+            busy = self._in_flight > 0
+        if lead:
+            # Idle provider: send right away; otherwise gather the queries arriving meanwhile
+            if busy and self._window > 0:
+                time.sleep(self._window)
+            with self._lock:
+                batch, self._queue = self._queue, []
+                self._leader = False
+            try:
+                vectors = self.embed_many([pending.text for pending in batch])
+                for pending, vector in zip(batch, vectors):
+                    pending.vector = vector
+            except BaseException as e:
+                for pending in batch:
+                    pending.error = e
+            finally:
+                for pending in batch:
+                    pending.done.set()
+        item.done.wait()
+        if item.error is not None:
+            raise item.error
+        return item.vector
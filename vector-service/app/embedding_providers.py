@@ -0,0 +1,148 @@
+"""
+Embedding providers: OpenAI API or a local CPU model
+
+Every provider exposes the same interface (model, dim, embed) and owns an
+EmbeddingDispatcher, so batching, bounded concurrency and query coalescing
+apply to both. The local provider runs a small ONNX model through fastembed
+(optional dependency), loaded once per process: searches need no network and
+concurrent queries are embedded as one inference batch.
+
+Air-gapped deployments fetch the model once with network access
+(python -m app.embedding_providers, into LOCAL_EMBEDDING_CACHE_DIR) and then
+set LOCAL_EMBEDDING_OFFLINE: the model is loaded from the cache only.
+"""
+
+import importlib.util
+import os
+import threading
+from typing import Any, Callable, List, Optional
+
+from loguru import logger
+
+from app.embedding_dispatcher import (
+    EMBEDDING_BATCH_SIZE,
+    EMBEDDING_BATCH_TOKENS,
+    EMBEDDING_CONCURRENCY,
+    EmbeddingDispatcher,
+)
+
+LOCAL_EMBEDDING_MODEL = os.environ.get(
+    "LOCAL_EMBEDDING_MODEL", "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+)
+LOCAL_EMBEDDING_DIM = int(os.environ.get("LOCAL_EMBEDDING_DIM", "384"))
+LOCAL_EMBEDDING_BATCH_SIZE = int(os.environ.get("LOCAL_EMBEDDING_BATCH_SIZE", "32"))
+# One inference at a time: ONNX Runtime already spreads a batch over the cores
+LOCAL_EMBEDDING_CONCURRENCY = int(os.environ.get("LOCAL_EMBEDDING_CONCURRENCY", "1"))
+LOCAL_EMBEDDING_THREADS = int(os.environ.get("LOCAL_EMBEDDING_THREADS", "0")) or None
+# Model files: pre-populate this directory to run without network access
+LOCAL_EMBEDDING_CACHE_DIR = os.environ.get("LOCAL_EMBEDDING_CACHE_DIR", "/data/models")
+# Never try the network: fail at load when the model is not in the cache directory
+LOCAL_EMBEDDING_OFFLINE = os.environ.get("LOCAL_EMBEDDING_OFFLINE", "false").lower() in ("1", "true", "yes")
+
+
+def _fastembed_installed() -> bool:
+    return importlib.util.find_spec("fastembed") is not None
+
+
+class EmbeddingProvider:
+    """Embedding backend: one model, fixed dimension"""
+
+    name = "base"
+
+    def __init__(self, model: str, dim: int, concurrency: int, batch_size: int, batch_tokens: int):
+        self.model = model
+        self.dim = dim
+        self.dispatcher = EmbeddingDispatcher(
+            self.embed, concurrency=concurrency, batch_size=batch_size, batch_tokens=batch_tokens
+        )
+
+    @property
+    def model_id(self) -> str:
+        """Identifies the vector space (vectors of different ids are not comparable)"""
+        return f"{self.model}:{self.dim}"
+
+    def unavailable_reason(self) -> Optional[str]:
+        """Why the provider cannot embed right now, None when it can"""
+        return None
+
+    def warm_up(self) -> None:
+        """Prepare the provider before the first request (no-op by default)"""
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        """One provider call for a batch prepared by the dispatcher"""
+        raise NotImplementedError
+
+
+class OpenAIEmbeddingProvider(EmbeddingProvider):
+    """OpenAI embeddings API"""
+
+    name = "openai"
+
+    def __init__(self, get_client: Callable[[], Any], model: str, dim: int):
+        self._get_client = get_client
+        super().__init__(model, dim, EMBEDDING_CONCURRENCY, EMBEDDING_BATCH_SIZE, EMBEDDING_BATCH_TOKENS)
+
+    def unavailable_reason(self) -> Optional[str]:
+        return None if self._get_client() else "OPENAI_API_KEY is not set"
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        response = self._get_client().embeddings.create(model=self.model, input=texts, dimensions=self.dim)
+        return [embedding.embedding for embedding in response.data]
+
+
+class LocalEmbeddingProvider(EmbeddingProvider):
+    """fastembed ONNX model on CPU, loaded once"""
+
+    name = "local"
+
+    def __init__(
+        self,
+        model: str = LOCAL_EMBEDDING_MODEL,
+        dim: int = LOCAL_EMBEDDING_DIM,
+        batch_size: int = LOCAL_EMBEDDING_BATCH_SIZE,
+        concurrency: int = LOCAL_EMBEDDING_CONCURRENCY
+    ):
+        self._batch_size = batch_size
+        self._model = None
+        self._load_lock = threading.Lock()
+        # Inference batches are bounded by count only (the model truncates long texts)
+        super().__init__(model, dim, concurrency, batch_size, batch_tokens=10 ** 9)
+
+    def unavailable_reason(self) -> Optional[str]:
+        if self._model is None and not _fastembed_installed():
+            return "fastembed is not installed"
+        return None
+
+    def _load(self, offline: Optional[bool] = None):
+        from fastembed import TextEmbedding
+        return TextEmbedding(
+            model_name=self.model, cache_dir=LOCAL_EMBEDDING_CACHE_DIR, threads=LOCAL_EMBEDDING_THREADS,
+            local_files_only=LOCAL_EMBEDDING_OFFLINE if offline is None else offline
+        )
+
+    def _get_model(self):
+        if self._model is None:
+            with self._load_lock:
+                if self._model is None:
+                    logger.info(f"Loading local embedding model {self.model}")
+                    self._model = self._load()
+        return self._model
+
+    def warm_up(self) -> None:
+        self.embed(["warm-up"])
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        vectors = [vector.tolist() for vector in self._get_model().embed(texts, batch_size=self._batch_size)]
+        if vectors and len(vectors[0]) != self.dim:
+            raise RuntimeError(
+                f"{self.model} returns {len(vectors[0])}-d vectors, LOCAL_EMBEDDING_DIM is {self.dim}"
+            )
+        return vectors
+
+
+if __name__ == "__main__":
+    # Fetch the local model into LOCAL_EMBEDDING_CACHE_DIR (run once with network access)
+    provider = LocalEmbeddingProvider()
+    provider._model = provider._load(offline=False)
+    provider.warm_up()
+    logger.info(f"{provider.model} ready in {LOCAL_EMBEDDING_CACHE_DIR}")
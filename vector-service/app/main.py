@@ -1,53 +1,298 @@
+import asyncio
 import os
-from typing import List, Optional
+import re
+from typing import Any, Dict, List, Optional, Set, Tuple
 
 from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
-from qdrant_client import QdrantClient
-from qdrant_client.http.models import VectorParams, Distance, PointStruct
+from qdrant_client import AsyncQdrantClient
+from qdrant_client.http.models import (
+    CreateAlias,
+    CreateAliasOperation,
+    DeleteAlias,
+    DeleteAliasOperation,
+    Distance,
+    PointStruct,
+    VectorParams,
+)
 from openai import OpenAI
 from loguru import logger
 
+from app.embedding_cache import cache_key, get_embedding_cache
+from app.embedding_providers import EmbeddingProvider, LocalEmbeddingProvider, OpenAIEmbeddingProvider
+
 
 QDRANT_HOST = os.environ.get("QDRANT_HOST", "qdrant")
 QDRANT_PORT = int(os.environ.get("QDRANT_PORT", 6333))
-COLLECTION = "pdf_segments"
+QDRANT_GRPC_PORT = int(os.environ.get("QDRANT_GRPC_PORT", 6334))
+QDRANT_PREFER_GRPC = os.environ.get("QDRANT_PREFER_GRPC", "false").lower() in ("1", "true", "yes")
+QDRANT_TIMEOUT = int(os.environ.get("QDRANT_TIMEOUT", 30))  # Client default (seconds)
+QDRANT_SEARCH_TIMEOUT = float(os.environ.get("QDRANT_SEARCH_TIMEOUT", 5))
+QDRANT_UPSERT_TIMEOUT = float(os.environ.get("QDRANT_UPSERT_TIMEOUT", 60))
+COLLECTION = "pdf_segments"  # Alias of the collection built with the current embedding model
 OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
 EMBEDDING_MODEL = "text-embedding-3-small"  # OpenAI embedding model
+EMBEDDING_DIM = int(os.environ.get("EMBEDDING_DIMENSIONS", 1536))
+# "openai" or "local" (CPU model, no network on the search path); never inferred from the key
+EMBEDDING_PROVIDER = os.environ.get("EMBEDDING_PROVIDER", "openai").lower()
+if EMBEDDING_PROVIDER not in ("openai", "local"):
+    raise ValueError(f"EMBEDDING_PROVIDER must be 'openai' or 'local', not {EMBEDDING_PROVIDER!r}")
+# Model of the vectors stored in COLLECTION when it was still a plain collection
+LEGACY_MODEL_ID = f"{EMBEDDING_MODEL}:1536"
+MIGRATION_BATCH_SIZE = int(os.environ.get("COLLECTION_MIGRATION_BATCH_SIZE", 256))
+# Re-embed on a model change without waiting for POST /collections/migrate
+COLLECTION_AUTO_MIGRATE = os.environ.get("COLLECTION_AUTO_MIGRATE", "false").lower() in ("1", "true", "yes")
 
 app = FastAPI(title="Vector Service", version="0.1.0")
 
 # Initialize clients
 openai_client = OpenAI(api_key=OPENAI_API_KEY) if OPENAI_API_KEY else None
-qdrant_client = QdrantClient(host=QDRANT_HOST, port=QDRANT_PORT)
+# One async client for the process: its HTTP pool (or gRPC channel) is reused by every request
+qdrant_client = AsyncQdrantClient(
+    host=QDRANT_HOST,
+    port=QDRANT_PORT,
+    grpc_port=QDRANT_GRPC_PORT,
+    prefer_grpc=QDRANT_PREFER_GRPC,
+    timeout=QDRANT_TIMEOUT,
+)
+
+
+openai_provider = OpenAIEmbeddingProvider(lambda: openai_client, EMBEDDING_MODEL, EMBEDDING_DIM)
+embedding_provider: EmbeddingProvider = (
+    LocalEmbeddingProvider() if EMBEDDING_PROVIDER == "local" else openai_provider
+)
 
 
 def get_embeddings(texts: List[str]) -> List[List[float]]:
-    """Get embeddings using OpenAI API or fallback to local model"""
-    if not openai_client:
-        logger.warning("OpenAI API key not available, using mock embeddings")
-        # Return mock embeddings for testing
-        return [[0.1] * 1536 for _ in texts]
-    
+    """
+    Get embeddings from the configured provider (OpenAI API or local CPU model).
+    Cached vectors are reused; only the distinct missing texts go to the provider,
+    in bounded concurrent batches (a single query is coalesced with others).
+    """
+    provider = embedding_provider
+    reason = provider.unavailable_reason()
+    if reason:
+        logger.error(f"Embedding provider {provider.name} unavailable: {reason}")
+        raise HTTPException(status_code=503, detail=f"Embedding provider unavailable: {reason}")
+
+    cache = get_embedding_cache()
+    keys = [cache_key(provider.model, provider.dim, text) for text in texts]
+    vectors = {}
+    if cache is not None:
+        try:
+            vectors = cache.get_many(keys)
+        except Exception as e:
+            logger.warning(f"Embedding cache read failed: {e}")
+
+    missing = {key: text for key, text in zip(keys, texts) if key not in vectors}
+    if missing:
+        missing_texts = list(missing.values())
+        try:
+            if len(missing_texts) == 1:
+                fresh_vectors = [provider.dispatcher.embed_one(missing_texts[0])]
+            else:
+                fresh_vectors = provider.dispatcher.embed_many(missing_texts)
+        except Exception as e:
+            logger.error(f"Error getting embeddings from {provider.name}: {e}")
+            raise HTTPException(status_code=500, detail=f"Embedding error: {str(e)}")
+        fresh = dict(zip(missing, fresh_vectors))
+        vectors.update(fresh)
+        if cache is not None:
+            try:
+                cache.put_many(fresh.items())
+            except Exception as e:
+                logger.warning(f"Embedding cache write failed: {e}")
+
+    return [vectors[key] for key in keys]
+
+# Collection name -> vector size, filled by the first check (or creation) and
+# kept until a Qdrant error or POST /collections/refresh
+_collection_state: Dict[str, Optional[int]] = {}
+_collection_lock = asyncio.Lock()
+
+# Re-embedding of the collection after an embedding model change
+_migration: Dict[str, Any] = {"state": "idle"}
+_migration_task: Optional[asyncio.Task] = None
+# Point ids written by /index into the target during a migration (not overwritten by the copy)
+_migration_written: Set[int] = set()
+
+
+def invalidate_collection_cache():
+    """Forget the cached collection state: the next request checks Qdrant again"""
+    _collection_state.clear()
+
+
+def model_collection(model_id: str) -> str:
+    """Physical collection holding the vectors of one embedding model"""
+    slug = re.sub(r"[^a-z0-9]+", "_", model_id.lower()).strip("_")
+    return f"{COLLECTION}__{slug}"
+
+
+def _migration_running() -> bool:
+    return _migration_task is not None and not _migration_task.done()
+
+
+async def _collection_vector_size(name: str) -> Optional[int]:
     try:
-        response = openai_client.embeddings.create(
-            model=EMBEDDING_MODEL,
-            input=texts
-        )
-        return [embedding.embedding for embedding in response.data]
+        size = (await qdrant_client.get_collection(name)).config.params.vectors.size
+        return size if isinstance(size, int) else None
     except Exception as e:
-        logger.error(f"Error getting embeddings from OpenAI: {e}")
-        raise HTTPException(status_code=500, detail=f"Embedding error: {str(e)}")
-
-def ensure_collection(dim: int):
-    existing = qdrant_client.get_collections()
-    names = [c.name for c in existing.collections]
-    if COLLECTION not in names:
-        qdrant_client.create_collection(
-            collection_name=COLLECTION,
-            vectors_config=VectorParams(size=dim, distance=Distance.COSINE),
+        logger.warning(f"Could not read vector config of {name}: {e}")
+        return None
+
+
+async def _alias_target(alias: str) -> Optional[str]:
+    for description in (await qdrant_client.get_aliases()).aliases:
+        if description.alias_name == alias:
+            return description.collection_name
+    return None
+
+
+async def _collections() -> Tuple[List[str], Optional[str]]:
+    """Existing collections, and the one COLLECTION currently resolves to"""
+    existing = [c.name for c in (await qdrant_client.get_collections()).collections]
+    current = await _alias_target(COLLECTION)
+    if current is None and COLLECTION in existing:
+        current = COLLECTION  # Created before per-model collections
+    return existing, current
+
+
+def _matches_provider(current: str) -> bool:
+    return current == model_collection(embedding_provider.model_id) or (
+        current == COLLECTION and embedding_provider.model_id == LEGACY_MODEL_ID
+    )
+
+
+async def _create_collection(name: str, dim: int, existing: List[str] = ()):
+    """Create the collection unless it exists (an earlier or failed migration: upserted over)"""
+    if name in existing:
+        return
+    await qdrant_client.create_collection(
+        collection_name=name,
+        vectors_config=VectorParams(size=dim, distance=Distance.COSINE),
+    )
+    logger.info(f"Created collection {name} with dimension {dim}")
+
+
+async def _scroll(name: str, with_vectors: bool):
+    """Batches of points of a collection"""
+    offset = None
+    while True:
+        records, offset = await qdrant_client.scroll(
+            collection_name=name, limit=MIGRATION_BATCH_SIZE, offset=offset,
+            with_payload=True, with_vectors=with_vectors
+        )
+        if records:
+            yield records
+        if offset is None:
+            return
+
+
+def _alias_to(name: str, replace: bool) -> list:
+    create = CreateAliasOperation(create_alias=CreateAlias(collection_name=name, alias_name=COLLECTION))
+    if not replace:
+        return [create]
+    return [DeleteAliasOperation(delete_alias=DeleteAlias(alias_name=COLLECTION)), create]
+
+
+async def start_migration(current: str, dim: int, existing: List[str]) -> str:
+    """Create the collection of the current model and re-embed into it in the background"""
+    global _migration_task
+    target = model_collection(embedding_provider.model_id)
+    await _create_collection(target, dim, existing)
+    _migration.clear()
+    _migration.update(state="running", source=current, target=target, migrated=0)
+    _migration_written.clear()
+    invalidate_collection_cache()
+    _migration_task = asyncio.create_task(migrate_collection(current, target, dim, existing))
+    return target
+
+
+async def migrate_collection(source: str, target: str, dim: int, existing: List[str]):
+    """
+    Re-embed the segments of source with the current model into target (already
+    created), then point COLLECTION at target. The source collection is kept
+    until POST /collections/cleanup: switching back only moves the alias again.
+    """
+    logger.info(f"Migrating {source} to {target} ({embedding_provider.model_id})")
+    try:
+        if source == COLLECTION:
+            # A collection and an alias cannot share a name: the plain collection is
+            # first copied as is to the collection of its model
+            archive = model_collection(LEGACY_MODEL_ID)
+            await _create_collection(archive, await _collection_vector_size(source) or 1536, existing)
+            async for records in _scroll(source, with_vectors=True):
+                await qdrant_client.upsert(collection_name=archive, wait=True, points=[
+                    PointStruct(id=record.id, vector=record.vector, payload=record.payload) for record in records
+                ])
+            await qdrant_client.delete_collection(source)
+            await qdrant_client.update_collection_aliases(change_aliases_operations=_alias_to(archive, replace=False))
+            source = _migration["source"] = archive
+
+        async for records in _scroll(source, with_vectors=False):
+            records = [
+                record for record in records
+                if (record.payload or {}).get("text") and record.id not in _migration_written
+            ]
+            if records:
+                vectors = await asyncio.to_thread(get_embeddings, [record.payload["text"] for record in records])
+                # Re-check: /index may have written some of these points while embedding
+                points = [
+                    PointStruct(id=record.id, vector=vector, payload=record.payload)
+                    for record, vector in zip(records, vectors) if record.id not in _migration_written
+                ]
+                await qdrant_client.upsert(collection_name=target, wait=True, points=points)
+                _migration["migrated"] += len(points)
+
+        await qdrant_client.update_collection_aliases(change_aliases_operations=_alias_to(target, replace=True))
+        _collection_state[COLLECTION] = dim
+        _migration["state"] = "done"
+        logger.info(
+            f"Migrated {_migration['migrated']} segments to {target}; "
+            f"{source} kept until POST /collections/cleanup"
         )
-        logger.info(f"Created collection {COLLECTION} with dimension {dim}")
+    except Exception as e:
+        _migration.update(state="failed", error=str(e))
+        logger.error(f"Collection migration to {target} failed (retry: POST /collections/migrate): {e}")
+    finally:
+        _migration_written.clear()
+
+
+async def ensure_collection(dim: int):
+    """
+    Make sure COLLECTION holds vectors of the current embedding model; checked
+    against Qdrant once, then cached. A missing collection is created. One built
+    with another model is only migrated on POST /collections/migrate (or with
+    COLLECTION_AUTO_MIGRATE): until then searches get a 503.
+    """
+    if COLLECTION in _collection_state:
+        return
+    async with _collection_lock:
+        if COLLECTION in _collection_state:
+            return
+        if _migration_running():
+            raise HTTPException(status_code=503, detail="Collection migration in progress")
+
+        existing, current = await _collections()
+        if current is None:
+            target = model_collection(embedding_provider.model_id)
+            await _create_collection(target, dim, existing)
+            await qdrant_client.update_collection_aliases(change_aliases_operations=_alias_to(target, replace=False))
+            size = dim
+        elif _matches_provider(current):
+            size = await _collection_vector_size(current)
+        elif COLLECTION_AUTO_MIGRATE:
+            await start_migration(current, dim, existing)
+            raise HTTPException(status_code=503, detail="Collection migration in progress")
+        else:
+            logger.error(f"{COLLECTION} ({current}) was not built with {embedding_provider.model_id}")
+            raise HTTPException(
+                status_code=503,
+                detail=f"Collection {current} was built with another embedding model: POST /collections/migrate"
+            )
+        if size is not None and size != dim:
+            logger.warning(f"Collection {COLLECTION} has dimension {size}, embeddings have {dim}")
+        _collection_state[COLLECTION] = size
 
 
 class UpsertPayload(BaseModel):
@@ -60,30 +305,107 @@ class SearchPayload(BaseModel):
     top_k: int | None = 5
 
 
+@app.on_event("startup")
+async def startup_event():
+    """Check the collection once so the first search does not pay for it"""
+    transport = "gRPC" if QDRANT_PREFER_GRPC else "REST"
+    logger.info(f"Qdrant client: {QDRANT_HOST} over {transport}")
+    logger.info(f"Embedding provider: {embedding_provider.name} ({embedding_provider.model_id})")
+    try:
+        # Local model: loaded now rather than on the first search
+        await asyncio.to_thread(embedding_provider.warm_up)
+    except Exception as e:
+        logger.error(f"Embedding provider warm-up failed: {e}")
+    try:
+        await ensure_collection(embedding_provider.dim)
+    except Exception as e:
+        logger.warning(f"Qdrant collection check deferred: {e}")
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await qdrant_client.close()
+
+
 @app.get("/health")
 def health():
     return {"status": "ok"}
 
 
+@app.get("/metrics")
+def metrics():
+    """Embedding cache counters (per process), provider and collection migration state"""
+    cache = get_embedding_cache()
+    return {
+        "embedding_cache": cache.stats() if cache is not None else None,
+        "embedding_provider": {"name": embedding_provider.name, "model": embedding_provider.model_id},
+        "collection_migration": dict(_migration),
+    }
+
+
 @app.get("/collections")
-def collections():
+async def collections():
     """Get information about all collections"""
     try:
-        return qdrant_client.get_collections().dict()
+        return (await qdrant_client.get_collections()).dict()
     except Exception as e:
         logger.error(f"Error getting collections: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/collections/refresh")
+async def refresh_collections():
+    """Admin: re-read the collection state from Qdrant (after an external change)"""
+    invalidate_collection_cache()
+    try:
+        await ensure_collection(embedding_provider.dim)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error refreshing collection state: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+    return {"collection": COLLECTION, "vector_size": _collection_state.get(COLLECTION)}
+
+
+@app.post("/collections/migrate", status_code=202)
+async def migrate_collections():
+    """Admin: rebuild the collection with the current embedding model (background)"""
+    async with _collection_lock:
+        if not _migration_running():
+            existing, current = await _collections()
+            if current is None or _matches_provider(current):
+                return {"collection": COLLECTION, "state": "up to date"}
+            await start_migration(current, embedding_provider.dim, existing)
+    return {"collection": COLLECTION, **_migration}
+
+
+@app.post("/collections/cleanup")
+async def cleanup_collections():
+    """Admin: delete the per-model collections kept after migrations (not the active one)"""
+    if _migration_running():
+        raise HTTPException(status_code=409, detail="Collection migration in progress")
+    existing, current = await _collections()
+    stale = [name for name in existing if name.startswith(f"{COLLECTION}__") and name != current]
+    for name in stale:
+        await qdrant_client.delete_collection(name)
+        logger.info(f"Deleted collection {name}")
+    return {"deleted": stale}
+
+
 @app.post("/index")
-def upsert_embedding(payload: UpsertPayload):
+async def upsert_embedding(payload: UpsertPayload):
     """Index document segments with embeddings"""
     try:
-        # Get embeddings from OpenAI
-        embeddings = get_embeddings(payload.segments)
-        embedding_dim = len(embeddings[0]) if embeddings else 1536
+        # Blocking provider calls and cache: worker thread
+        embeddings = await asyncio.to_thread(get_embeddings, payload.segments)
+        embedding_dim = len(embeddings[0]) if embeddings else embedding_provider.dim
         
-        ensure_collection(embedding_dim)
+        if _migration_running():
+            # Vectors of the new model: written to the collection being built, not to the old one
+            collection = _migration["target"]
+        else:
+            await ensure_collection(embedding_dim)
+            collection = COLLECTION
         
         points = []
         base_id = payload.doc_id * 1000000
@@ -102,30 +424,44 @@ def upsert_embedding(payload: UpsertPayload):
                 )
             )
         
-        qdrant_client.upsert(collection_name=COLLECTION, wait=True, points=points)
+        if collection != COLLECTION:
+            _migration_written.update(point.id for point in points)
+        await asyncio.wait_for(
+            qdrant_client.upsert(collection_name=collection, wait=True, points=points),
+            timeout=QDRANT_UPSERT_TIMEOUT
+        )
         logger.info(f"Successfully indexed {len(points)} segments for document {payload.doc_id}")
         
         return {"upserted": len(points), "embedding_dim": embedding_dim}
         
+    except asyncio.TimeoutError:
+        logger.error(f"Qdrant upsert timed out after {QDRANT_UPSERT_TIMEOUT}s (document {payload.doc_id})")
+        raise HTTPException(status_code=504, detail="Vector store timeout")
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error upserting embeddings: {e}")
+        invalidate_collection_cache()
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.post("/search")
-def search(payload: SearchPayload):
+async def search(payload: SearchPayload):
     """Search for similar document segments"""
     try:
         # Get query embedding
-        query_embeddings = get_embeddings([payload.query])
+        query_embeddings = await asyncio.to_thread(get_embeddings, [payload.query])
         query_vec = query_embeddings[0]
         
-        ensure_collection(len(query_vec))
+        await ensure_collection(len(query_vec))
         
-        results = qdrant_client.search(
-            collection_name=COLLECTION, 
-            query_vector=query_vec, 
-            limit=payload.top_k or 5
+        results = await asyncio.wait_for(
+            qdrant_client.search(
+                collection_name=COLLECTION, 
+                query_vector=query_vec, 
+                limit=payload.top_k or 5
+            ),
+            timeout=QDRANT_SEARCH_TIMEOUT
         )
         
         return [
@@ -138,13 +474,19 @@ def search(payload: SearchPayload):
             for r in results
         ]
         
+    except asyncio.TimeoutError:
+        logger.error(f"Qdrant search timed out after {QDRANT_SEARCH_TIMEOUT}s")
+        raise HTTPException(status_code=504, detail="Vector store timeout")
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error searching: {e}")
+        invalidate_collection_cache()
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/upsert_embedding")
-def upsert_embedding_legacy(payload: UpsertPayload):
+async def upsert_embedding_legacy(payload: UpsertPayload):
     """Legacy endpoint for backward compatibility"""
-    return upsert_embedding(payload)
+    return await upsert_embedding(payload)
 
 
@@ -1,26 +1,81 @@
+import asyncio
+
+import numpy as np
 import pytest
 from fastapi.testclient import TestClient
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch, AsyncMock, MagicMock
 
-from app.main import app
+import app.main as main
+from app.main import app, invalidate_collection_cache
+from app.embedding_cache import EmbeddingCache
 
 client = TestClient(app)
 
+
+def async_qdrant():
+    """Mock of the async Qdrant client (awaited calls return plain mocks)"""
+    mock = AsyncMock()
+    mock.get_collections.return_value = MagicMock()
+    mock.get_collection.return_value = MagicMock()
+    mock.get_aliases.return_value = MagicMock(aliases=[])
+    mock.scroll.return_value = ([], None)
+    return mock
+
+
+class FakeOnnxModel:
+    """Stands in for a fastembed model: one vector per text, records inference batches"""
+
+    def __init__(self, dim):
+        self.dim = dim
+        self.batches = []
+
+    def embed(self, texts, batch_size=256):
+        texts = list(texts)
+        for start in range(0, len(texts), batch_size):
+            batch = texts[start:start + batch_size]
+            self.batches.append(len(batch))
+            for text in batch:
+                yield np.full(self.dim, len(text) / 100, dtype=np.float32)
+
+
+@pytest.fixture(autouse=True)
+def embedding_cache():
+    """Fresh in-memory embedding cache (and unknown collection state) for each test"""
+    invalidate_collection_cache()
+    cache = EmbeddingCache(path=":memory:")
+    with patch('app.main.get_embedding_cache', return_value=cache), \
+         patch('app.main.embedding_provider', main.openai_provider), \
+         patch('app.main._migration', {"state": "idle"}), \
+         patch('app.main._migration_task', None):
+        yield cache
+
+
+@pytest.fixture
+def local_provider():
+    """Local CPU provider backed by a fake ONNX model (8 dimensions, batches of 4)"""
+    from app.embedding_providers import LocalEmbeddingProvider
+
+    provider = LocalEmbeddingProvider(model="test/local-model", dim=8, batch_size=4)
+    with patch.object(provider, '_load', return_value=FakeOnnxModel(8)), \
+         patch('app.embedding_providers._fastembed_installed', return_value=True), \
+         patch('app.main.embedding_provider', provider):
+        yield provider
+
 def test_health():
     response = client.get("/health")
     assert response.status_code == 200
     assert response.json()["status"] == "ok"
 
-@patch('app.main.qdrant_client')
+@patch('app.main.qdrant_client', new_callable=async_qdrant)
 def test_collections(mock_qdrant):
     mock_qdrant.get_collections.return_value.dict.return_value = {"collections": []}
     
     response = client.get("/collections")
     assert response.status_code == 200
 
-@patch('app.main.openai_client', None)  # Test without OpenAI
-@patch('app.main.qdrant_client')
-def test_index_without_openai(mock_qdrant):
+@patch('app.main.openai_client', None)  # Test without OpenAI: local model
+@patch('app.main.qdrant_client', new_callable=async_qdrant)
+def test_index_without_openai(mock_qdrant, local_provider):
     mock_qdrant.get_collections.return_value.collections = []
     mock_qdrant.upsert.return_value = None
     
@@ -33,10 +88,13 @@ def test_index_without_openai(mock_qdrant):
     assert response.status_code == 200
     data = response.json()
     assert data["upserted"] == 2
-    assert data["embedding_dim"] == 1536  # Mock embedding dimension
+    assert data["embedding_dim"] == 8  # Local model dimension
+    # Points go through the alias, backed by the collection of the local model
+    assert mock_qdrant.upsert.call_args.kwargs["collection_name"] == "pdf_segments"
+    assert mock_qdrant.create_collection.call_args.kwargs["collection_name"] == "pdf_segments__test_local_model_8"
 
 @patch('app.main.openai_client')
-@patch('app.main.qdrant_client')
+@patch('app.main.qdrant_client', new_callable=async_qdrant)
 def test_index_with_openai(mock_qdrant, mock_openai):
     # Mock OpenAI response
     mock_embedding_response = MagicMock()
@@ -61,9 +119,9 @@ def test_index_with_openai(mock_qdrant, mock_openai):
     assert data["upserted"] == 2
     assert data["embedding_dim"] == 1536
 
-@patch('app.main.openai_client', None)  # Test without OpenAI
-@patch('app.main.qdrant_client')
-def test_search_without_openai(mock_qdrant):
+@patch('app.main.openai_client', None)  # Test without OpenAI: local model
+@patch('app.main.qdrant_client', new_callable=async_qdrant)
+def test_search_without_openai(mock_qdrant, local_provider):
     # Mock search results
     mock_result = MagicMock()
     mock_result.score = 0.95
@@ -81,9 +139,10 @@ def test_search_without_openai(mock_qdrant):
     assert len(data) == 1
     assert data[0]["text"] == "Test result"
     assert data[0]["score"] == 0.95
+    assert len(mock_qdrant.search.call_args.kwargs["query_vector"]) == 8
 
 @patch('app.main.openai_client')
-@patch('app.main.qdrant_client')
+@patch('app.main.qdrant_client', new_callable=async_qdrant)
 def test_search_with_openai(mock_qdrant, mock_openai):
     # Mock OpenAI response
     mock_embedding_response = MagicMock()
@@ -108,14 +167,14 @@ def test_search_with_openai(mock_qdrant, mock_openai):
     assert data[0]["text"] == "Test result"
 
 def test_get_embeddings_function():
+    from fastapi import HTTPException
     from app.main import get_embeddings
     
-    # Test with no OpenAI client (should return mock embeddings)
+    # OpenAI provider without a key: an error, never placeholder vectors
     with patch('app.main.openai_client', None):
-        embeddings = get_embeddings(["test"])
-        assert len(embeddings) == 1
-        assert len(embeddings[0]) == 1536
-        assert all(x == 0.1 for x in embeddings[0])
+        with pytest.raises(HTTPException) as error:
+            get_embeddings(["test"])
+        assert error.value.status_code == 503
 
 @patch('app.main.openai_client')
 def test_get_embeddings_with_openai(mock_openai):
@@ -131,27 +190,28 @@ def test_get_embeddings_with_openai(mock_openai):
     assert len(embeddings[0]) == 1536
     assert all(x == 0.5 for x in embeddings[0])
 
-@patch('app.main.qdrant_client')
+@patch('app.main.qdrant_client', new_callable=async_qdrant)
 def test_ensure_collection(mock_qdrant):
     from app.main import ensure_collection
     
     # Test collection doesn't exist
     mock_qdrant.get_collections.return_value.collections = []
-    ensure_collection(1536)
-    mock_qdrant.create_collection.assert_called_once()
+    asyncio.run(ensure_collection(1536))
+    mock_qdrant.create_collection.assert_awaited_once()
     
-    # Test collection exists
+    # Test collection exists (state re-read from Qdrant)
     mock_qdrant.reset_mock()
+    invalidate_collection_cache()
     mock_collection = MagicMock()
     mock_collection.name = "pdf_segments"
     mock_qdrant.get_collections.return_value.collections = [mock_collection]
-    ensure_collection(1536)
+    asyncio.run(ensure_collection(1536))
     mock_qdrant.create_collection.assert_not_called()
 
-def test_legacy_endpoint():
+def test_legacy_endpoint(local_provider):
     """Test backward compatibility endpoint"""
     with patch('app.main.openai_client', None), \
-         patch('app.main.qdrant_client') as mock_qdrant:
+         patch('app.main.qdrant_client', new_callable=async_qdrant) as mock_qdrant:
         
         mock_qdrant.get_collections.return_value.collections = []
         mock_qdrant.upsert.return_value = None
@@ -163,3 +223,355 @@ def test_legacy_endpoint():
         
         response = client.post("/upsert_embedding", json=payload)
         assert response.status_code == 200
+
+
+def _embedding_response(vectors):
+    response = MagicMock()
+    response.data = [MagicMock(embedding=vector) for vector in vectors]
+    return response
+
+
+@patch('app.main.openai_client')
+def test_get_embeddings_only_sends_cache_misses(mock_openai, embedding_cache):
+    from app.main import get_embeddings
+
+    mock_openai.embeddings.create.return_value = _embedding_response([[0.5] * 4, [0.25] * 4])
+    assert get_embeddings(["alpha", "beta"]) == [[0.5] * 4, [0.25] * 4]
+
+    mock_openai.embeddings.create.reset_mock()
+    mock_openai.embeddings.create.return_value = _embedding_response([[0.75] * 4])
+    embeddings = get_embeddings(["beta", "gamma", "gamma", "alpha"])
+
+    # Only the distinct miss goes to the provider, in one batch
+    mock_openai.embeddings.create.assert_called_once()
+    assert mock_openai.embeddings.create.call_args.kwargs["input"] == ["gamma"]
+    assert embeddings == [[0.25] * 4, [0.75] * 4, [0.75] * 4, [0.5] * 4]
+
+    stats = embedding_cache.stats()
+    assert stats["hits"] == 2
+    assert stats["misses"] == 3
+    assert stats["entries"] == 3
+
+
+@patch('app.main.openai_client')
+def test_metrics_reports_embedding_cache_hit_ratio(mock_openai):
+    mock_openai.embeddings.create.return_value = _embedding_response([[0.5] * 4])
+    from app.main import get_embeddings
+    get_embeddings(["query"])
+    get_embeddings(["query"])
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.json()["embedding_cache"]["hit_ratio"] == 0.5
+
+
+def test_embedding_cache_evicts_least_recently_used():
+    cache = EmbeddingCache(path=":memory:", max_entries=2)
+    cache.put_many([("a", [1.0]), ("b", [2.0])])
+    cache.get_many(["a"])  # "b" becomes the least recently used
+    cache.put_many([("c", [3.0])])
+
+    assert set(cache.get_many(["a", "b", "c"])) == {"a", "c"}
+
+
+def test_make_batches_bounds_items_and_tokens():
+    from app.embedding_dispatcher import make_batches
+
+    texts = ["x" * 400] * 10  # ~101 tokens each
+    batches = make_batches(texts, max_items=4, max_tokens=250)
+    assert [len(batch) for batch in batches] == [2, 2, 2, 2, 2]
+    assert [len(batch) for batch in make_batches(texts, max_items=4, max_tokens=10_000)] == [4, 4, 2]
+    assert sum(batches, []) == texts
+
+
+def test_dispatcher_runs_batches_concurrently_in_order():
+    import threading
+    import time
+    from app.embedding_dispatcher import EmbeddingDispatcher
+
+    active = {"now": 0, "max": 0}
+    lock = threading.Lock()
+
+    def slow_embed(batch):
+        with lock:
+            active["now"] += 1
+            active["max"] = max(active["max"], active["now"])
+        time.sleep(0.05)
+        with lock:
+            active["now"] -= 1
+        return [[float(text)] for text in batch]
+
+    dispatcher = EmbeddingDispatcher(slow_embed, concurrency=3, batch_size=10)
+    vectors = dispatcher.embed_many([str(i) for i in range(60)])
+
+    assert vectors == [[float(i)] for i in range(60)]
+    assert active["max"] == 3
+
+
+def test_dispatcher_coalesces_concurrent_queries():
+    import threading
+    import time
+    from app.embedding_dispatcher import EmbeddingDispatcher
+
+    calls = []
+
+    def slow_embed(batch):
+        calls.append(list(batch))
+        time.sleep(0.05)
+        return [[float(text)] for text in batch]
+
+    dispatcher = EmbeddingDispatcher(slow_embed, concurrency=4, coalesce_ms=20)
+    results = {}
+
+    def query(i):
+        results[i] = dispatcher.embed_one(str(i))
+
+    threads = [threading.Thread(target=query, args=(i,)) for i in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == {i: [float(i)] for i in range(20)}
+    assert len(calls) < 20
+
+
+@patch('app.main.openai_client', None)
+@patch('app.main.qdrant_client', new_callable=async_qdrant)
+def test_search_checks_collection_once(mock_qdrant, local_provider):
+    mock_qdrant.get_collections.return_value.collections = []
+    mock_qdrant.search.return_value = []
+
+    for _ in range(3):
+        assert client.post("/search", json={"query": "test query"}).status_code == 200
+
+    mock_qdrant.get_collections.assert_called_once()
+    mock_qdrant.create_collection.assert_called_once()
+    assert mock_qdrant.search.call_count == 3
+
+
+@patch('app.main.openai_client', None)
+@patch('app.main.qdrant_client', new_callable=async_qdrant)
+def test_qdrant_error_revalidates_collection(mock_qdrant, local_provider):
+    mock_qdrant.get_collections.return_value.collections = []
+    mock_qdrant.search.side_effect = [Exception("Not found: Collection `pdf_segments` doesn't exist!"), []]
+
+    assert client.post("/search", json={"query": "test query"}).status_code == 500
+    assert client.post("/search", json={"query": "test query"}).status_code == 200
+    assert mock_qdrant.get_collections.call_count == 2
+
+
+@patch('app.main.qdrant_client', new_callable=async_qdrant)
+def test_refresh_collections(mock_qdrant):
+    existing = MagicMock()
+    existing.name = "pdf_segments"
+    mock_qdrant.get_collections.return_value.collections = [existing]
+    mock_qdrant.get_collection.return_value.config.params.vectors.size = 1536
+
+    response = client.post("/collections/refresh")
+    assert response.status_code == 200
+    assert response.json() == {"collection": "pdf_segments", "vector_size": 1536}
+
+    client.post("/collections/refresh")
+    assert mock_qdrant.get_collections.call_count == 2
+    mock_qdrant.create_collection.assert_not_called()
+
+
+@patch('app.main.openai_client', None)
+@patch('app.main.QDRANT_SEARCH_TIMEOUT', 0.05)
+@patch('app.main.qdrant_client', new_callable=async_qdrant)
+def test_search_timeout_returns_504(mock_qdrant, local_provider):
+    async def slow_search(**kwargs):
+        await asyncio.sleep(1)
+        return []
+
+    mock_qdrant.get_collections.return_value.collections = []
+    mock_qdrant.search.side_effect = slow_search
+
+    response = client.post("/search", json={"query": "test query"})
+    assert response.status_code == 504
+
+
+@patch('app.main.openai_client', None)
+@patch('app.main.qdrant_client', new_callable=async_qdrant)
+def test_concurrent_searches_share_the_event_loop(mock_qdrant, local_provider):
+    import time
+    from app.main import search, SearchPayload
+
+    async def slow_search(**kwargs):
+        await asyncio.sleep(0.2)
+        return []
+
+    mock_qdrant.get_collections.return_value.collections = []
+    mock_qdrant.search.side_effect = slow_search
+
+    async def run():
+        start = time.perf_counter()
+        await asyncio.gather(*(search(SearchPayload(query=f"q{i}")) for i in range(20)))
+        return time.perf_counter() - start
+
+    # Searches wait on Qdrant concurrently instead of one after another
+    assert asyncio.run(run()) < 1.0
+    assert mock_qdrant.search.await_count == 20
+    mock_qdrant.get_collections.assert_awaited_once()
+
+
+def test_local_provider_loads_model_once_and_batches(local_provider):
+    vectors = local_provider.dispatcher.embed_many([f"segment {i}" for i in range(10)])
+    local_provider.dispatcher.embed_one("query")
+
+    assert len(vectors) == 10 and all(len(vector) == 8 for vector in vectors)
+    local_provider._load.assert_called_once()
+    assert local_provider._load.return_value.batches == [4, 4, 2, 1]
+
+
+def test_local_provider_rejects_wrong_dimension():
+    from app.embedding_providers import LocalEmbeddingProvider
+
+    provider = LocalEmbeddingProvider(model="test/local-model", dim=16)
+    with patch.object(provider, '_load', return_value=FakeOnnxModel(8)):
+        with pytest.raises(RuntimeError):
+            provider.embed(["text"])
+
+
+def test_local_provider_reports_missing_fastembed():
+    from app.embedding_providers import LocalEmbeddingProvider
+
+    with patch('app.embedding_providers._fastembed_installed', return_value=False):
+        assert LocalEmbeddingProvider().unavailable_reason() == "fastembed is not installed"
+
+
+def _legacy_collection(mock_qdrant):
+    """Plain "pdf_segments" collection built with the OpenAI model"""
+    legacy = MagicMock()
+    legacy.name = "pdf_segments"
+    mock_qdrant.get_collections.return_value.collections = [legacy]
+    mock_qdrant.get_collection.return_value.config.params.vectors.size = 1536
+    return [
+        MagicMock(id=i, vector=[0.1] * 1536, payload={"text": f"segment {i}", "doc_id": 1}) for i in range(3)
+    ]
+
+
+@patch('app.main.qdrant_client', new_callable=async_qdrant)
+def test_model_change_requires_explicit_migration(mock_qdrant, local_provider):
+    from fastapi import HTTPException
+    from app.main import ensure_collection
+
+    _legacy_collection(mock_qdrant)
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(ensure_collection(8))
+
+    assert error.value.status_code == 503
+    assert "/collections/migrate" in error.value.detail
+    mock_qdrant.scroll.assert_not_called()
+    mock_qdrant.create_collection.assert_not_called()
+    mock_qdrant.delete_collection.assert_not_called()
+
+
+@patch('app.main.qdrant_client', new_callable=async_qdrant)
+def test_migration_keeps_source_collection(mock_qdrant, local_provider):
+    from app.main import ensure_collection, migrate_collections
+
+    records = _legacy_collection(mock_qdrant)
+    # Copy of the plain collection (vectors as is), then re-embedding of that copy
+    mock_qdrant.scroll.side_effect = [(records[:2], 2), (records[2:], None), (records[:2], 2), (records[2:], None)]
+
+    async def run():
+        assert (await migrate_collections())["state"] == "running"
+        await main._migration_task
+        await ensure_collection(8)  # Cached by the migration: no further Qdrant calls
+
+    asyncio.run(run())
+
+    archive, target = "pdf_segments__text_embedding_3_small_1536", "pdf_segments__test_local_model_8"
+    created = [call.kwargs["collection_name"] for call in mock_qdrant.create_collection.call_args_list]
+    assert created == [target, archive]
+    upserts = {}
+    for call in mock_qdrant.upsert.call_args_list:
+        upserts.setdefault(call.kwargs["collection_name"], []).extend(call.kwargs["points"])
+    assert [point.vector for point in upserts[archive]] == [[0.1] * 1536] * 3
+    assert [point.id for point in upserts[target]] == [0, 1, 2]
+    assert all(len(point.vector) == 8 for point in upserts[target])
+    # Only the plain collection is dropped (its name becomes the alias); the copy is kept
+    mock_qdrant.delete_collection.assert_awaited_once_with("pdf_segments")
+    alias = mock_qdrant.update_collection_aliases.call_args.kwargs["change_aliases_operations"][-1]
+    assert (alias.create_alias.alias_name, alias.create_alias.collection_name) == ("pdf_segments", target)
+    assert main._migration["state"] == "done" and main._migration["migrated"] == 3
+
+
+@patch('app.main.openai_client', None)
+@patch('app.main.qdrant_client', new_callable=async_qdrant)
+def test_index_during_migration_writes_to_target(mock_qdrant, local_provider):
+    from app.main import migrate_collections, upsert_embedding, UpsertPayload
+
+    source = MagicMock(alias_name="pdf_segments", collection_name="pdf_segments__text_embedding_3_small_1536")
+    mock_qdrant.get_aliases.return_value = MagicMock(aliases=[source])
+    records = [MagicMock(id=i, payload={"text": f"old {i}", "doc_id": 0}) for i in range(2)]
+    records.append(MagicMock(id=5_000_000, payload={"text": "old version", "doc_id": 5}))
+    released = asyncio.Event()
+
+    async def slow_scroll(**kwargs):
+        await released.wait()
+        return records, None
+
+    mock_qdrant.scroll.side_effect = slow_scroll
+
+    async def run():
+        await migrate_collections()
+        response = await upsert_embedding(UpsertPayload(doc_id=5, segments=["new version"]))
+        released.set()
+        await main._migration_task
+        return response
+
+    assert asyncio.run(run())["upserted"] == 1
+
+    target = "pdf_segments__test_local_model_8"
+    first, migrated = mock_qdrant.upsert.call_args_list
+    assert first.kwargs["collection_name"] == target
+    assert [point.payload["text"] for point in first.kwargs["points"]] == ["new version"]
+    # The copy does not overwrite the point indexed meanwhile
+    assert [point.id for point in migrated.kwargs["points"]] == [0, 1]
+    mock_qdrant.delete_collection.assert_not_called()
+
+
+@patch('app.main.qdrant_client', new_callable=async_qdrant)
+def test_cleanup_deletes_only_inactive_collections(mock_qdrant):
+    names = ["pdf_segments__text_embedding_3_small_1536", "pdf_segments__test_local_model_8", "other"]
+    mock_qdrant.get_collections.return_value.collections = [MagicMock() for _ in names]
+    for collection, name in zip(mock_qdrant.get_collections.return_value.collections, names):
+        collection.name = name
+    active = MagicMock(alias_name="pdf_segments", collection_name="pdf_segments__test_local_model_8")
+    mock_qdrant.get_aliases.return_value = MagicMock(aliases=[active])
+
+    response = client.post("/collections/cleanup")
+    assert response.json() == {"deleted": ["pdf_segments__text_embedding_3_small_1536"]}
+    mock_qdrant.delete_collection.assert_awaited_once_with("pdf_segments__text_embedding_3_small_1536")
+
+
+@patch('app.main.qdrant_client', new_callable=async_qdrant)
+def test_same_model_keeps_legacy_collection(mock_qdrant):
+    from app.main import ensure_collection
+
+    legacy = MagicMock()
+    legacy.name = "pdf_segments"
+    mock_qdrant.get_collections.return_value.collections = [legacy]
+
+    asyncio.run(ensure_collection(1536))
+    mock_qdrant.scroll.assert_not_called()
+    mock_qdrant.create_collection.assert_not_called()
+
+
+def test_metrics_reports_embedding_provider(local_provider):
+    response = client.get("/metrics")
+    assert response.json()["embedding_provider"] == {"name": "local", "model": "test/local-model:8"}
+
+
+def test_local_provider_offline_never_downloads():
+    from app.embedding_providers import LocalEmbeddingProvider
+
+    provider = LocalEmbeddingProvider(model="test/local-model", dim=8)
+    with patch('fastembed.TextEmbedding') as text_embedding, \
+         patch('app.embedding_providers.LOCAL_EMBEDDING_OFFLINE', True):
+        provider._load()
+        provider._load(offline=False)  # python -m app.embedding_providers
+    assert [c.kwargs["local_files_only"] for c in text_embedding.call_args_list] == [True, False]